@@ -0,0 +1,90 @@
+import argparse
+import datetime
+import time
+from queue import Queue
+from typing import List
+
+from telegram import Bot, Chat, Message, Update, User
+from telegram.ext import CallbackContext
+
+from nyanyabot.core.dispatcher import Dispatcher
+from nyanyabot.handler.regexhandler import RegexHandler
+
+BOT_USERNAME = "benchbot"
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compares per-update dispatch time with and without DispatchIndex. "
+                                                 "Run from the repository root: python -m benchmark.dispatch")
+    parser.add_argument("--handlers", type=int, nargs="+", default=[10, 100, 1000], help="Handler counts to test")
+    parser.add_argument("--updates", type=int, default=2000, help="Updates per run")
+    return parser.parse_args()
+
+
+def callback(_: Update, __: CallbackContext) -> None:
+    pass
+
+
+def build_dispatcher(bot: Bot, num_handlers: int, use_dispatch_index: bool) -> Dispatcher:
+    dispatcher = Dispatcher(
+            database=None,  # Only private chats are dispatched, so no bookkeeping happens
+            bookkeeping=None,
+            seen_cache=None,
+            membership=None,
+            bot=bot,
+            update_queue=Queue(),
+            use_dispatch_index=use_dispatch_index
+    )
+
+    for num in range(num_handlers):
+        if num % 10 == 9:
+            # Some plugins react to words anywhere in a message
+            handler = RegexHandler(rf"\bkeyword{num}\b", callback=callback)
+        else:
+            handler = RegexHandler(rf"^/cmd{num}(?:@{BOT_USERNAME})?(?: (.+))?$", callback=callback)
+        handler.name = f"plugin{num}"
+        handler.group = num
+        dispatcher.add_handler(handler, group=num)
+
+    return dispatcher
+
+
+def build_updates(bot: Bot, num_handlers: int, num_updates: int) -> List[Update]:
+    chat = Chat(1, Chat.PRIVATE)
+    user = User(1, "Bench", False)
+    date = datetime.datetime.now(datetime.timezone.utc)
+    texts = [
+        "Just some chatter which does not match anything",
+        f"/cmd{num_handlers // 2} argument",
+        f"/cmd{num_handlers - 2}@{BOT_USERNAME}",
+        f"This message mentions keyword{num_handlers - 1}",
+        "/unknown command",
+    ]
+
+    return [
+        Update(num, message=Message(num, date, chat, from_user=user, text=texts[num % len(texts)], bot=bot))
+        for num in range(num_updates)
+    ]
+
+
+def run(dispatcher: Dispatcher, updates: List[Update]) -> float:
+    start = time.perf_counter()
+    for update in updates:
+        dispatcher.process_update(update)
+    return (time.perf_counter() - start) / len(updates)
+
+
+def main() -> None:
+    args = parse_arguments()
+    bot = Bot(token="123456:benchmark")
+
+    print(f"{'handlers':>10} {'linear (µs)':>14} {'indexed (µs)':>14} {'speedup':>9}")
+    for num_handlers in args.handlers:
+        updates = build_updates(bot, num_handlers, args.updates)
+        linear = run(build_dispatcher(bot, num_handlers, False), updates)
+        indexed = run(build_dispatcher(bot, num_handlers, True), updates)
+        print(f"{num_handlers:>10} {linear * 1e6:>14.1f} {indexed * 1e6:>14.1f} {linear / indexed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
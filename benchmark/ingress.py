@@ -0,0 +1,105 @@
+import argparse
+import functools
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, List
+
+from telegram import Update
+from telegram.ext import CallbackContext, Filters, MessageHandler
+
+from benchmark.replay import ReplayBot, StubRequest, UpdateFactory, write_config
+from nyanyabot.core.configuration import Configuration
+from nyanyabot.core.ingress import Ingress
+from nyanyabot.database.database import Database
+
+PORT = 18443
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures how throughput scales with the number of worker "
+                                                 "processes behind the webhook ingress. Run from the repository "
+                                                 "root: python -m benchmark.ingress")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to test")
+    parser.add_argument("--updates", type=int, default=3000, help="Updates per run")
+    parser.add_argument("--work", type=float, default=2.0, help="Milliseconds of CPU time each message takes")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent webhook connections")
+    parser.add_argument("--chats", type=int, default=200, help="Number of synthetic group chats")
+    return parser.parse_args()
+
+
+def burn(work: float, _: Update, __: CallbackContext) -> None:
+    """Stands in for a plugin doing CPU-bound work, like parsing or image processing."""
+    end = time.thread_time() + work
+    while time.thread_time() < end:
+        pass
+
+
+def run_worker(configpath: str, index: int, updates: Any, control: Any, primary: bool, *, work: float,
+               ready: Any) -> None:
+    config = Configuration(configpath)
+    config.worker_primary = primary
+    bot = ReplayBot(config, StubRequest(0.0))
+    bot.updater.dispatcher.add_handler(MessageHandler(Filters.text, functools.partial(burn, work)))
+    ready.put(index)
+    bot.start_worker(updates, control)
+
+
+def post(updates: List[bytes]) -> None:
+    connection = http.client.HTTPConnection("127.0.0.1", PORT)
+    for data in updates:
+        connection.request("POST", "/replay", body=data, headers={"Content-Type": "application/json"})
+        connection.getresponse().read()
+    connection.close()
+
+
+def run(configpath: str, args: argparse.Namespace, processes: int, updates: List[bytes]) -> float:
+    config = Configuration(configpath)
+    config.webhook_processes = processes
+    ingress = Ingress(config, configpath)
+    ready = ingress.context.Queue()
+    ingress.target = functools.partial(run_worker, work=args.work / 1000, ready=ready)
+    ingress.start()
+    for _ in range(processes):
+        ready.get()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=post, args=(updates[num::args.clients],)) for num in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    ingress.stop()  # Returns once the workers have handled all updates
+    return len(updates) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    args = parse_arguments()
+    path = tempfile.mkdtemp()
+    configpath = write_config(path, True)
+    with open(configpath, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+    config["webhook"] = {"interface": "127.0.0.1", "port": PORT, "path": "replay"}
+    with open(configpath, "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file)
+    # Create the tables once, the workers would race for it
+    Database(backend="sqlite", path=os.path.join(path, "replay.sqlite")).engine.dispose()
+
+    factory = UpdateFactory(None, args.chats, 500, 1)
+    updates = [factory.create_message(num, factory.random.choice(factory.users)).to_json().encode("utf-8")
+               for num in range(args.updates)]
+
+    print(f"{args.updates} updates, {args.work} ms CPU time each")
+    print(f"{'processes':>10} {'updates/s':>10} {'speedup':>9}")
+    baseline = 0.0
+    for processes in args.processes:
+        throughput = run(configpath, args, processes, updates)
+        baseline = baseline or throughput
+        print(f"{processes:>10} {throughput:>10.0f} {throughput / baseline:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Union
+
+from sqlalchemy import event
+from telegram import CallbackQuery, Chat, InlineQuery, Message, Update, User
+from telegram.ext import CallbackContext
+from telegram.utils.request import Request
+
+from nyanyabot.core.configuration import Configuration
+from nyanyabot.core.nyanyabot import NyaNyaBot
+from nyanyabot.core.outbound import OutboundScheduler
+
+BOT_ID = 123456
+BOT_USERNAME = "replaybot"
+SUPERUSER_ID = 1000
+KINDS = {"message": 60, "command": 10, "edit": 8, "join": 8, "leave": 4, "callback": 5, "inline": 5}
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replays synthetic or recorded updates through the dispatcher, "
+                                                 "handlers and database of a bot with a stubbed Telegram API. "
+                                                 "Run from the repository root: python -m benchmark.replay")
+    parser.add_argument("--config", help="config.json to use (defaults to a temporary SQLite database)")
+    parser.add_argument("--updates", type=int, default=5000, help="Number of synthetic updates")
+    parser.add_argument("--warmup", type=int, default=200, help="Updates replayed before measuring")
+    parser.add_argument("--chats", type=int, default=20, help="Number of synthetic group chats")
+    parser.add_argument("--users", type=int, default=500, help="Number of synthetic users")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic updates")
+    parser.add_argument("--replay", help="Replay updates from a file with one JSON update per line")
+    parser.add_argument("--record", help="Save the replayed updates to a file with one JSON update per line")
+    parser.add_argument("--latency", type=float, default=50.0, help="Milliseconds each API call takes")
+    parser.add_argument("--sync-writes", action="store_true", help="Write bookkeeping records on every update "
+                                                                   "instead of in the background")
+    parser.add_argument("--chat-scheduler", action="store_true", help="Handle updates on the ChatScheduler")
+    parser.add_argument("--admission", action="store_true", help="Shed spam and floods before dispatch")
+    parser.add_argument("--plugins", nargs="*", default=[], help="User plugins to enable")
+    parser.add_argument("--json", help="Write the report as JSON to this file, for comparing runs")
+    return parser.parse_args()
+
+
+class StubRequest(Request):
+    """
+    Answers API calls with fake results after a fixed latency instead of sending them to Telegram,
+    and counts them per method.
+
+    Args:
+        latency (:obj:`float`): Seconds each call takes
+    """
+
+    def __init__(self, latency: float):
+        super().__init__(con_pool_size=16)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+    def post(self, url: str, data: Optional[Dict[str, Any]] = None,  # type: ignore[override]
+             timeout: Optional[float] = None) -> Union[Dict[str, Any], bool]:
+        method = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.result(method, data or {})
+
+    def result(self, method: str, data: Dict[str, Any]) -> Union[Dict[str, Any], bool]:
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Replay", "username": BOT_USERNAME}
+        if method.startswith(("send", "edit", "forward")) and "chat_id" in data:
+            return {
+                "message_id": next(self._message_ids),
+                "date":       int(time.time()),
+                "chat":       {"id": int(data["chat_id"]), "type": Chat.SUPERGROUP},
+                "text":       data.get("text", ""),
+            }
+        return True
+
+
+class ReplayBot(NyaNyaBot):
+    """A NyaNyaBot whose API calls go to a StubRequest."""
+
+    def __init__(self, config: Configuration, stub: StubRequest):
+        self.stub = stub
+        super().__init__(config)
+
+    def create_request(self, con_pool_size: int, scheduler: Optional[OutboundScheduler]) -> Request:
+        return self.stub
+
+
+def write_config(path: str, write_behind: bool, chat_scheduler: bool = False, admission: bool = False) -> str:
+    config = {
+        "token":    f"{BOT_ID}:replay",
+        "superuser": [SUPERUSER_ID],
+        "database": {"backend": "sqlite", "path": os.path.join(path, "replay.sqlite")},
+        "bookkeeping": {"write_behind": write_behind},
+        "chat_scheduler": {"enabled": chat_scheduler},
+        "admission": {"enabled": admission},
+        "rate_limits": {"enabled": False},
+        "logging": {"level": "warning"},
+    }
+    config_path = os.path.join(path, "config.json")
+    with open(config_path, "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file)
+    return config_path
+
+
+class UpdateFactory:
+    """Creates a reproducible mix of group updates with the weights from ``KINDS``."""
+
+    def __init__(self, bot: Any, chats: int, users: int, seed: int):
+        self.bot = bot
+        self.random = random.Random(seed)
+        self.chats = [Chat(-1001000000000 - num, Chat.SUPERGROUP, title=f"Group {num}") for num in range(chats)]
+        self.users = [User(SUPERUSER_ID + num, f"User {num}", False, username=f"user{num}") for num in range(users)]
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.sent: List[Message] = []
+
+    def message(self, text: str, user: Optional[User] = None, **kwargs: Any) -> Message:
+        return Message(next(self.message_ids), datetime.datetime.now(datetime.timezone.utc),
+                       self.random.choice(self.chats), from_user=user or self.random.choice(self.users),
+                       text=text, bot=self.bot, **kwargs)
+
+    def create(self) -> Update:
+        kind = self.random.choices(list(KINDS), weights=list(KINDS.values()))[0]
+        if kind == "edit" and not self.sent:
+            kind = "message"
+        return getattr(self, f"create_{kind}")(next(self.update_ids), self.random.choice(self.users))
+
+    def create_message(self, update_id: int, user: User) -> Update:
+        message = self.message(self.random.choice([
+            "Just some chatter", "Does anyone know how this works?", "ok", "This message mentions a keyword",
+        ]), user)
+        self.sent.append(message)
+        return Update(update_id, message=message)
+
+    def create_command(self, update_id: int, user: User) -> Update:
+        command = self.random.choice(["/stats", f"/stats@{BOT_USERNAME}", "/list", "/help", "/start"])
+        # Half of the commands come from the superuser
+        return Update(update_id, message=self.message(command, self.users[0] if update_id % 2 else user))
+
+    def create_edit(self, update_id: int, _: User) -> Update:
+        return Update(update_id, edited_message=self.random.choice(self.sent))
+
+    def create_join(self, update_id: int, _: User) -> Update:
+        members = self.random.sample(self.users, self.random.randint(1, 5))
+        return Update(update_id, message=self.message("", members[0], new_chat_members=members))
+
+    def create_leave(self, update_id: int, user: User) -> Update:
+        return Update(update_id, message=self.message("", user, left_chat_member=user))
+
+    def create_callback(self, update_id: int, user: User) -> Update:
+        return Update(update_id, callback_query=CallbackQuery(
+                str(update_id), user, "instance", message=self.message("Buttons"), data="replay:button", bot=self.bot
+        ))
+
+    def create_inline(self, update_id: int, user: User) -> Update:
+        return Update(update_id, inline_query=InlineQuery(
+                str(update_id), user, self.random.choice(["", "cat", "cats", "hello world"]), "", bot=self.bot
+        ))
+
+
+def load_updates(path: str, bot: Any) -> List[Update]:
+    with open(path, encoding="utf-8") as update_file:
+        return [Update.de_json(json.loads(line), bot) for line in update_file if line.strip()]  # type: ignore
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+class Replay:
+    """
+    Feeds updates into ``Dispatcher.process_update`` and records the latency of each phase, the database
+    statements and the API calls.
+
+    Args:
+        bot (:obj:`ReplayBot`): Bot to replay the updates with
+    """
+
+    def __init__(self, bot: ReplayBot):
+        self.bot = bot
+        self.dispatcher = bot.updater.dispatcher
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statements = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        # Keep every observation, the histograms are too coarse for percentiles
+        observe = bot.metrics.observe
+
+        def record(name: str, value: float, **labels: str) -> None:
+            with self._lock:
+                self.samples[labels.get("phase", name)].append(value)
+            observe(name, value, **labels)
+
+        bot.metrics.observe = record  # type: ignore[method-assign]
+        event.listen(bot.database.engine, "before_cursor_execute", self._count_statement)
+        self.dispatcher.add_error_handler(self._count_error)
+
+    # pylint: disable=unused-argument
+    def _count_statement(self, *args: Any) -> None:
+        with self._lock:
+            self.statements += 1
+
+    # pylint: disable=unused-argument
+    def _count_error(self, update: object, context: CallbackContext) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples.clear()
+            self.statements = 0
+            self.errors = 0
+            self.bot.stub.calls.clear()
+
+    def feed(self, updates: List[Update]) -> None:
+        for update in updates:
+            start = time.perf_counter()
+            self.dispatcher.process_update(update)
+            self.samples["process_update"].append(time.perf_counter() - start)
+
+    def drain(self) -> None:
+        """Waits for all callbacks and writes all pending records."""
+        self.bot.shutdown()
+        self.dispatcher.stop()
+
+    def run(self, updates: List[Update], warmup: int) -> Dict[str, Any]:
+        self.bot.start_background_tasks()
+        self.feed(updates[:warmup])
+        self.reset()
+
+        measured = updates[warmup:]
+        start = time.perf_counter()
+        self.feed(measured)
+        ingested = time.perf_counter() - start
+        self.drain()
+        completed = time.perf_counter() - start
+
+        return {
+            "updates":               len(measured),
+            "ingest_per_second":     len(measured) / ingested if ingested else 0.0,
+            "completed_per_second":  len(measured) / completed if completed else 0.0,
+            "statements_per_update": self.statements / len(measured) if measured else 0.0,
+            "api_calls":             dict(self.bot.stub.calls),
+            "errors":                self.errors,
+            "phases": {
+                phase: {
+                    "count": len(values),
+                    "p50":   percentile(values, 0.5),
+                    "p99":   percentile(values, 0.99),
+                } for phase, values in sorted(self.samples.items())
+            },
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['updates']} updates, {report['errors']} errors")
+    print(f"ingest:    {report['ingest_per_second']:>10.0f} updates/s")
+    print(f"completed: {report['completed_per_second']:>10.0f} updates/s")
+    print(f"database:  {report['statements_per_update']:>10.2f} statements/update")
+    print(f"{'phase':>16} {'count':>8} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for phase, stats in report["phases"].items():
+        print(f"{phase:>16} {stats['count']:>8} {stats['p50'] * 1000:>10.3f} {stats['p99'] * 1000:>10.3f}")
+    print("API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(report["api_calls"].items())))
+
+
+def main() -> None:
+    args = parse_arguments()
+    config = Configuration(args.config or write_config(tempfile.mkdtemp(), not args.sync_writes,
+                                                         args.chat_scheduler, args.admission))
+    bot = ReplayBot(config, StubRequest(args.latency / 1000))
+    if args.plugins:
+        for name in args.plugins:
+            bot.database.set_plugin_enabled(name, True)
+        bot.plugin_loader.reload_all_plugins()
+
+    if args.replay:
+        updates = load_updates(args.replay, bot.updater.bot)
+    else:
+        factory = UpdateFactory(bot.updater.bot, args.chats, args.users, args.seed)
+        updates = [factory.create() for _ in range(args.warmup + args.updates)]
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as update_file:
+            update_file.writelines(update.to_json() + "\n" for update in updates)
+
+    report = Replay(bot).run(updates, min(args.warmup, len(updates) // 2))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import argparse
 
 from nyanyabot.core.configuration import Configuration
+from nyanyabot.core.ingress import Ingress
 from nyanyabot.core.nyanyabot import NyaNyaBot
 
 
@@ -18,6 +19,10 @@ def parse_arguments() -> argparse.Namespace:
 def main() -> None:
     args = parse_arguments()
     config = Configuration(args.configpath)
+    if config.webhook_enabled and config.webhook_processes > 1:
+        Ingress(config, args.configpath).run()
+        return
+
     bot = NyaNyaBot(config)
     bot.start()
 
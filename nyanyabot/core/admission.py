@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional, Set
+
+from telegram import Update
+from telegram.ext import Filters
+
+from nyanyabot.core.lrucache import LRUCache
+from nyanyabot.core.outbound import TokenBucket
+from nyanyabot.core.updatefacts import UpdateFacts
+
+
+class AdmissionControl:
+    """
+    Sheds spam and floods before updates reach the bookkeeping and the handlers. A message is dropped if the
+    same text or sticker was sent to its chat ``duplicate_limit`` times within ``duplicate_window`` seconds,
+    if its sender exceeds ``user_rate`` updates per second with bursts of ``user_burst``, or if its group
+    exceeds ``chat_rate`` and ``chat_burst``. Attempts count, so a flooder stays limited while they keep
+    sending. Commands are never counted as duplicates, since several users may send the same one, but are still
+    rate-limited. Superusers and service messages like joins are always admitted, inline queries are left to the
+    inline debouncer and callback queries to the button cleaner, as a dropped query would never be answered.
+
+    Args:
+        superusers (:obj:`set`): IDs of users which are never limited
+        user_rate (:obj:`float`, optional): Messages per second per user, 0 disables the limit (defaults to 1)
+        user_burst (:obj:`int`, optional): Messages a user may send at once (defaults to 5)
+        chat_rate (:obj:`float`, optional): Messages per second per group, 0 disables the limit (defaults to 10)
+        chat_burst (:obj:`int`, optional): Messages a group may receive at once (defaults to 30)
+        duplicate_window (:obj:`float`, optional): Seconds in which duplicates are counted (defaults to 10)
+        duplicate_limit (:obj:`int`, optional): Identical messages per chat allowed in the window, 0 disables
+            the detection (defaults to 3)
+        max_tracked (:obj:`int`, optional): Maximum number of users, chats and messages to track each
+            (defaults to 10000)
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 superusers: Set[int],
+                 *,
+                 user_rate: float = 1.0,
+                 user_burst: int = 5,
+                 chat_rate: float = 10.0,
+                 chat_burst: int = 30,
+                 duplicate_window: float = 10.0,
+                 duplicate_limit: int = 3,
+                 max_tracked: int = 10000):
+        self.logger = logging.getLogger(__name__)
+        self.superusers = superusers
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.duplicate_window = duplicate_window
+        self.duplicate_limit = duplicate_limit
+        self._users = LRUCache(max_tracked)
+        self._chats = LRUCache(max_tracked)
+        self._messages = LRUCache(max_tracked, ttl=duplicate_window)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.admitted = 0
+        self.exempt = 0
+        self.dropped_duplicate = 0
+        self.dropped_user = 0
+        self.dropped_chat = 0
+
+    @staticmethod
+    def _take(buckets: LRUCache, key: Hashable, rate: float, burst: int) -> bool:
+        """Takes a token from the bucket of ``key``, returns False if it is empty."""
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            buckets.put(key, bucket)
+        if bucket.delay() > 0:
+            bucket.tokens = max(bucket.tokens - 1, -burst)  # Flooders have to pause before they are let in again
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def _is_duplicate(self, chat_id: int, content: str) -> bool:
+        key = (chat_id, hash(content))
+        now = time.monotonic()
+        sent: Optional[Deque[float]] = self._messages.get(key)
+        if sent is None:
+            sent = deque(maxlen=self.duplicate_limit)
+        duplicate = len(sent) == self.duplicate_limit and sent[0] > now - self.duplicate_window
+        sent.append(now)
+        self._messages.put(key, sent)
+        return duplicate
+
+    def admit(self, update: object) -> bool:
+        """Returns False if an update should be dropped."""
+        if not isinstance(update, Update) or not update.effective_message or not update.effective_user:
+            return True
+        if update.callback_query:
+            return True
+        chat_id = update.effective_message.chat_id
+        user_id = update.effective_user.id
+
+        facts = UpdateFacts.of(update)
+        if facts.is_superuser(self.superusers):
+            self.exempt += 1
+            return True
+        if Filters.status_update(update):
+            return True
+
+        with self._lock:
+            admitted = self._check(update, facts, chat_id, user_id)
+            if admitted:
+                self.admitted += 1
+        return admitted
+
+    def _check(self, update: Update, facts: UpdateFacts, chat_id: int, user_id: int) -> bool:
+        if self.duplicate_limit and update.message and not Filters.command(update):
+            sticker = update.message.sticker
+            content = facts.text or (sticker.file_unique_id if sticker else None)
+            if content and self._is_duplicate(chat_id, content):
+                self.dropped_duplicate += 1
+                self.logger.debug("Dropping duplicate message in %s", chat_id)
+                return False
+        if self.user_rate and not self._take(self._users, user_id, self.user_rate, self.user_burst):
+            self.dropped_user += 1
+            self.logger.debug("Dropping update of %s, user is flooding", user_id)
+            return False
+        if self.chat_rate and facts.is_group and not self._take(self._chats, chat_id,
+                                                                self.chat_rate, self.chat_burst):
+            self.dropped_chat += 1
+            self.logger.debug("Dropping update in %s, chat is flooded", chat_id)
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the admission metrics."""
+        return {
+            "admitted":          self.admitted,
+            "exempt":            self.exempt,
+            "dropped_duplicate": self.dropped_duplicate,
+            "dropped_user":      self.dropped_user,
+            "dropped_chat":      self.dropped_chat,
+            "tracked_users":     len(self._users),
+            "tracked_chats":     len(self._chats),
+        }
@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from telegram import Update
+from telegram.ext import CallbackContext, Dispatcher, DispatcherHandlerStop
+
+T = TypeVar("T")
+
+
+class AsyncRuntime:
+    """
+    Runs an asyncio event loop in a background thread. Handler callbacks defined with ``async def`` are
+    scheduled on this loop, so they don't occupy a dispatcher worker while they wait for the network.
+    Blocking code (Bot API calls, synchronous database access) is run on a shared thread pool through
+    ``run_sync()``.
+
+    Args:
+        workers (:obj:`int`, optional): Size of the thread pool for blocking calls (defaults to 16)
+    """
+
+    def __init__(self, workers: int = 16):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="AsyncRuntime")
+        self.loop.set_default_executor(self.executor)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="AsyncRuntime", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Waits up to ``timeout`` seconds for running callbacks and stops the loop."""
+        if not self._thread:
+            return
+
+        async def shutdown() -> None:
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                self.logger.info("Waiting for %s async callbacks to finish", len(tasks))
+                _, pending = await asyncio.wait(tasks, timeout=timeout)
+                for task in pending:
+                    task.cancel()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+        self.executor.shutdown(wait=True)
+        self.loop.close()
+
+    def submit(self, coroutine: Awaitable[T]) -> 'Future[T]':
+        """Schedules a coroutine on the event loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)  # type: ignore[arg-type]
+
+    async def run_sync(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Runs blocking code on the thread pool and waits for it without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    def wrap_callback(self,
+                      callback: Callable[[Update, CallbackContext], Awaitable[Any]],
+                      dispatcher: Dispatcher,
+                      wait: bool = False) -> Callable[[Update, CallbackContext], Any]:
+        """Turns an ``async def`` handler callback into a synchronous one which schedules it on the loop
+        and returns immediately. Exceptions are passed to the dispatcher's error handlers.
+        With ``wait``, it returns the callback's result and raises its exceptions instead."""
+
+        @functools.wraps(callback)
+        def wrapper(update: Update, context: CallbackContext) -> Any:
+            future = self.submit(callback(update, context))
+            if wait:
+                return future.result()
+            future.add_done_callback(functools.partial(self._done, dispatcher, update))
+            return None
+
+        return wrapper
+
+    def _done(self, dispatcher: Dispatcher, update: Update, future: 'Future[Any]') -> None:
+        if future.cancelled() or not future.exception():
+            return
+        if isinstance(future.exception(), DispatcherHandlerStop):
+            # The dispatcher has moved on, only callbacks it waits for can stop later handler groups
+            self.logger.warning("DispatcherHandlerStop raised in an async callback has no effect")
+            return
+
+        try:
+            dispatcher.dispatch_error(update, future.exception())  # type: ignore[arg-type]
+        except Exception:
+            self.logger.exception("An uncaught error was raised while handling the error.")
+
+
+def run_coroutine_callback(callback: Callable[[Update, CallbackContext], Awaitable[Any]]
+                           ) -> Callable[[Update, CallbackContext], Any]:
+    """Thread-pool shim for the threaded runtime: runs an ``async def`` callback to completion
+    on the worker thread which handles the update."""
+
+    @functools.wraps(callback)
+    def wrapper(update: Update, context: CallbackContext) -> Any:
+        return asyncio.run(callback(update, context))  # type: ignore[arg-type]
+
+    return wrapper
@@ -0,0 +1,140 @@
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, Dispatcher, DispatcherHandlerStop
+
+
+class Bulkhead:
+    """
+    Runs the callbacks of one plugin on the plugin's own thread pool, so a plugin with slow callbacks can only
+    exhaust its own workers. At most ``workers`` callbacks run at once and up to ``max_queue`` more wait for
+    a worker. Further updates are rejected until the queue has room again. Callbacks which overran their time
+    budget keep running on detached threads, once ``max_detached`` of them are still running, further updates
+    are rejected as well.
+
+    The dispatcher has moved on to the next handler group by the time a callback runs, so DispatcherHandlerStop
+    raised in a bulkhead can't stop later groups and is only logged. It still works when the dispatcher waits
+    for the callback, i.e. with the ChatScheduler, or for plugins without a bulkhead.
+
+    Args:
+        name (:obj:`str`): Name of the plugin
+        workers (:obj:`int`): Number of worker threads
+        max_queue (:obj:`int`, optional): Maximum number of waiting callbacks (defaults to 100)
+        max_detached (:obj:`int`, optional): Maximum number of detached callbacks (defaults to ``workers``)
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int = 100, max_detached: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_detached = workers if max_detached is None else max_detached
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"Bulkhead_{name}")
+        self._lock = threading.Lock()
+        self._warned_stop = False
+
+        # Metrics
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.detached = 0
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> 'Future[Any]':
+        """Schedules a function on the pool.
+
+        Raises:
+            RuntimeError: If all workers are busy and the queue is full
+        """
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise RuntimeError(f"Bulkhead of {self.name} is full")
+            if self.detached >= self.max_detached:
+                self.rejected += 1
+                raise RuntimeError(f"Bulkhead of {self.name} has {self.detached} hanging callbacks")
+            self.queued += 1
+
+        return self.executor.submit(self._run, function, *args)
+
+    def add_detached(self) -> None:
+        """Counts a callback which overran its time budget and keeps running on its own thread."""
+        with self._lock:
+            self.detached += 1
+
+    def remove_detached(self) -> None:
+        with self._lock:
+            self.detached -= 1
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def wrap_callback(self,
+                      callback: Callable[[Update, CallbackContext], Any],
+                      dispatcher: Dispatcher,
+                      wait: bool = False) -> Callable[[Update, CallbackContext], Any]:
+        """Turns a handler callback into one which runs it in this bulkhead and returns immediately.
+        Exceptions are passed to the dispatcher's error handlers, rejected updates are dropped.
+        With ``wait``, it returns the callback's result and raises its exceptions instead, e.g. to keep the
+        order of a chat's updates."""
+
+        @functools.wraps(callback)
+        def wrapper(update: Update, context: CallbackContext) -> Any:
+            try:
+                future = self.submit(callback, update, context)
+            except RuntimeError as err:
+                self.logger.warning("%s, dropping update", err)
+                return None
+            if wait:
+                return future.result()
+            future.add_done_callback(functools.partial(self._done, dispatcher, update))
+            return None
+
+        return wrapper
+
+    def _done(self, dispatcher: Dispatcher, update: Update, future: 'Future[Any]') -> None:
+        exception = future.exception()
+        if exception is None:
+            return
+        if isinstance(exception, DispatcherHandlerStop):
+            if not self._warned_stop:
+                self._warned_stop = True
+                self.logger.warning("%s raised DispatcherHandlerStop in its bulkhead, where it can't stop later "
+                                    "handler groups. Set workers = 0 to run its callbacks on the dispatcher thread.",
+                                    self.name)
+            return
+
+        self.failed += 1
+        try:
+            dispatcher.dispatch_error(update, exception)  # type: ignore[arg-type]
+        except Exception:
+            self.logger.exception("An uncaught error was raised while handling the error.")
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stops the workers once the waiting callbacks are done, optionally blocking until then."""
+        self.executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the bulkhead metrics."""
+        return {
+            "workers":   self.workers,
+            "queued":    self.queued,
+            "running":   self.running,
+            "completed": self.completed,
+            "failed":    self.failed,
+            "rejected":  self.rejected,
+            "detached":  self.detached,
+        }
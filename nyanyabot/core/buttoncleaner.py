@@ -0,0 +1,225 @@
+import logging
+import threading
+from queue import Full, Queue
+from typing import Any, Dict, Hashable, Optional, Union
+
+from telegram import Bot, CallbackQuery, TelegramError
+from telegram.utils.helpers import DEFAULT_NONE
+from telegram.utils.types import JSONDict, ODVInput
+
+from nyanyabot.core.lrucache import LRUCache
+
+
+class Cleanup:
+    """A pending removal of a callback query's buttons. It is skipped if the plugin edits the message first."""
+
+    def __init__(self, query: CallbackQuery):
+        self.query = query
+        self.started = False
+        self.cancelled = False
+        self.removed = False
+        self.edited = False  # The plugin edited or deleted the message
+        self.finished = False  # The callback returned
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self) -> bool:
+        """Removes the buttons. Returns False if the cleanup was merged into an edit of the plugin.
+
+        Raises:
+            TelegramError: If the buttons could not be removed
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.started = True
+        try:
+            self.query.edit_message_reply_markup(reply_markup=None)
+            self.removed = True
+        finally:
+            self.done.set()
+        return True
+
+    def merge(self, timeout: float) -> bool:
+        """Called before the plugin edits the message. Cancels the cleanup if it hasn't started yet, since the
+        edit replaces the buttons anyway, otherwise waits for it so the edit isn't overwritten. Returns True
+        if the cleanup was cancelled."""
+        with self._lock:
+            if not self.started and not self.done.is_set():
+                self.cancelled = True
+                self.done.set()
+                return True
+        self.done.wait(timeout)
+        return False
+
+
+class ButtonCleaner:
+    """
+    Removes the buttons of pressed callback queries on a background thread, so handlers don't wait for the
+    Bot API before running the plugin. If the plugin edits or deletes the message before the removal was sent,
+    the removal is skipped, otherwise the edit waits for it. Edits are noticed however they are sent, through
+    the query, its message or ``context.bot``, as long as the bot is a :class:`CleaningBot`.
+
+    Also tracks which messages have a press in flight, so a rapid double-press runs the plugin only once.
+    A press stays in flight until both its callback and the removal are done. If the buttons were removed and
+    the plugin didn't edit the message, it stays in flight until the timeout, as only stale presses can follow.
+
+    Args:
+        max_queue (:obj:`int`, optional): Maximum number of waiting removals, newer ones are sent by the
+            caller (defaults to 100)
+        in_flight_timeout (:obj:`float`, optional): Seconds after which a press counts as finished, even if its
+            callback never did, e.g. because it was dropped (defaults to 60.0)
+        edit_timeout (:obj:`float`, optional): Seconds an edit waits for a running removal (defaults to 10.0)
+    """
+
+    EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+                      "deleteMessage")
+
+    def __init__(self, max_queue: int = 100, in_flight_timeout: float = 60.0, edit_timeout: float = 10.0):
+        self.logger = logging.getLogger(__name__)
+        self.edit_timeout = edit_timeout
+        # Holds True while a press is in flight, or its Cleanup once the removal was queued
+        self._in_flight = LRUCache(max_size=10000, ttl=in_flight_timeout)
+        self._queue: 'Queue[Cleanup]' = Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # Metrics
+        self.removed = 0
+        self.merged = 0
+        self.sent_directly = 0
+        self.failed = 0
+        self.duplicates = 0
+
+    @staticmethod
+    def key(query: CallbackQuery) -> Hashable:
+        if query.inline_message_id:
+            return query.inline_message_id
+        if query.message:
+            return query.message.chat_id, query.message.message_id
+        return query.id
+
+    @staticmethod
+    def message_key(data: JSONDict) -> Hashable:
+        """Returns the key of the message an edit request targets."""
+        if data.get("inline_message_id"):
+            return data["inline_message_id"]
+        return data.get("chat_id"), data.get("message_id")
+
+    def before_edit(self, endpoint: str, data: Optional[JSONDict]) -> None:
+        """Merges an edit or deletion of a message with the pending cleanup of its buttons."""
+        if endpoint not in self.EDIT_ENDPOINTS or not data or getattr(self._local, "removing", False):
+            return
+        key = self.message_key(data)
+        with self._lock:
+            cleanup = self._in_flight.get(key)
+            if not isinstance(cleanup, Cleanup):
+                return
+            cleanup.edited = True
+            if cleanup.finished and cleanup.done.is_set():
+                self._in_flight.pop(key)
+        if cleanup.merge(self.edit_timeout):
+            self.merged += 1
+
+    def begin(self, query: CallbackQuery) -> bool:
+        """Marks a press of the query's message as in flight. Returns False if one already is."""
+        key = self.key(query)
+        with self._lock:
+            if self._in_flight.get(key):
+                self.duplicates += 1
+                return False
+            self._in_flight.put(key, True)
+            return True
+
+    def end(self, query: CallbackQuery) -> None:
+        """Called once the callback of a press returned."""
+        key = self.key(query)
+        with self._lock:
+            cleanup = self._in_flight.get(key)
+            if not isinstance(cleanup, Cleanup):
+                self._in_flight.pop(key)
+                return
+            cleanup.finished = True
+            if cleanup.done.is_set():
+                self._release(key, cleanup)
+
+    def _release(self, key: Hashable, cleanup: Cleanup) -> None:
+        # Without buttons, only stale presses can follow, they are ignored until the mark expires
+        if not cleanup.removed or cleanup.edited:
+            self._in_flight.pop(key)
+
+    def remove_buttons(self, query: CallbackQuery) -> Cleanup:
+        """Queues the removal of the query's buttons and returns immediately."""
+        cleanup = Cleanup(query)
+        with self._lock:
+            self._in_flight.put(self.key(query), cleanup)
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(cleanup)
+        except Full:
+            self.sent_directly += 1
+            self._remove(cleanup)
+        return cleanup
+
+    def _ensure_started(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="ButtonCleaner", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._remove(self._queue.get())
+
+    def _remove(self, cleanup: Cleanup) -> None:
+        self._local.removing = True
+        try:
+            if cleanup.run():
+                self.removed += 1
+        except TelegramError as err:
+            self.failed += 1
+            self.logger.debug("Removing buttons failed: %s", err)
+        except Exception:
+            self.failed += 1
+            self.logger.exception("Removing buttons failed")
+        finally:
+            self._local.removing = False
+
+        key = self.key(cleanup.query)
+        with self._lock:
+            if cleanup.finished and self._in_flight.get(key) is cleanup:
+                self._release(key, cleanup)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the cleaner metrics."""
+        return {
+            "queued":        self._queue.qsize(),
+            "in_flight":     len(self._in_flight),
+            "removed":       self.removed,
+            "merged":        self.merged,
+            "sent_directly": self.sent_directly,
+            "failed":        self.failed,
+            "duplicates":    self.duplicates,
+        }
+
+
+class CleaningBot(Bot):
+    """
+    A Bot which lets its ButtonCleaner merge every edit or deletion it sends with the pending cleanup of the
+    message.
+
+    Args:
+        button_cleaner (:obj:`ButtonCleaner`): Cleaner to notify before edits
+    """
+
+    def __init__(self, *args: Any, button_cleaner: ButtonCleaner, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.button_cleaner = button_cleaner
+
+    def _post(self, endpoint: str, data: Optional[JSONDict] = None, timeout: ODVInput[float] = DEFAULT_NONE,
+              api_kwargs: Optional[JSONDict] = None) -> Union[bool, JSONDict, None]:
+        self.button_cleaner.before_edit(endpoint, data)
+        return super()._post(endpoint, data or {}, timeout=timeout, api_kwargs=api_kwargs or {})
@@ -0,0 +1,90 @@
+import logging
+import threading
+from queue import Full, Queue
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram import Bot, TelegramError
+
+from nyanyabot.core.lrucache import LRUCache
+
+
+class ChatActionSender:
+    """
+    Sends chat actions ("typing...") on a background thread, so handlers don't wait for the Bot API.
+    Telegram shows an action for about five seconds, so repeated actions to the same chat within
+    ``window`` seconds after one was sent, or while one is waiting, are merged into it. Failed or dropped
+    actions are only logged and don't suppress later ones.
+
+    Args:
+        bot (:obj:`Bot`): Bot instance
+        window (:obj:`float`, optional): Seconds in which repeated actions are merged (defaults to 5.0)
+        max_queue (:obj:`int`, optional): Maximum number of waiting actions, newer ones are dropped (defaults to 100)
+    """
+
+    def __init__(self, bot: Bot, window: float = 5.0, max_queue: int = 100):
+        self.logger = logging.getLogger(__name__)
+        self.bot = bot
+        self._recent = LRUCache(max_size=10000, ttl=window)
+        self._pending: Set[Tuple[int, str]] = set()
+        self._queue: 'Queue[Tuple[int, str]]' = Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def send(self, chat_id: int, action: str, refresh: bool = False) -> None:
+        """Queues a chat action and returns immediately. With ``refresh``, it is sent even if it was sent
+        recently, e.g. because sending a message ended it."""
+        key = (chat_id, action)
+        with self._lock:
+            if key in self._pending or (not refresh and self._recent.get(key)):
+                self.merged += 1
+                return
+            self._pending.add(key)
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(key)
+        except Full:
+            with self._lock:
+                self._pending.discard(key)
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="ChatActionSender", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            chat_id, action = self._queue.get()
+            try:
+                self.bot.send_chat_action(chat_id=chat_id, action=action)
+                self._recent.put((chat_id, action), True)
+                self.sent += 1
+            except TelegramError as err:
+                self.failed += 1
+                self.logger.debug("Sending chat action to %s failed: %s", chat_id, err)
+            except Exception:
+                self.failed += 1
+                self.logger.exception("Sending chat action to %s failed", chat_id)
+            finally:
+                with self._lock:
+                    self._pending.discard((chat_id, action))
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the sender metrics."""
+        return {
+            "queued":  self._queue.qsize(),
+            "sent":    self.sent,
+            "merged":  self.merged,
+            "dropped": self.dropped,
+            "failed":  self.failed,
+        }
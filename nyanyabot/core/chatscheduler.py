@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Set, Tuple
+
+
+class ChatScheduler:
+    """
+    Runs tasks on a pool of worker threads, one at a time per chat and in the order they were submitted, while
+    tasks of different chats run in parallel. Chats take turns: after each task, a chat with more waiting tasks
+    goes to the back of the line, so a busy chat never holds more than one worker. Each chat can have up to
+    ``max_backlog`` waiting tasks, further ones are rejected until its backlog shrinks.
+
+    Args:
+        workers (:obj:`int`): Number of worker threads
+        max_backlog (:obj:`int`, optional): Maximum number of waiting tasks per chat (defaults to 100)
+    """
+
+    def __init__(self, workers: int, max_backlog: int = 100):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.max_backlog = max_backlog
+
+        # Chats with waiting or running tasks. A chat is in _ready while it waits for a worker.
+        self._backlogs: Dict[Hashable, Deque[Tuple[float, Callable[..., Any], Tuple[Any, ...]]]] = {}
+        self._ready: Deque[Hashable] = deque()
+        self._overflowing: Set[Hashable] = set()
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+
+        # Metrics
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, key: Hashable, function: Callable[..., Any], *args: Any) -> bool:
+        """Schedules a function after all waiting tasks of the chat ``key``. Returns False if the chat's backlog
+        is full."""
+        with self._condition:
+            backlog = self._backlogs.get(key)
+            if backlog is None:
+                backlog = self._backlogs[key] = deque()
+                self._ready.append(key)
+                self._condition.notify()
+            elif len(backlog) >= self.max_backlog:
+                self.rejected += 1
+                if key not in self._overflowing:
+                    self._overflowing.add(key)
+                    self.logger.warning("Chat %s has %s waiting updates, dropping further ones", key, len(backlog))
+                return False
+
+            self.submitted += 1
+            backlog.append((time.perf_counter(), function, args))
+            return True
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._ready:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                submitted, function, args = self._backlogs[key].popleft()
+                wait = time.perf_counter() - submitted
+                self.started += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+            failed = False
+            try:
+                function(*args)
+            except Exception:
+                failed = True
+                self.logger.exception("Task of chat %s failed", key)
+
+            with self._condition:
+                self.completed += 1
+                self.failed += failed
+                if self._backlogs[key]:
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._backlogs[key]
+                    self._overflowing.discard(key)
+
+    def start(self) -> None:
+        if self._running:
+            return
+
+        self._running = True
+        for num in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ChatScheduler_{num}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stops the workers once all waiting tasks are done."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def backlogs(self, count: int = 10) -> List[Tuple[Hashable, int]]:
+        """Returns the chats with the most waiting tasks."""
+        with self._condition:
+            backlogs = [(key, len(backlog)) for key, backlog in self._backlogs.items() if backlog]
+        return sorted(backlogs, key=lambda backlog: backlog[1], reverse=True)[:count]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the scheduler metrics."""
+        backlogs = [len(backlog) for backlog in list(self._backlogs.values())]
+        return {
+            "workers":      self.workers,
+            "chats":        len(backlogs),
+            "backlog":      sum(backlogs),
+            "max_backlog":  max(backlogs, default=0),
+            "overflowing":  len(self._overflowing),
+            "submitted":    self.submitted,
+            "completed":    self.completed,
+            "failed":       self.failed,
+            "rejected":     self.rejected,
+            "average_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait":     self.max_wait,
+        }
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import time
 
 
 class Configuration:
@@ -14,7 +15,9 @@ class Configuration:
         FileNotFoundError: If the config file is not found
     """
 
-    def __init__(self, configpath: str):
+    def __init__(self, configpath: str):  # pylint: disable=too-many-statements
+        start = time.perf_counter()
+
         # Load config
         if not os.path.isfile(configpath):
             raise FileNotFoundError("Config could not be loaded")
@@ -40,19 +43,117 @@ class Configuration:
             self.webhook_certificate = config.get("webhook").get("certificate")
             self.webhook_private_key = config.get("webhook").get("key")
             self.webhook_port = config.get("webhook").get("port", 443)
+            # More than one process starts an Ingress which routes updates to worker processes by chat
+            self.webhook_processes = config.get("webhook").get("processes", 1)
+            self.webhook_max_restarts = config.get("webhook").get("max_restarts", 5)
+        # Index of the worker process, set by the Ingress. Plugin jobs only run on the primary worker
+        self.worker_index = 0
+        self.worker_primary = True
 
         # Database config
+        self.database_backend = config.get("database").get("backend", "mysql")
+        if self.database_backend not in ["mysql", "sqlite"]:
+            self.logger.warning("Invalid database backend, using mysql")
+            self.database_backend = "mysql"
+        self.database_path = config.get("database").get("path", "nyanyabot.sqlite")
         self.database_name = config.get("database").get("name")
         self.database_user = config.get("database").get("user")
         self.database_password = config.get("database").get("password")
         self.database_host = config.get("database").get("host", "localhost")
         self.database_port = config.get("database").get("port", 3306)
 
+        # Per-chat ordered execution of handlers
+        self.workers = config.get("workers", 8)
+        chat_scheduler = config.get("chat_scheduler", {})
+        self.chat_scheduler_enabled = chat_scheduler.get("enabled", False)
+        self.chat_scheduler_workers = chat_scheduler.get("workers", self.workers)
+        self.chat_scheduler_max_backlog = chat_scheduler.get("max_backlog", 100)
+
+        # Connection pool, sized for the dispatcher and chat scheduler workers plus the job queue and the
+        # bookkeeping flusher. Plugin bulkheads and bursts use the overflow.
+        handler_threads = self.workers + (self.chat_scheduler_workers if self.chat_scheduler_enabled else 0)
+        self.database_pool_size = config.get("database").get("pool_size", handler_threads + 2)
+        self.database_max_overflow = config.get("database").get("max_overflow", self.workers)
+        self.database_pool_timeout = config.get("database").get("pool_timeout", 30.0)
+        self.database_pool_recycle = config.get("database").get("pool_recycle", 3600)
+        self.database_pool_pre_ping = config.get("database").get("pool_pre_ping", True)
+
+        # Bookkeeping config
+        bookkeeping = config.get("bookkeeping", {})
+        self.bookkeeping_write_behind = bookkeeping.get("write_behind", False)
+        self.bookkeeping_batch_size = bookkeeping.get("batch_size", 500)
+        self.bookkeeping_flush_interval = bookkeeping.get("flush_interval", 1.0)
+        self.bookkeeping_max_pending = bookkeeping.get("max_pending", 5000)
+        self.bookkeeping_max_retries = bookkeeping.get("max_retries", 3)
+        self.bookkeeping_membership_window = bookkeeping.get("membership_window", 0.5)
+        self.bookkeeping_cache_size = bookkeeping.get("cache_size", 10000)
+        self.bookkeeping_cache_ttl = bookkeeping.get("cache_ttl", 3600.0)
+
+        # Outbound rate limits
+        rate_limits = config.get("rate_limits", {})
+        self.rate_limits_enabled = rate_limits.get("enabled", True)
+        self.rate_limits_global_rate = rate_limits.get("global_rate", 30.0)
+        self.rate_limits_chat_rate = rate_limits.get("chat_rate", 1.0)
+        self.rate_limits_chat_burst = rate_limits.get("chat_burst", 3)
+        self.rate_limits_group_rate = rate_limits.get("group_rate", 20.0)
+        self.rate_limits_max_retries = rate_limits.get("max_retries", 3)
+        self.rate_limits_max_queue = rate_limits.get("max_queue", 1000)
+        self.rate_limits_max_delay = rate_limits.get("max_delay", 0.0)
+
+        # Spam and flood shedding before dispatch
+        admission = config.get("admission", {})
+        self.admission_enabled = admission.get("enabled", False)
+        self.admission_user_rate = admission.get("user_rate", 1.0)
+        self.admission_user_burst = admission.get("user_burst", 5)
+        self.admission_chat_rate = admission.get("chat_rate", 10.0)
+        self.admission_chat_burst = admission.get("chat_burst", 30)
+        self.admission_duplicate_window = admission.get("duplicate_window", 10.0)
+        self.admission_duplicate_limit = admission.get("duplicate_limit", 3)
+
+        # Metrics endpoint config
+        self.metrics_enabled = False
+        if config.get("metrics"):
+            self.metrics_enabled = True
+            self.metrics_interface = config.get("metrics").get("interface", "127.0.0.1")
+            self.metrics_port = config.get("metrics").get("port", 9091)
+
+        # Runtime config
+        runtime = config.get("runtime", {})
+        self.runtime_mode = runtime.get("mode", "threaded")
+        if self.runtime_mode not in ["threaded", "asyncio"]:
+            self.logger.warning("Invalid runtime mode, using threaded")
+            self.runtime_mode = "threaded"
+        self.runtime_executor_workers = runtime.get("executor_workers", 16)
+
+        # Per-plugin worker pools, plugins can still ask for their own pool if disabled
+        bulkheads = config.get("bulkheads", {})
+        self.bulkheads_enabled = bulkheads.get("enabled", False)
+        self.bulkheads_workers = bulkheads.get("workers", 2)
+        self.bulkheads_max_queue = bulkheads.get("max_queue", 100)
+        self.bulkheads_max_detached = bulkheads.get("max_detached")
+
+        # Inline query result cache
+        inline_cache = config.get("inline_cache", {})
+        self.inline_cache_size = inline_cache.get("size", 1000)
+        self.inline_cache_ttl = inline_cache.get("ttl", 0)
+
+        # Plugin cooldowns
+        cooldowns = config.get("cooldowns", {})
+        self.cooldowns_max_tracked = cooldowns.get("max_tracked", 10000)
+
         # Rest of the config
         self.superuser = set(config.get("superuser", []))
         self.set_commands_enabled = config.get("set_commands", False)
         self.error_channel = config.get("error_channel")
         self.plugin_modules = config.get("plugin_modules", ["main"])
+        self.plugin_import_workers = config.get("plugin_import_workers", 4)
+        self.plugin_lazy_setup = config.get("plugin_lazy_setup", False)
+        # Time budget of plugin callbacks, 0 disables it, as each synchronous callback then runs on its own thread
+        self.plugin_callback_timeout = config.get("plugin_callback_timeout", 0.0)
+        self.plugin_callback_max_detached = config.get("plugin_callback_max_detached", 2)
+        self.blacklist_refresh_interval = config.get("blacklist_refresh_interval", 0)
+
+        self.load_time = time.perf_counter() - start
 
     def setup_logging(self, logging_level: str = "WARNING") -> None:
         logging.basicConfig(format="%(asctime)s - %(levelname)-8s - %(name)s - %(message)s", level=logging.DEBUG)
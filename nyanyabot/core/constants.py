@@ -8,3 +8,6 @@ class Constants:
 
     UTC_TIMEZONE = pytz.utc
     GERMAN_TIMEZONE = pytz.timezone("Europe/Berlin")
+    ALLOWED_UPDATES = ["message", "edited_message", "inline_query", "callback_query"]
+    # Sent by the Ingress through the update queues of its workers, not valid JSON so it can't be an update
+    RELOAD_PLUGINS = b"reload_plugins"
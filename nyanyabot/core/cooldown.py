@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional, Union
+
+from telegram import Update
+
+from nyanyabot.core.lrucache import LRUCache
+
+
+class Cooldown:
+    """
+    Limits how often a plugin's handler may be used: at most ``limit`` times within ``seconds``, counted in a
+    sliding window per user in each chat, or for the whole chat if ``per_chat`` is set. Handlers of a plugin
+    share their windows only if their cooldowns are equal.
+
+    Args:
+        seconds (:obj:`float`): Length of the window
+        limit (:obj:`int`, optional): Uses allowed within the window (defaults to 1)
+        per_chat (:obj:`bool`, optional): Share the limit between all users of a chat (defaults to False)
+    """
+
+    def __init__(self, seconds: float, limit: int = 1, per_chat: bool = False):
+        if seconds <= 0 or limit < 1:
+            raise ValueError("A cooldown needs a positive window and limit.")
+        self.seconds = seconds
+        self.limit = limit
+        self.per_chat = per_chat
+
+    @classmethod
+    def of(cls, cooldown: Union[float, 'Cooldown', None]) -> Optional['Cooldown']:
+        """Returns the given Cooldown, a Cooldown allowing one use per ``cooldown`` seconds, or None for 0."""
+        if isinstance(cooldown, Cooldown):
+            return cooldown
+        if cooldown:
+            return cls(cooldown)
+        return None
+
+    def key(self, name: str, update: Update) -> Hashable:
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        user_id = update.effective_user.id if update.effective_user and not self.per_chat else None
+        return name, self.seconds, self.limit, user_id, chat_id
+
+    def __repr__(self):
+        return f"Cooldown({self.seconds}, limit={self.limit}, per_chat={self.per_chat})"
+
+
+class CooldownStore:
+    """
+    Tracks the uses of handlers with a Cooldown, shared by all plugins. Each plugin, cooldown, user and chat has a
+    sliding window holding the times of its last ``limit`` uses. Windows expire once they are over and are
+    purged every ``purge_interval`` seconds, at most ``max_tracked`` are kept.
+
+    Args:
+        max_tracked (:obj:`int`, optional): Maximum number of tracked windows (defaults to 10000)
+        purge_interval (:obj:`float`, optional): Seconds between purges of expired windows (defaults to 60)
+    """
+
+    def __init__(self, max_tracked: int = 10000, purge_interval: float = 60.0):
+        self.purge_interval = purge_interval
+        self._windows = LRUCache(max_tracked)
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + purge_interval
+
+        # Metrics
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, name: str, update: Update, cooldown: Cooldown) -> float:
+        """Records a use of the plugin ``name`` if the cooldown allows it and returns 0, otherwise returns
+        the seconds until it is allowed again. Rejected uses are not recorded."""
+        key = cooldown.key(name, update)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge:
+                self._windows.purge_expired()
+                self._next_purge = now + self.purge_interval
+
+            uses: Optional[Deque[float]] = self._windows.get(key)
+            if uses is None:
+                uses = deque(maxlen=cooldown.limit)
+            if len(uses) == cooldown.limit and uses[0] > now - cooldown.seconds:
+                self.rejected += 1
+                return uses[0] + cooldown.seconds - now
+
+            uses.append(now)
+            self._windows.put(key, uses, ttl=cooldown.seconds)
+            self.allowed += 1
+            return 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the cooldown metrics."""
+        stats = self._windows.stats()
+        return {
+            "allowed":     self.allowed,
+            "rejected":    self.rejected,
+            "tracked":     stats["size"],
+            "evictions":   stats["evictions"],
+            "expirations": stats["expirations"],
+        }
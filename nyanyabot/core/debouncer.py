@@ -0,0 +1,56 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from telegram.ext import CallbackContext, Job, JobQueue
+
+
+class Debouncer:
+    """
+    Delays calls until their key has been quiet for a given time. A call which arrives while another one with
+    the same key is still waiting supersedes it, so only the latest call of a burst runs.
+    Calls run as one-off jobs of the JobQueue.
+
+    Args:
+        job_queue (:obj:`JobQueue`): The bot's JobQueue
+    """
+
+    def __init__(self, job_queue: JobQueue):
+        self.logger = logging.getLogger(__name__)
+        self.job_queue = job_queue
+        self._pending: Dict[Hashable, Job] = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.submitted = 0
+        self.superseded = 0
+        self.fired = 0
+
+    def submit(self, key: Hashable, delay: float, function: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """Runs ``function`` after ``delay`` seconds, unless another call with the same key arrives until then."""
+
+        def fire(_: CallbackContext) -> None:
+            with self._lock:
+                if self._pending.get(key) is not job:
+                    return
+                del self._pending[key]
+                self.fired += 1
+            function(*args, **kwargs)
+
+        with self._lock:
+            self.submitted += 1
+            previous = self._pending.pop(key, None)
+            if previous:
+                previous.schedule_removal()
+                self.superseded += 1
+            job = self.job_queue.run_once(fire, delay, name=f"Debounce {key}")
+            self._pending[key] = job
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the debouncer metrics."""
+        return {
+            "pending":    len(self._pending),
+            "submitted":  self.submitted,
+            "superseded": self.superseded,
+            "fired":      self.fired,
+        }
@@ -1,96 +1,212 @@
-from sqlalchemy import delete
-from sqlalchemy.dialects.mysql import insert
-from telegram import Update
-from telegram.ext import dispatcher, Filters
+import time
+from typing import Dict, List, Optional, Tuple
 
+from telegram import Update, TelegramError
+from telegram.ext import dispatcher, CallbackContext, DispatcherHandlerStop, Filters, Handler
+from telegram.ext.dispatcher import DEFAULT_GROUP
+from telegram.utils.helpers import DEFAULT_FALSE
+
+from nyanyabot.core.admission import AdmissionControl
+from nyanyabot.core.chatscheduler import ChatScheduler
+from nyanyabot.core.handlertable import HandlerTable
+from nyanyabot.core.metrics import Metrics
+from nyanyabot.core.updatefacts import UpdateFacts
 from nyanyabot.database.database import Database
+from nyanyabot.database.membershipsync import MembershipSync
+from nyanyabot.database.seencache import SeenCache
+from nyanyabot.database.writebehind import WriteBehindQueue
 
 
 class Dispatcher(dispatcher.Dispatcher):
     """
     Extends telegram.ext.dispatcher.Dispatcher. It sits between arriving updates and plugin handlers.
     It saves additional data to the database before running through any handler checks.
+    Chats, users and memberships which have already been saved unchanged are skipped. Joins and leaves from
+    service messages go through a MembershipSync, so bursts of them are written together.
+
+    Handlers are kept in a HandlerTable and looked up in its DispatchIndex, so only handlers which could
+    match an update are checked. Set ``use_dispatch_index`` to False to check every handler like
+    telegram.ext.Dispatcher does. ``handlers`` and ``groups`` are read from the current table.
+
+    With AdmissionControl, spam and floods are dropped before the bookkeeping.
+
+    With a ChatScheduler, handlers run on its workers instead of the dispatcher thread: the updates of a chat,
+    or of a user for updates without a chat, one after another and different chats in parallel.
     """
 
-    def __init__(self, database: Database, *args, **kwargs):  # type: ignore
+    def __init__(self,  # type: ignore  # pylint: disable=too-many-arguments
+                 database: Database,
+                 bookkeeping: WriteBehindQueue,
+                 seen_cache: SeenCache,
+                 membership: MembershipSync,
+                 *args,
+                 use_dispatch_index: bool = True,
+                 metrics: Optional[Metrics] = None,
+                 chat_scheduler: Optional[ChatScheduler] = None,
+                 admission: Optional[AdmissionControl] = None,
+                 **kwargs):
+        self.use_dispatch_index = use_dispatch_index
+        self.table = HandlerTable(use_dispatch_index)
         super().__init__(*args, **kwargs)
         self.database = database
+        self.bookkeeping = bookkeeping
+        self.seen_cache = seen_cache
+        self.membership = membership
+        self.metrics = metrics
+        self.chat_scheduler = chat_scheduler
+        self.admission = admission
 
-    def process_update(self, update: object) -> None:
+    @property
+    def handlers(self) -> Dict[int, List[Handler]]:
+        """A copy of the handlers of the current table by group."""
+        return self.table.as_dict()
+
+    @handlers.setter
+    def handlers(self, handlers: Dict[int, List[Handler]]) -> None:
+        table = self.new_table()
+        for group, group_handlers in handlers.items():
+            for handler in group_handlers:
+                table.add(handler, group)
+        self.swap_table(table)
+
+    @property
+    def groups(self) -> List[int]:
+        return list(self.table.groups)
+
+    @groups.setter
+    def groups(self, _: List[int]) -> None:
+        # The groups follow from the handlers, telegram.ext.Dispatcher only sets them on initialization
+        pass
+
+    def new_table(self) -> HandlerTable:
+        """Creates an empty HandlerTable with the settings of this dispatcher."""
+        return HandlerTable(self.use_dispatch_index)
+
+    def swap_table(self, table: HandlerTable) -> HandlerTable:
+        """Atomically replaces the handler table and returns the old one."""
+        old_table, self.table = self.table, table
+        return old_table
+
+    def add_handler(self, handler: Handler, group: int = DEFAULT_GROUP) -> None:
+        self.table.add(handler, group)
+
+    def remove_handler(self, handler: Handler, group: int = DEFAULT_GROUP) -> None:
+        self.table.remove(handler, group)
+
+    def save_update_data(self, update: object) -> None:
+        """Saves chat, user and membership data of group messages."""
         if isinstance(update, Update) and update.effective_message:
-            if update.effective_chat and Filters.chat_type.groups(update):
-                with self.database.engine.begin() as conn:
-                    # Save chat
-                    conn.execute(
-                            insert(self.database.tables.bot_chats).values(
-                                    id=update.effective_chat.id,
-                                    title=update.effective_chat.title
-                            ).on_duplicate_key_update(
-                                    title=update.effective_chat.title,
-                            )
-                    )
-
-                    if not Filters.status_update(update) and update.effective_user:
-                        # Save user
-                        conn.execute(
-                                insert(self.database.tables.bot_users).values(
-                                        id=update.effective_user.id,
-                                        first_name=update.effective_user.first_name,
-                                        last_name=update.effective_user.last_name,
-                                        username=update.effective_user.username
-                                ).on_duplicate_key_update(
-                                        first_name=update.effective_user.first_name,
-                                        last_name=update.effective_user.last_name,
-                                        username=update.effective_user.username
-                                )
-                        )
-
-                        # Save user-chat-relationship
-                        conn.execute(
-                                insert(self.database.tables.link_bot_chats_id__bot_users_id).values(
-                                        chat_id=update.effective_chat.id,
-                                        user_id=update.effective_user.id
-                                ).prefix_with('IGNORE')
-                        )
-                    else:
-                        if update.effective_message.new_chat_members:
-                            user_data = []
-                            relationship_data = []
-                            for user in update.effective_message.new_chat_members:
-                                user_data.append({
-                                    "id":         user.id,
-                                    "first_name": user.first_name,
-                                    "last_name":  user.last_name,
-                                    "username":   user.username
-                                })
-                                relationship_data.append({
-                                    "chat_id": update.effective_chat.id,
-                                    "user_id": user.id
-                                })
-
-                            # Save new users, construct on_duplicate_key for multiple values
-                            insert_stmt = insert(self.database.tables.bot_users).values(user_data)
-                            dup_stmt = insert_stmt.on_duplicate_key_update(
-                                    first_name=insert_stmt.inserted.first_name,
-                                    last_name=insert_stmt.inserted.last_name,
-                                    username=insert_stmt.inserted.username
-                            )
-                            conn.execute(dup_stmt)
-
-                            # Save user-chat-relationship
-                            conn.execute(
-                                    insert(self.database.tables.link_bot_chats_id__bot_users_id).values(
-                                            relationship_data
-                                    ).prefix_with('IGNORE')
-                            )
-                        elif update.effective_message.left_chat_member:
-                            conn.execute(
-                                    delete(self.database.tables.link_bot_chats_id__bot_users_id).where(
-                                            self.database.tables.link_bot_chats_id__bot_users_id.c.chat_id ==
-                                            update.effective_chat.id,
-                                            self.database.tables.link_bot_chats_id__bot_users_id.c.user_id ==
-                                            update.effective_message.left_chat_member.id
-                                    )
-                            )
-
-        super().process_update(update)
+            if update.effective_chat and UpdateFacts.of(update).is_group:
+                chat = update.effective_chat
+
+                # Save chat
+                if self.seen_cache.chat_changed(chat.id, chat.title):
+                    self.bookkeeping.save_chat(chat.id, chat.title)
+
+                if not Filters.status_update(update) and update.effective_user:
+                    user = update.effective_user
+
+                    # Save user
+                    if self.seen_cache.user_changed(user.id, user.first_name, user.last_name, user.username):
+                        self.bookkeeping.save_user(user.id, user.first_name, user.last_name, user.username)
+
+                    # Save user-chat-relationship
+                    if self.seen_cache.member_changed(chat.id, user.id):
+                        self.bookkeeping.add_member(chat.id, user.id)
+                else:
+                    if update.effective_message.new_chat_members:
+                        for user in update.effective_message.new_chat_members:
+                            # Always write joins, the cached membership may be stale. The cache is not filled
+                            # until the next message, so that message saves the user again if it reaches the
+                            # database before the join does.
+                            self.seen_cache.forget_user(user.id)
+                            self.seen_cache.forget_member(chat.id, user.id)
+                            self.membership.join(chat.id, user.id, user.first_name, user.last_name, user.username)
+                    elif update.effective_message.left_chat_member:
+                        self.seen_cache.forget_member(chat.id, update.effective_message.left_chat_member.id)
+                        self.membership.leave(chat.id, update.effective_message.left_chat_member.id)
+
+                self.bookkeeping.commit()
+
+    def process_update(self, update: object) -> None:
+        if self.admission and not self.admission.admit(update):
+            return
+
+        start = time.perf_counter()
+        self.save_update_data(update)
+
+        if self.metrics:
+            checkpoint = time.perf_counter()
+            self.metrics.observe("nyanyabot_update_seconds", checkpoint - start, phase="bookkeeping")
+            start = checkpoint
+
+        if isinstance(update, TelegramError):
+            super().process_update(update)
+        else:
+            # Read the table once, so a reload doesn't change the handlers in the middle of an update
+            table = self.table
+            candidates = table.candidates(update)
+            if self.chat_scheduler and candidates:
+                self.chat_scheduler.submit(self.chat_key(update), self.dispatch, update, candidates)
+            else:
+                self.dispatch(update, candidates)
+
+        if self.metrics:
+            self.metrics.observe("nyanyabot_update_seconds", time.perf_counter() - start, phase="dispatch")
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[int]:
+        """Returns the chat ID of an update, or the user ID if it has no chat, e.g. for inline queries."""
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    def dispatch(self, update: object, candidates: List[Tuple[int, List[Handler]]]) -> None:
+        """Same as telegram.ext.Dispatcher.process_update, but only checks the given handlers."""
+        context = None
+        handled = False
+        sync_modes = []
+
+        for _, handlers in candidates:
+            try:
+                for handler in handlers:
+                    check = handler.check_update(update)
+                    if check is not None and check is not False:
+                        # Each handler gets its own context, callbacks of earlier groups may still be running in
+                        # their bulkhead when the next handler's matches are collected
+                        if self.use_context:
+                            context = CallbackContext.from_update(update, self)
+                        handled = True
+                        sync_modes.append(handler.run_async)
+                        handler.handle_update(update, self, check, context)  # type: ignore[arg-type]
+                        break
+
+            # Stop processing with any other handler.
+            except DispatcherHandlerStop:
+                self.logger.debug('Stopping further handlers due to DispatcherHandlerStop')
+                self.update_persistence(update=update)
+                break
+
+            # Dispatch any error.
+            except Exception as exc:
+                try:
+                    self.dispatch_error(update, exc)
+                except DispatcherHandlerStop:
+                    self.logger.debug('Error handler stopped further handlers')
+                    break
+                # Errors should not stop the thread.
+                except Exception:
+                    self.logger.exception('An uncaught error was raised while handling the error.')
+
+        # Update persistence, if handled
+        handled_only_async = all(sync_modes)
+        if handled:
+            # Respect default settings
+            if all(mode is DEFAULT_FALSE for mode in sync_modes) and self.bot.defaults:
+                handled_only_async = self.bot.defaults.run_async
+            # If update was only handled by async handlers, we don't need to update here
+            if not handled_only_async:
+                self.update_persistence(update=update)
@@ -0,0 +1,122 @@
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import Handler
+
+from nyanyabot.core.updatefacts import UpdateFacts
+from nyanyabot.handler.callbackqueryhandler import CallbackQueryHandler
+from nyanyabot.handler.inlinequeryhandler import InlineQueryHandler
+from nyanyabot.handler.messagehandler import MessageHandler
+from nyanyabot.handler.regexhandler import RegexHandler
+
+Entry = Tuple[int, int, Handler]
+
+
+class DispatchIndex:
+    """
+    Indexes handlers by what they can match, so the dispatcher only has to run the handlers which could
+    possibly handle an update instead of checking every handler one by one.
+
+    RegexHandlers are put into buckets by the literal text their pattern has to start with
+    (e.g. "/list" for ``^/list(?:@bot)?$``), so finding them takes one dictionary lookup per distinct prefix
+    length. Patterns without such a prefix are prefiltered by the longest literal text they have to contain.
+    Other handlers are only checked against the update types they can handle.
+
+    Buckets are dictionaries keyed by insertion order, so removing a handler doesn't have to scan a list.
+    """
+
+    def __init__(self) -> None:
+        self._seq = 0
+        # ignore_case -> prefix length -> prefix -> entries
+        self._prefixes: Dict[bool, Dict[int, Dict[str, Dict[int, Entry]]]] = {False: {}, True: {}}
+        self._substrings: Dict[int, Tuple[str, bool, Entry]] = {}
+        self._messages: Dict[int, Entry] = {}
+        self._callback_queries: Dict[int, Entry] = {}
+        self._inline_queries: Dict[int, Entry] = {}
+        self._others: Dict[int, Entry] = {}
+        self._locations: Dict[Tuple[int, int], Tuple[dict, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def add(self, handler: Handler, group: int) -> None:
+        seq = self._seq
+        entry: Entry = (group, seq, handler)
+        self._seq += 1
+
+        bucket: dict = self._others
+        item: object = entry
+        if isinstance(handler, RegexHandler):
+            prefix, required, ignore_case = handler.prefix, handler.required, handler.ignore_case
+            if prefix:
+                bucket = self._prefixes[ignore_case].setdefault(len(prefix), {}).setdefault(prefix, {})
+            elif required:
+                bucket = self._substrings
+                item = (required, ignore_case, entry)
+            else:
+                bucket = self._messages
+        elif isinstance(handler, MessageHandler):
+            bucket = self._messages
+        elif isinstance(handler, CallbackQueryHandler):
+            bucket = self._callback_queries
+        elif isinstance(handler, InlineQueryHandler):
+            bucket = self._inline_queries
+
+        bucket[seq] = item
+        self._locations[(id(handler), group)] = (bucket, seq)
+
+    def remove(self, handler: Handler, group: int) -> None:
+        location = self._locations.pop((id(handler), group), None)
+        if location:
+            bucket, seq = location
+            del bucket[seq]
+
+    def _literal_matches(self, text: str) -> List[Entry]:
+        entries: List[Entry] = []
+        lower_text = text.lower()
+        is_ascii = text.isascii()
+
+        for length, prefixes in self._prefixes[False].items():
+            bucket = prefixes.get(text[:length])
+            if bucket:
+                entries.extend(bucket.values())
+        for length, prefixes in self._prefixes[True].items():
+            if is_ascii:
+                bucket = prefixes.get(lower_text[:length])
+                if bucket:
+                    entries.extend(bucket.values())
+            else:
+                for bucket in prefixes.values():
+                    entries.extend(bucket.values())
+
+        for required, ignore_case, entry in self._substrings.values():
+            if not ignore_case:
+                if required in text:
+                    entries.append(entry)
+            elif not is_ascii or required in lower_text:
+                entries.append(entry)
+
+        return entries
+
+    def candidates(self, update: object) -> List[Tuple[int, List[Handler]]]:
+        """Returns the handlers which could handle the update, grouped and ordered like the dispatcher's groups."""
+        entries = list(self._others.values())
+        if isinstance(update, Update):
+            if update.callback_query:
+                entries.extend(self._callback_queries.values())
+            elif update.inline_query:
+                entries.extend(self._inline_queries.values())
+            elif update.message or update.edited_message or update.channel_post or update.edited_channel_post:
+                entries.extend(self._messages.values())
+                text = UpdateFacts.of(update).text
+                if text:
+                    entries.extend(self._literal_matches(text))
+
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        groups: List[Tuple[int, List[Handler]]] = []
+        for group, _, handler in entries:
+            if groups and groups[-1][0] == group:
+                groups[-1][1].append(handler)
+            else:
+                groups.append((group, [handler]))
+        return groups
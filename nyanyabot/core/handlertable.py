@@ -0,0 +1,82 @@
+import bisect
+import itertools
+import threading
+from typing import Dict, List, Tuple
+
+from telegram.ext import Handler
+
+from nyanyabot.core.dispatchindex import DispatchIndex
+
+
+class HandlerTable:
+    """
+    Holds the handlers of the dispatcher by group. Every handler gets a handle when it is added, so removing
+    it is a dictionary lookup instead of a list scan.
+
+    A table can be built off to the side (e.g. while reloading all plugins) and swapped into the dispatcher
+    in one assignment. Updates which are being processed finish against the table they started with.
+
+    Args:
+        use_dispatch_index (:obj:`bool`, optional): Index the handlers in a DispatchIndex (defaults to True)
+    """
+
+    def __init__(self, use_dispatch_index: bool = True):
+        self.dispatch_index = DispatchIndex() if use_dispatch_index else None
+        self.groups: List[int] = []
+        self._groups: Dict[int, Dict[int, Handler]] = {}
+        self._handles: Dict[Tuple[int, int], int] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __contains__(self, item: Tuple[Handler, int]) -> bool:
+        handler, group = item
+        return (id(handler), group) in self._handles
+
+    def add(self, handler: Handler, group: int) -> int:
+        """Adds a handler to a group and returns its handle."""
+        if not isinstance(handler, Handler):
+            raise TypeError(f'handler is not an instance of {Handler.__name__}')
+        if not isinstance(group, int):
+            raise TypeError('group is not int')
+
+        with self._lock:
+            handle = next(self._counter)
+            if group not in self._groups:
+                self._groups[group] = {}
+                bisect.insort(self.groups, group)
+            self._groups[group][handle] = handler
+            self._handles[(id(handler), group)] = handle
+            if self.dispatch_index is not None:
+                self.dispatch_index.add(handler, group)
+        return handle
+
+    def remove(self, handler: Handler, group: int) -> bool:
+        """Removes a handler from a group. Returns False if it wasn't in the group."""
+        with self._lock:
+            handle = self._handles.pop((id(handler), group), None)
+            if handle is None:
+                return False
+
+            handlers = self._groups[group]
+            del handlers[handle]
+            if not handlers:
+                del self._groups[group]
+                del self.groups[bisect.bisect_left(self.groups, group)]
+            if self.dispatch_index is not None:
+                self.dispatch_index.remove(handler, group)
+        return True
+
+    def as_dict(self) -> Dict[int, List[Handler]]:
+        """Returns a copy of the handlers by group, like telegram.ext.Dispatcher.handlers."""
+        with self._lock:
+            return {group: list(self._groups[group].values()) for group in self.groups}
+
+    def candidates(self, update: object) -> List[Tuple[int, List[Handler]]]:
+        """Returns the handlers which could handle the update, grouped and ordered by group."""
+        with self._lock:
+            if self.dispatch_index is not None:
+                return self.dispatch_index.candidates(update)
+            return [(group, list(self._groups[group].values())) for group in self.groups]
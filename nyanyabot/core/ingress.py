@@ -0,0 +1,348 @@
+import json
+import logging
+import signal
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from queue import Empty
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from telegram import Bot
+
+from nyanyabot.core.configuration import Configuration
+from nyanyabot.core.constants import Constants
+from nyanyabot.core.metrics import Metrics, MetricsServer
+from nyanyabot.core.nyanyabot import NyaNyaBot
+
+
+def run_worker(configpath: str, index: int, updates: Any, control: Any, primary: bool) -> None:
+    """Entry point of a worker process, runs the full bot on the updates an Ingress routes to it."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The ingress stops its workers through their queues
+    config = Configuration(configpath)
+    config.worker_index = index
+    config.worker_primary = primary
+    config.set_commands_enabled = config.set_commands_enabled and primary
+    # Chats are only handled by one worker, so only the global budget is shared
+    config.rate_limits_global_rate /= config.webhook_processes
+    if config.metrics_enabled:
+        config.metrics_port += index + 1  # The ingress serves its own metrics on the configured port
+    NyaNyaBot(config).start_worker(updates, control)
+
+
+class Ingress:
+    """
+    Receives updates on the configured webhook and forwards them to ``webhook_processes`` worker processes,
+    each running the full bot with all plugins. Updates are routed by their chat ID, or the user ID for
+    updates without a chat, so all updates of a chat are handled in order by the same worker.
+
+    A crashed worker is restarted and handles the updates which were waiting for it. If a worker crashes
+    ``webhook_max_restarts`` times within a minute, it is given up and its chats are redistributed to the
+    remaining workers.
+
+    When a worker disables, enables or reloads a plugin, the other workers reload their plugins from the database.
+    Each worker gets an equal share of the global rate limit. Plugin jobs only run on the primary worker, which
+    also sets the commands. It starts as the first worker, if it is given up the lowest remaining worker is
+    restarted as the primary.
+
+    Args:
+        config (:obj:`Configuration`): Initialized Configuration class
+        configpath (:obj:`str`): Path to the config file, the workers load it again
+        target (:obj:`callable`, optional): Entry point of the worker processes, called with the config path,
+            the worker index, the worker's update queue, the control queue and whether it is the primary worker
+            (defaults to run_worker)
+    """
+
+    SHARDS_PER_WORKER = 16
+    RESTART_WINDOW = 60.0
+    STOP_TIMEOUT = 60.0
+
+    def __init__(self,
+                 config: Configuration,
+                 configpath: str,
+                 target: Callable[[str, int, Any, Any, bool], None] = run_worker):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.configpath = configpath
+        self.target = target
+        self.path = config.webhook_path if config.webhook_path.startswith("/") else f"/{config.webhook_path}"
+
+        # Workers must not inherit the threads of the ingress, so they are spawned instead of forked
+        self.context = get_context("spawn")
+        processes = config.webhook_processes
+        self.queues = [self.context.Queue() for _ in range(processes)]
+        # Workers put their index here after changing plugins
+        self.control = self.context.Queue()
+        self.workers: List[Optional[BaseProcess]] = [None] * processes
+        self.restarts: List[List[float]] = [[] for _ in range(processes)]
+        self.failed: Set[int] = set()
+        self.primary = 0
+        # Chats are hashed to shards, which are assigned to workers. A given up worker's shards are spread over
+        # the remaining workers.
+        self.shards = [num % processes for num in range(processes * self.SHARDS_PER_WORKER)]
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._supervisor: Optional[threading.Thread] = None
+        self._relay: Optional[threading.Thread] = None
+
+        self.metrics_server: Optional[MetricsServer] = None
+        if config.metrics_enabled:
+            metrics = Metrics()
+            metrics.add_collector("nyanyabot_ingress", self.stats)
+            self.metrics_server = MetricsServer(metrics, config.metrics_interface, config.metrics_port)
+
+        # Metrics
+        self.received = 0
+        self.rejected = 0
+        self.forwarded = [0] * processes
+        self.restarted = 0
+        self.redistributed = 0
+        self.reloads = 0
+
+    @staticmethod
+    def shard_key(update: Dict[str, Any]) -> int:
+        """Returns the chat ID of an update, or the user ID if it has no chat, e.g. for inline queries."""
+        for value in update.values():
+            if not isinstance(value, dict):
+                continue
+            chat = value.get("chat") or value.get("message", {}).get("chat")
+            if chat:
+                return chat["id"]
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+        return 0
+
+    def route(self, data: bytes) -> bool:
+        """Forwards a JSON-encoded update to the worker of its chat. Returns False if it is malformed."""
+        try:
+            key = self.shard_key(json.loads(data))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.rejected += 1
+            return False
+
+        with self._lock:
+            self.received += 1
+            self._forward(key, data)
+        return True
+
+    def _forward(self, key: int, data: bytes) -> None:
+        worker = self.shards[key % len(self.shards)]
+        self.queues[worker].put(data)
+        self.forwarded[worker] += 1
+
+    def start_worker(self, index: int) -> None:
+        process = self.context.Process(target=self.target,
+                                       args=(self.configpath, index, self.queues[index], self.control,
+                                             index == self.primary),
+                                       name=f"Worker{index}")
+        process.start()
+        self.workers[index] = process
+        self.logger.info("Started worker %s (pid %s)", index, process.pid)
+
+    def _drain(self, index: int) -> List[bytes]:
+        """Replaces the queue of a worker and returns the updates which were still waiting in it.
+        A crashed worker may have left the old queue locked, so reading gives up after a short wait."""
+        old_queue, self.queues[index] = self.queues[index], self.context.Queue()
+        waiting = []
+        while True:
+            try:
+                data = old_queue.get(timeout=0.1)
+            except Empty:
+                break
+            # A restarted worker loads the plugins from the database anyway
+            if data is not None and data != Constants.RELOAD_PLUGINS:
+                waiting.append(data)
+        old_queue.close()
+        return waiting
+
+    def relay_control(self) -> None:
+        """Tells all workers except the one which changed plugins to reload theirs, until None is received."""
+        for origin in iter(self.control.get, None):
+            with self._lock:
+                for index, queue in enumerate(self.queues):
+                    if index != origin and index not in self.failed:
+                        queue.put(Constants.RELOAD_PLUGINS)
+            self.reloads += 1
+
+    def supervise(self) -> None:
+        """Restarts crashed workers or gives them up if they crash too often."""
+        for index, process in enumerate(self.workers):
+            if index in self.failed or process is None or process.is_alive() or self._stop_event.is_set():
+                continue
+
+            self.logger.error("Worker %s exited with code %s", index, process.exitcode)
+            now = time.monotonic()
+            self.restarts[index] = [restart for restart in self.restarts[index] if now - restart < self.RESTART_WINDOW]
+            if len(self.restarts[index]) >= self.config.webhook_max_restarts:
+                self.give_up(index)
+                continue
+
+            self.restarts[index].append(now)
+            self.restarted += 1
+            with self._lock:
+                waiting = self._drain(index)
+                for data in waiting:
+                    self.queues[index].put(data)
+            self.start_worker(index)
+
+    def give_up(self, index: int) -> None:
+        """Stops routing to a worker and moves its shards and waiting updates to the remaining workers."""
+        self.failed.add(index)
+        healthy = [worker for worker in range(len(self.workers)) if worker not in self.failed]
+        if not healthy:
+            self.logger.critical("All workers crashed, stopping")
+            self._stop_event.set()
+            return
+
+        with self._lock:
+            moved = 0
+            for shard, worker in enumerate(self.shards):
+                if worker == index:
+                    self.shards[shard] = healthy[moved % len(healthy)]
+                    moved += 1
+            self.redistributed += moved
+            waiting = self._drain(index)
+            for data in waiting:
+                self._forward(self.shard_key(json.loads(data)), data)
+        self.logger.critical("Worker %s crashed too often, moved %s shards and %s waiting updates to workers %s",
+                             index, moved, len(waiting), healthy)
+        if index == self.primary:
+            self.make_primary(healthy[0])
+
+    def make_primary(self, index: int) -> None:
+        """Restarts a worker as the primary, so the plugin jobs keep running. The worker handles the updates
+        which are waiting for it first, new ones wait for the restarted worker."""
+        self.logger.warning("Restarting worker %s as the primary worker", index)
+        self.primary = index
+        with self._lock:
+            old_queue, self.queues[index] = self.queues[index], self.context.Queue()
+            old_queue.put(None)
+        process = self.workers[index]
+        if process:
+            process.join(self.STOP_TIMEOUT)
+            if process.is_alive():
+                self.logger.warning("Worker %s did not stop, terminating it", index)
+                process.terminate()
+                process.join()
+        self.start_worker(index)
+
+    def set_webhook(self) -> None:
+        """Points the bot's webhook to the ingress, like telegram.ext.Updater.start_webhook does."""
+        webhook_url = self.config.webhook_url or \
+            f"https://{self.config.webhook_interface}:{self.config.webhook_port}{self.path}"
+        certificate = self.config.webhook_certificate
+        bot = Bot(token=self.config.bot_token)
+        self.logger.info("Setting webhook")
+        if certificate:
+            with open(certificate, "rb") as certificate_file:
+                bot.set_webhook(webhook_url, certificate=certificate_file, drop_pending_updates=True,
+                                allowed_updates=Constants.ALLOWED_UPDATES)
+        else:
+            bot.set_webhook(webhook_url, drop_pending_updates=True, allowed_updates=Constants.ALLOWED_UPDATES)
+
+    def start(self) -> None:
+        """Starts the workers, the webhook server and the supervisor."""
+        for index in range(len(self.workers)):
+            self.start_worker(index)
+
+        ingress = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep connections of the Bot API alive
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split("?", 1)[0] != ingress.path:
+                    self.send_error(403)
+                    return
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not ingress.route(data):
+                    self.send_error(400)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((self.config.webhook_interface, self.config.webhook_port), RequestHandler)
+        self._server.daemon_threads = True
+        # Like telegram.ext.Updater, only terminate TLS if the key is present, a reverse proxy may do it otherwise
+        if self.config.webhook_certificate and self.config.webhook_private_key:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(self.config.webhook_certificate, self.config.webhook_private_key)
+            self._server.socket = ssl_context.wrap_socket(self._server.socket, server_side=True)
+        threading.Thread(target=self._server.serve_forever, name="Ingress", daemon=True).start()
+        self.logger.info("Routing updates on %s:%s%s to %s workers",
+                         self.config.webhook_interface, self.config.webhook_port, self.path, len(self.workers))
+
+        self._supervisor = threading.Thread(target=self._supervise, name="IngressSupervisor", daemon=True)
+        self._supervisor.start()
+        self._relay = threading.Thread(target=self.relay_control, name="IngressControl", daemon=True)
+        self._relay.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+
+    def _supervise(self) -> None:
+        while not self._stop_event.wait(1.0):
+            self.supervise()
+
+    def run(self) -> None:
+        """Sets the webhook and routes updates until SIGINT, SIGTERM or SIGABRT is received."""
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            signal.signal(signum, lambda *_: self._stop_event.set())
+
+        self.set_webhook()
+        self.start()
+        self._stop_event.wait()
+        self.stop()
+
+    def stop(self) -> None:
+        """Stops accepting updates and waits for the workers to handle the routed ones."""
+        self._stop_event.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._supervisor:
+            self._supervisor.join()
+            self._supervisor = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+        self.logger.info("Waiting for workers to handle the remaining updates")
+        for index, process in enumerate(self.workers):
+            if process and process.is_alive():
+                self.queues[index].put(None)
+        for index, process in enumerate(self.workers):
+            if process:
+                process.join(self.STOP_TIMEOUT)
+                if process.is_alive():
+                    self.logger.warning("Worker %s did not stop, terminating it", index)
+                    process.terminate()
+                    process.join()
+        if self._relay:
+            self.control.put(None)
+            self._relay.join()
+            self._relay = None
+        self.logger.info("Bye!")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the ingress metrics."""
+        stats = {
+            "workers":       len(self.workers) - len(self.failed),
+            "failed":        len(self.failed),
+            "received":      self.received,
+            "rejected":      self.rejected,
+            "restarts":      self.restarted,
+            "redistributed": self.redistributed,
+            "reloads":       self.reloads,
+        }
+        for index, forwarded in enumerate(self.forwarded):
+            stats[f"forwarded_{index}"] = forwarded
+        return stats
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from telegram import InlineQuery, InlineQueryResult, TelegramError
+
+from nyanyabot.core.lrucache import LRUCache
+
+Answer = Tuple[Sequence[InlineQueryResult], Dict[str, Any], float]
+
+
+class InlineResultCache:
+    """
+    Caches the answers of inline query handlers, so near-identical queries (e.g. while the user is still
+    typing) are answered without running the plugin again. Queries are keyed by plugin, query text (normalized
+    if the handler ignores case), offset and, for personal results, the user. Identical queries which arrive
+    while the first one is still being computed wait for its answer instead of computing it again.
+
+    Args:
+        max_size (:obj:`int`, optional): Maximum number of cached answers (defaults to 1000)
+        in_flight_timeout (:obj:`float`, optional): Seconds after which an unanswered computation is given up,
+            so waiting queries don't block new ones forever (defaults to 10.0)
+    """
+
+    def __init__(self, max_size: int = 1000, in_flight_timeout: float = 10.0):
+        self.logger = logging.getLogger(__name__)
+        self.in_flight_timeout = in_flight_timeout
+        self._answers = LRUCache(max_size)
+        self._in_flight: Dict[Hashable, Tuple[float, List[InlineQuery]]] = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.collapsed = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.split()).casefold()
+
+    def key(self, name: str, inline_query: InlineQuery, is_personal: bool, ignore_case: bool = True) -> Hashable:
+        """Queries are only normalized for handlers which ignore case, others may treat "Foo" and "foo"
+        differently."""
+        user_id = inline_query.from_user.id if is_personal else None
+        query = self.normalize(inline_query.query) if ignore_case else inline_query.query
+        return name, query, inline_query.offset, user_id
+
+    def get(self, key: Hashable) -> Optional[Answer]:
+        return self._answers.get(key)
+
+    def begin(self, key: Hashable, inline_query: InlineQuery) -> bool:
+        """Returns True if the caller should compute the answer, otherwise the query is answered
+        once the running computation has finished."""
+        now = time.monotonic()
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight and now - in_flight[0] < self.in_flight_timeout:
+                in_flight[1].append(inline_query)
+                self.collapsed += 1
+                return False
+            self._in_flight[key] = (now, [])
+            return True
+
+    def complete(self, key: Hashable, results: Sequence[InlineQueryResult], kwargs: Dict[str, Any],
+                 ttl: float) -> None:
+        """Caches an answer and sends it to the queries which waited for it."""
+        answer: Answer = (results, kwargs, time.monotonic() + ttl)
+        self._answers.put(key, answer, ttl)
+        with self._lock:
+            _, waiting = self._in_flight.pop(key, (0.0, []))
+        for inline_query in waiting:
+            self.answer(inline_query, answer)
+
+    def abort(self, key: Hashable) -> None:
+        """Gives up a computation, waiting queries stay unanswered and users may retry."""
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def answer(self, inline_query: InlineQuery, answer: Answer) -> None:
+        results, kwargs, expires_at = answer
+        cache_time = max(1, int(expires_at - time.monotonic()))
+        try:
+            InlineQuery.answer(inline_query, results, **{**kwargs, "cache_time": cache_time})
+        except TelegramError as err:
+            # Inline queries expire quickly, an outdated query is no reason to report an error
+            self.logger.debug("Answering inline query %s from cache failed: %s", inline_query.id, err)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the cache metrics."""
+        return {
+            **self._answers.stats(),
+            "in_flight": len(self._in_flight),
+            "collapsed": self.collapsed,
+        }
@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from telegram.ext import Job, JobQueue
+
+
+class WorkerJobQueue(JobQueue):
+    """
+    JobQueue of a bot which may run as one of several worker processes of an Ingress. Jobs scheduled inside
+    ``primary_only()``, e.g. the periodic jobs plugins create while they are loaded, only run on the primary
+    worker, so they don't run once per worker. Jobs scheduled elsewhere, e.g. by callbacks, run on every worker.
+
+    Args:
+        primary (:obj:`bool`, optional): Whether this is the primary worker (defaults to True)
+    """
+
+    def __init__(self, primary: bool = True):
+        super().__init__()
+        self.primary = primary
+        self._local = threading.local()
+
+    @contextmanager
+    def primary_only(self) -> Iterator[None]:
+        """Jobs scheduled by the current thread inside this block are dropped on the other workers."""
+        self._local.primary_only = True
+        try:
+            yield
+        finally:
+            self._local.primary_only = False
+
+    def _filter(self, job: Job) -> Job:
+        if not self.primary and getattr(self._local, "primary_only", False):
+            job.schedule_removal()
+        return job
+
+    def run_once(self, *args: Any, **kwargs: Any) -> Job:
+        return self._filter(super().run_once(*args, **kwargs))
+
+    def run_repeating(self, *args: Any, **kwargs: Any) -> Job:
+        return self._filter(super().run_repeating(*args, **kwargs))
+
+    def run_monthly(self, *args: Any, **kwargs: Any) -> Job:
+        return self._filter(super().run_monthly(*args, **kwargs))
+
+    def run_daily(self, *args: Any, **kwargs: Any) -> Job:
+        return self._filter(super().run_daily(*args, **kwargs))
+
+    def run_custom(self, *args: Any, **kwargs: Any) -> Job:
+        return self._filter(super().run_custom(*args, **kwargs))
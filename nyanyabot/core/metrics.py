@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, compatible with Prometheus' histogram type.
+
+    Args:
+        buckets (:obj:`tuple`, optional): Upper bounds of the buckets in seconds
+    """
+
+    DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, quantile: float) -> float:
+        """Estimates a quantile by returning the upper bound of the bucket it falls into."""
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        cumulative = 0
+        for num, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return self.buckets[num] if num < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """
+    Collects latency histograms and exports them, together with the statistics of registered
+    components, in the Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: Dict[Tuple[str, LabelSet], Histogram] = {}
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def time_callback(self, callback: Callable, **labels: str) -> Callable:
+        """Wraps a handler callback (``def`` or ``async def``) so its execution time is recorded."""
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.timer("nyanyabot_handler_seconds", phase="callback", **labels):
+                    return await callback(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(callback)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with self.timer("nyanyabot_handler_seconds", phase="callback", **labels):
+                return callback(*args, **kwargs)
+
+        return wrapper
+
+    def add_collector(self, prefix: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        """Registers a ``stats()`` function, its numeric values are exported as gauges named ``<prefix>_<key>``."""
+        self._collectors.append((prefix, collector))
+
+    def histograms(self, name: Optional[str] = None) -> Dict[Tuple[str, LabelSet], Histogram]:
+        with self._lock:
+            return {key: histogram for key, histogram in self._histograms.items() if name in (None, key[0])}
+
+    @staticmethod
+    def _labels(labels: LabelSet, extra: str = "") -> str:
+        parts = [f'{key}="{value}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def _render_histogram(self, name: str, labels: LabelSet, histogram: Histogram) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            upper = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_label = f'le="{upper}"'
+            lines.append(f"{name}_bucket{self._labels(labels, bucket_label)} {cumulative}")
+        lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        seen_names = set()
+        for (name, labels), histogram in sorted(self.histograms().items()):
+            if name not in seen_names:
+                lines.append(f"# TYPE {name} histogram")
+                seen_names.add(name)
+            lines.extend(self._render_histogram(name, labels, histogram))
+
+        for prefix, collector in self._collectors:
+            try:
+                stats = collector()
+            except Exception:
+                logging.getLogger(__name__).exception("Collecting metrics for %s failed", prefix)
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def measure(handler: Any, phase: str) -> ContextManager[None]:
+    """Times a phase of a handler's check if the handler has been loaded by the PluginLoader."""
+    nyanyabot = getattr(handler, "nyanyabot", None)
+    if nyanyabot is None:
+        return nullcontext()
+    return nyanyabot.metrics.timer("nyanyabot_handler_seconds", plugin=handler.name, phase=phase)
+
+
+class MetricsServer:
+    """
+    Serves the metrics in the Prometheus text format on ``http://<interface>:<port>/metrics``.
+
+    Args:
+        metrics (:obj:`Metrics`): Metrics instance
+        interface (:obj:`str`, optional): Interface to listen on (defaults to "127.0.0.1")
+        port (:obj:`int`, optional): Port to listen on (defaults to 9091)
+    """
+
+    def __init__(self, metrics: Metrics, interface: str = "127.0.0.1", port: int = 9091):
+        self.logger = logging.getLogger(__name__)
+        self.metrics = metrics
+        self.interface = interface
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((self.interface, self.port), RequestHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        self.logger.info("Serving metrics on http://%s:%s/metrics", self.interface, self.port)
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,19 +1,39 @@
 import html
+import json
 import logging
+import multiprocessing
+import threading
 import traceback
 from io import StringIO
 from queue import Queue
+from typing import Optional
 
-from telegram import Bot, ParseMode
+from telegram import ParseMode, Update
 from telegram.error import Unauthorized
-from telegram.ext import Defaults, Updater, JobQueue, CallbackContext
+from telegram.ext import Defaults, Updater, CallbackContext
 from telegram.utils.request import Request
 
+from nyanyabot.core.admission import AdmissionControl
+from nyanyabot.core.asyncruntime import AsyncRuntime
+from nyanyabot.core.buttoncleaner import ButtonCleaner, CleaningBot
+from nyanyabot.core.chatactionsender import ChatActionSender
+from nyanyabot.core.chatscheduler import ChatScheduler
 from nyanyabot.core.configuration import Configuration
 from nyanyabot.core.constants import Constants
+from nyanyabot.core.cooldown import CooldownStore
+from nyanyabot.core.debouncer import Debouncer
 from nyanyabot.core.dispatcher import Dispatcher
+from nyanyabot.core.inlinecache import InlineResultCache
+from nyanyabot.core.jobqueue import WorkerJobQueue
+from nyanyabot.core.metrics import Metrics, MetricsServer
+from nyanyabot.core.outbound import OutboundScheduler, Priority, ScheduledRequest
 from nyanyabot.core.pluginloader import PluginLoader
+from nyanyabot.core.timeout import CallbackTimeout
+from nyanyabot.core.util import StartupTimer
 from nyanyabot.database.database import Database
+from nyanyabot.database.membershipsync import MembershipSync
+from nyanyabot.database.seencache import SeenCache
+from nyanyabot.database.writebehind import WriteBehindQueue
 
 
 class NyaNyaBot:
@@ -25,6 +45,14 @@ class NyaNyaBot:
     """
 
     def error_handler(self, update: object, context: CallbackContext) -> None:
+        # Reports to the error channel must not delay answers to users
+        if self.scheduler:
+            with self.scheduler.priority(Priority.LOW):
+                self._handle_error(update, context)
+        else:
+            self._handle_error(update, context)
+
+    def _handle_error(self, update: object, context: CallbackContext) -> None:
         if not context.error:
             self.logger.error("Unknown exception happened.")
             if self.config.error_channel:
@@ -36,6 +64,8 @@ class NyaNyaBot:
             return
 
         trace = ''.join(traceback.format_tb(context.error.__traceback__))
+        if isinstance(context.error, CallbackTimeout) and context.error.stack:
+            trace += f"\nThe callback was hanging at:\n{context.error.stack}\n"
 
         if update:
             log_msg = f"Exception happened with update:\n" \
@@ -59,12 +89,76 @@ class NyaNyaBot:
 
     def __init__(self, config: Configuration):
         self.config = config
-        self.database = Database(config.database_name, config.database_user, config.database_password,
-                                 config.database_host, config.database_port)
+        self.startup_timer: Optional[StartupTimer] = StartupTimer()
+        self.startup_timer.add("config", config.load_time)
+        self.database = Database(
+                config.database_name,
+                config.database_user,
+                config.database_password,
+                config.database_host,
+                config.database_port,
+                backend=config.database_backend,
+                path=config.database_path,
+                pool_size=config.database_pool_size,
+                max_overflow=config.database_max_overflow,
+                pool_timeout=config.database_pool_timeout,
+                pool_recycle=config.database_pool_recycle,
+                pool_pre_ping=config.database_pool_pre_ping,
+                startup_timer=self.startup_timer
+        )
 
         self.logger = logging.getLogger(__name__)
         self.logger.info("Starting up bot")
+        self.metrics = Metrics()
+        self.seen_cache = SeenCache(config.bookkeeping_cache_size, config.bookkeeping_cache_ttl)
+        self.bookkeeping = WriteBehindQueue(
+                self.database,
+                write_behind=config.bookkeeping_write_behind,
+                batch_size=config.bookkeeping_batch_size,
+                flush_interval=config.bookkeeping_flush_interval,
+                max_pending=config.bookkeeping_max_pending,
+                max_retries=config.bookkeeping_max_retries,
+                seen_cache=self.seen_cache
+        )
+        self.membership = MembershipSync(
+                self.bookkeeping,
+                window=config.bookkeeping_membership_window,
+                batch_size=config.bookkeeping_batch_size
+        )
+        self.inline_cache = InlineResultCache(config.inline_cache_size)
+        self.cooldowns = CooldownStore(config.cooldowns_max_tracked)
+        self.admission: Optional[AdmissionControl] = None
+        if config.admission_enabled:
+            self.admission = AdmissionControl(
+                    config.superuser,
+                    user_rate=config.admission_user_rate,
+                    user_burst=config.admission_user_burst,
+                    chat_rate=config.admission_chat_rate,
+                    chat_burst=config.admission_chat_burst,
+                    duplicate_window=config.admission_duplicate_window,
+                    duplicate_limit=config.admission_duplicate_limit
+            )
+        self.chat_scheduler: Optional[ChatScheduler] = None
+        if config.chat_scheduler_enabled:
+            self.chat_scheduler = ChatScheduler(config.chat_scheduler_workers, config.chat_scheduler_max_backlog)
 
+        # Async callbacks and blocking calls on the executor share the bot's connection pool with the workers
+        self.runtime = None
+        con_pool_size = 14
+        if self.config.runtime_mode == "asyncio":
+            self.logger.info("Using asyncio runtime")
+            self.runtime = AsyncRuntime(self.config.runtime_executor_workers)
+            self.runtime.start()
+            con_pool_size += self.runtime.workers
+
+        self.scheduler = self.create_scheduler()
+        request = self.create_request(con_pool_size, self.scheduler)
+
+        self.job_queue = WorkerJobQueue(primary=config.worker_primary)
+        # Set by start_worker, tells the Ingress when the plugins were changed
+        self.control: Optional["multiprocessing.Queue[Optional[int]]"] = None
+
+        self.button_cleaner = ButtonCleaner()
         defaults = Defaults(
                 quote=True,
                 tzinfo=Constants.UTC_TIMEZONE
@@ -74,29 +168,119 @@ class NyaNyaBot:
                 defaults=defaults,
                 use_context=True,
                 dispatcher=Dispatcher(
-                        bot=Bot(
+                        bot=CleaningBot(
                                 token=self.config.bot_token,
-                                request=Request(
-                                        con_pool_size=14,
-                                        connect_timeout=10,
-                                        read_timeout=7
-                                ),
-                                defaults=defaults
+                                request=request,
+                                defaults=defaults,
+                                button_cleaner=self.button_cleaner
                         ),
                         database=self.database,
+                        bookkeeping=self.bookkeeping,
+                        seen_cache=self.seen_cache,
+                        membership=self.membership,
+                        metrics=self.metrics,
+                        chat_scheduler=self.chat_scheduler,
+                        admission=self.admission,
                         update_queue=Queue(),
-                        job_queue=JobQueue(),
-                        workers=8,
+                        job_queue=self.job_queue,
+                        workers=self.config.workers,
                 ),
         )
         self.updater.dispatcher.job_queue.set_dispatcher(self.updater.dispatcher)  # type: ignore
+        self.chat_action_sender = ChatActionSender(self.updater.bot)
+        self.inline_debouncer = Debouncer(self.updater.job_queue)
+        self.metrics_server = self.setup_metrics()
         self.updater.dispatcher.add_error_handler(self.error_handler, run_async=True)
 
+        self.bot_name = self.bot_username = ""
+        self.authorized = self.fetch_identity()
+
         self.plugin_loader = PluginLoader(self)
+        self.metrics.add_collector("nyanyabot_bulkhead", self.plugin_loader.bulkhead_stats)
+        if self.authorized:
+            self.load_plugins()
+
+        self.logger.info("Startup took %s", self.startup_timer.summary())
+        self.startup_timer = None
+
+    def fetch_identity(self) -> bool:
+        """Fetches the bot's identity once, plugins use the cached result. Returns False if the token is
+        invalid, login() reports it."""
+        try:
+            with self.startup_timer.phase("getMe"):  # type: ignore[union-attr]
+                bot_user = self.updater.bot.get_me()
+        except Unauthorized:
+            return False
+        self.bot_name = bot_user.name
+        self.bot_username = bot_user.username
+        return True
+
+    def load_plugins(self) -> None:
+        """Loads the chat blacklist and all plugins."""
+        self.plugin_loader.load_chat_blacklist()
+        if self.config.blacklist_refresh_interval:
+            self.updater.job_queue.run_repeating(
+                    self.plugin_loader.refresh_chat_blacklist,
+                    interval=self.config.blacklist_refresh_interval
+            )
         self.plugin_loader.load_core_plugins()
         self.plugin_loader.load_user_plugins()
 
-    def start(self):
+    def create_scheduler(self) -> Optional[OutboundScheduler]:
+        """Creates the OutboundScheduler if rate limits are enabled."""
+        if not self.config.rate_limits_enabled:
+            return None
+        return OutboundScheduler(
+                global_rate=self.config.rate_limits_global_rate,
+                chat_rate=self.config.rate_limits_chat_rate,
+                chat_burst=self.config.rate_limits_chat_burst,
+                group_rate=self.config.rate_limits_group_rate,
+                max_retries=self.config.rate_limits_max_retries,
+                max_queue=self.config.rate_limits_max_queue,
+                max_delay=self.config.rate_limits_max_delay
+        )
+
+    def create_request(self, con_pool_size: int, scheduler: Optional[OutboundScheduler]) -> Request:
+        """Creates the bot's Request, rate-limited by the scheduler if given."""
+        if not scheduler:
+            return Request(
+                    con_pool_size=con_pool_size,
+                    connect_timeout=10,
+                    read_timeout=7
+            )
+        return ScheduledRequest(
+                scheduler=scheduler,
+                con_pool_size=con_pool_size,
+                connect_timeout=10,
+                read_timeout=7
+        )
+
+    def setup_metrics(self) -> Optional[MetricsServer]:
+        """Registers the statistics of all components and creates the metrics endpoint if enabled."""
+        self.metrics.add_collector("nyanyabot_db_pool", self.database.pool_stats)
+        self.metrics.add_collector("nyanyabot_bookkeeping", self.bookkeeping.stats)
+        self.metrics.add_collector("nyanyabot_membership_sync", self.membership.stats)
+        self.metrics.add_collector("nyanyabot_seen_cache", self.seen_cache.stats)
+        self.metrics.add_collector("nyanyabot_chat_actions", self.chat_action_sender.stats)
+        self.metrics.add_collector("nyanyabot_button_cleanup", self.button_cleaner.stats)
+        self.metrics.add_collector("nyanyabot_inline_cache", self.inline_cache.stats)
+        self.metrics.add_collector("nyanyabot_inline_debounce", self.inline_debouncer.stats)
+        self.metrics.add_collector("nyanyabot_cooldowns", self.cooldowns.stats)
+        if self.scheduler:
+            self.metrics.add_collector("nyanyabot_outbound", self.scheduler.stats)
+        if self.chat_scheduler:
+            self.metrics.add_collector("nyanyabot_chat_scheduler", self.chat_scheduler.stats)
+        if self.admission:
+            self.metrics.add_collector("nyanyabot_admission", self.admission.stats)
+
+        if not self.config.metrics_enabled:
+            return None
+        return MetricsServer(self.metrics, self.config.metrics_interface, self.config.metrics_port)
+
+    def login(self) -> bool:
+        if not self.authorized:
+            self.logger.critical("Login failed, check your bot token")
+            return False
         try:
             self.logger.info("Logged in as @%s: %s (%s)",
                              self.updater.bot.first_name,
@@ -104,8 +288,14 @@ class NyaNyaBot:
                              self.updater.bot.id)
         except Unauthorized:
             self.logger.critical("Login failed, check your bot token")
+            return False
+        return True
+
+    def start(self):
+        if not self.login():
             return
 
+        self.start_background_tasks()
         if self.config.webhook_enabled:
             self.logger.info("Setting webhook")
             self.updater.start_webhook(
@@ -116,13 +306,13 @@ class NyaNyaBot:
                     cert=self.config.webhook_certificate,
                     key=self.config.webhook_private_key,
                     drop_pending_updates=True,
-                    allowed_updates=["message", "edited_message", "inline_query", "callback_query"]
+                    allowed_updates=Constants.ALLOWED_UPDATES
             )
         else:
             self.logger.info("Starting long-polling")
             self.updater.start_polling(
                     drop_pending_updates=True,
-                    allowed_updates=["message", "edited_message", "inline_query", "callback_query"]
+                    allowed_updates=Constants.ALLOWED_UPDATES
             )
 
         if self.config.set_commands_enabled:
@@ -130,4 +320,82 @@ class NyaNyaBot:
 
         self.logger.info("Bot completely loaded")
         self.updater.idle()
+        self.shutdown()
+
+    def start_worker(self,
+                     updates: "multiprocessing.Queue[Optional[bytes]]",
+                     control: Optional["multiprocessing.Queue[Optional[int]]"] = None) -> None:
+        """
+        Runs the bot as a worker process of an Ingress. Handles the JSON-encoded updates arriving through
+        ``updates`` until the ingress sends None, then handles the remaining updates and shuts down.
+        ``Constants.RELOAD_PLUGINS`` reloads the plugins from the database, after another worker changed them.
+
+        Args:
+            updates (:obj:`multiprocessing.Queue`): Updates routed to this worker
+            control (:obj:`multiprocessing.Queue`, optional): Receives the worker index after a plugin was
+                disabled, enabled or reloaded, so the ingress can tell the other workers
+        """
+        self.control = control
+        if not self.login():
+            return
+
+        self.start_background_tasks()
+        self.updater.job_queue.start()
+        dispatcher_thread = threading.Thread(target=self.updater.dispatcher.start,
+                                             name=f"Bot:{self.updater.bot.id}:dispatcher")
+        dispatcher_thread.start()
+
+        if self.config.set_commands_enabled:
+            self.plugin_loader.setup_commands()
+
+        self.logger.info("Worker completely loaded")
+        for data in iter(updates.get, None):
+            if data == Constants.RELOAD_PLUGINS:
+                self.reload_plugins()
+                continue
+            try:
+                update = Update.de_json(json.loads(data), self.updater.bot)
+            except ValueError:
+                self.logger.warning("Dropping malformed update")
+                continue
+            self.updater.update_queue.put(update)
+
+        self.logger.info("Handling remaining updates")
+        self.updater.job_queue.stop()
+        self.updater.dispatcher.stop()
+        dispatcher_thread.join()
+        self.shutdown()
+
+    def reload_plugins(self) -> None:
+        """Reloads all plugins after another worker changed them."""
+        self.logger.info("Plugins were changed by another worker, reloading them")
+        try:
+            self.plugin_loader.reload_all_plugins()
+        except Exception:
+            self.logger.error("Reloading plugins failed, keeping the old ones: %s", traceback.format_exc())
+
+    def start_background_tasks(self) -> None:
+        self.bookkeeping.start()
+        self.membership.start()
+        if self.chat_scheduler:
+            self.chat_scheduler.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+
+    def shutdown(self) -> None:
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+        self.logger.info("Waiting for plugin callbacks")
+        if self.chat_scheduler:
+            self.chat_scheduler.stop()
+        self.plugin_loader.shutdown_bulkheads(wait=True)
+
+        if self.runtime:
+            self.logger.info("Stopping asyncio runtime")
+            self.runtime.stop()
+
+        self.logger.info("Flushing pending bookkeeping records")
+        self.membership.stop()
+        self.bookkeeping.stop()
         self.logger.info("Bye!")
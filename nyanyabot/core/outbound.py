@@ -0,0 +1,291 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram import TelegramError
+from telegram.error import RetryAfter
+from telegram.utils.request import Request
+from telegram.utils.types import JSONDict
+
+from nyanyabot.core.lrucache import LRUCache
+
+
+class Priority(IntEnum):
+    """Priority classes for outbound requests, lower values are sent first."""
+    HIGH = 0  # Answers to callback and inline queries
+    NORMAL = 1  # Replies to users
+    LOW = 2  # Reports, e.g. to the error channel
+
+
+class TokenBucket:
+    """
+    A token bucket which hands out reservations, so callers can sleep until their slot instead of polling.
+    Not thread-safe, the OutboundScheduler guards it.
+
+    Args:
+        rate (:obj:`float`): Tokens added per second
+        capacity (:obj:`float`): Maximum number of tokens, i.e. the allowed burst
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def reserve(self) -> float:
+        """Takes a token, possibly from the future, and returns how long to wait before using it."""
+        wait = self.delay()
+        self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class OutboundScheduler:
+    """
+    Flow control for all Bot API requests which send something. Every request waits in its chat's queue for
+    a token of the chat's bucket (private chats and groups have different limits) and then in the global queue
+    for a token of the global bucket. Both queues are served by priority, waiters sleep until their turn
+    instead of holding a reserved token. If ``max_delay`` is set, requests which aren't high priority are dropped
+    if they would wait longer, so a busy chat can't park the sending threads for long. Flood-control errors
+    (``retry_after``) pause the affected bucket and the request is retried.
+
+    Args:
+        global_rate (:obj:`float`, optional): Requests per second over all chats (defaults to 30)
+        chat_rate (:obj:`float`, optional): Requests per second per private chat (defaults to 1)
+        chat_burst (:obj:`int`, optional): Burst size per private chat (defaults to 3)
+        group_rate (:obj:`float`, optional): Requests per minute per group (defaults to 20)
+        max_retries (:obj:`int`, optional): Retries after a flood-control error (defaults to 3)
+        max_queue (:obj:`int`, optional): Waiting requests after which low-priority requests are dropped
+            (defaults to 1000)
+        max_delay (:obj:`float`, optional): Seconds after which waiting requests, except high-priority ones,
+            are dropped, 0 waits forever (defaults to 0)
+    """
+
+    # Requests which are subject to Telegram's sending limits
+    LIMITED_PREFIXES = ("send", "forward", "copy", "edit", "answer", "stop")
+    UNLIMITED_METHODS = {"sendChatAction"}
+    HIGH_PRIORITY_METHODS = {"answerCallbackQuery", "answerInlineQuery"}
+
+    def __init__(self,
+                 *,
+                 global_rate: float = 30.0,
+                 chat_rate: float = 1.0,
+                 chat_burst: int = 3,
+                 group_rate: float = 20.0,
+                 max_retries: int = 3,
+                 max_queue: int = 1000,
+                 max_delay: float = 0.0):
+        self.logger = logging.getLogger(__name__)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate / 60
+        self.group_burst = max(1, int(group_rate))
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.max_delay = max_delay
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = LRUCache(max_size=10000)
+        self._condition = threading.Condition()
+        self._waiting: List[Tuple[int, int]] = []
+        self._chat_queues: Dict[Union[int, str], List[Tuple[int, int]]] = {}
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+        # Metrics
+        self.sent = 0
+        self.delayed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def priority(self, priority: Priority) -> Iterator[None]:
+        """Sends all requests of the current thread inside this block with the given priority."""
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def classify(self, method: str) -> Optional[Priority]:
+        """Returns the priority for a Bot API method or None if it isn't rate limited."""
+        if method in self.UNLIMITED_METHODS or not method.startswith(self.LIMITED_PREFIXES):
+            return None
+        if method in self.HIGH_PRIORITY_METHODS:
+            return Priority.HIGH
+        priority = getattr(self._local, "priority", None)
+        return Priority.NORMAL if priority is None else priority
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group and channel IDs are negative, channels may also be given by their @username
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.put(chat_id, bucket)
+        return bucket
+
+    def acquire(self, chat_id: Optional[Union[int, str]], priority: Priority) -> None:
+        """Blocks until the request may be sent.
+
+        Raises:
+            TelegramError: If a low-priority request is dropped because too many requests are waiting, or if
+                a request other than a high-priority one would wait longer than ``max_delay``
+        """
+        start = time.monotonic()
+        deadline = start + self.max_delay if priority != Priority.HIGH and self.max_delay else None
+
+        with self._condition:
+            if priority == Priority.LOW and len(self._waiting) >= self.max_queue:
+                self.dropped += 1
+                raise TelegramError("Outbound queue is full, low-priority request dropped")
+
+            ticket = (int(priority), next(self._counter))
+            if chat_id is not None:
+                self._wait_for_chat(chat_id, ticket, deadline)
+            self._wait_for_global(ticket, deadline)
+
+            waited = time.monotonic() - start
+            self.sent += 1
+            if waited > 0.001:
+                self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def _wait(self, timeout: Optional[float], deadline: Optional[float], reason: str) -> None:
+        """Waits for a change of the queues, at most until the deadline. Must hold the condition."""
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.dropped += 1
+                raise TelegramError(f"Outbound request dropped after waiting {self.max_delay} seconds for {reason}")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._condition.wait(timeout)
+
+    def _wait_for_chat(self, chat_id: Union[int, str], ticket: Tuple[int, int], deadline: Optional[float]) -> None:
+        """Waits in the chat's queue, by priority, until the ticket is first and the chat has a token."""
+        bucket = self._chat_bucket(chat_id)
+        queue = self._chat_queues.setdefault(chat_id, [])
+
+        # Fail fast instead of parking the thread if the chat's backlog can't be sent in time
+        ahead = sum(1 for waiting in queue if waiting < ticket)
+        if deadline is not None and bucket.delay() + ahead / bucket.rate > deadline - time.monotonic():
+            if not queue:
+                del self._chat_queues[chat_id]
+            self.dropped += 1
+            raise TelegramError(f"Outbound queue of chat {chat_id} is too long, request dropped")
+
+        heapq.heappush(queue, ticket)
+        try:
+            while True:
+                wait: Optional[float] = None  # Others are woken up when the head of the queue was served
+                if queue[0] == ticket:
+                    wait = bucket.delay()
+                    if wait <= 0:
+                        bucket.reserve()
+                        break
+                self._wait(wait, deadline, f"chat {chat_id}")
+        finally:
+            queue.remove(ticket)
+            heapq.heapify(queue)
+            if not queue:
+                del self._chat_queues[chat_id]
+            self._condition.notify_all()
+
+    def _wait_for_global(self, ticket: Tuple[int, int], deadline: Optional[float]) -> None:
+        """Waits in the global queue, by priority, until the ticket is first and a global token is free."""
+        heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                wait: Optional[float] = None
+                if self._waiting[0] == ticket:
+                    wait = self._global.delay()
+                    if wait <= 0:
+                        self._global.reserve()
+                        break
+                self._wait(wait, deadline, "the global limit")
+        finally:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def flood_wait(self, chat_id: Optional[Union[int, str]], retry_after: float) -> None:
+        """Pauses the chat's bucket (or the global one) after Telegram answered with ``retry_after``."""
+        with self._condition:
+            self.retries += 1
+            if chat_id is not None:
+                self._chat_bucket(chat_id).pause(retry_after)
+            else:
+                self._global.pause(retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the scheduler metrics."""
+        return {
+            "waiting":      len(self._waiting) + sum(len(queue) for queue in list(self._chat_queues.values())),
+            "sent":         self.sent,
+            "delayed":      self.delayed,
+            "dropped":      self.dropped,
+            "retries":      self.retries,
+            "average_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait":     self.max_wait,
+        }
+
+
+class ScheduledRequest(Request):
+    """
+    Extends telegram.utils.request.Request. Sends every rate-limited request through an OutboundScheduler.
+    Added arguments:
+        scheduler (:obj:`OutboundScheduler`): The scheduler which owns the send path
+    """
+
+    def __init__(self, *args: Any, scheduler: OutboundScheduler, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+
+    def post(self, url: str, data: JSONDict, timeout: float = None) -> Union[JSONDict, bool]:  # type: ignore
+        priority = self.scheduler.classify(url.rsplit("/", 1)[-1])
+        if priority is None:
+            return super().post(url, data, timeout)
+
+        chat_id = data.get("chat_id") if data else None
+        attempt = 0
+        while True:
+            self.scheduler.acquire(chat_id, priority)
+            try:
+                # Request.post converts the data in place, keep the original for retries
+                return super().post(url, dict(data) if data else data, timeout)
+            except RetryAfter as err:
+                if attempt >= self.scheduler.max_retries:
+                    self.scheduler.dropped += 1
+                    raise
+                attempt += 1
+                self.scheduler.logger.warning("Flood control hit for chat %s, retrying in %s seconds",
+                                              chat_id, err.retry_after)
+                self.scheduler.flood_wait(chat_id, err.retry_after)
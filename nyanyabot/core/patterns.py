@@ -0,0 +1,62 @@
+import re
+from typing import List, Optional, Pattern, Tuple
+
+try:
+    from re import _parser as sre_parse  # type: ignore # pylint: disable=no-name-in-module
+except ImportError:  # Python < 3.11
+    import sre_parse  # pylint: disable=deprecated-module
+
+# The opcodes are generated at runtime and are invisible to linters
+AT, AT_BEGINNING, AT_BEGINNING_STRING, LITERAL = (
+    getattr(sre_parse, name) for name in ("AT", "AT_BEGINNING", "AT_BEGINNING_STRING", "LITERAL")
+)
+
+
+def literal_prefix(pattern: Pattern) -> Tuple[Optional[str], Optional[str], bool]:
+    """Analyzes a compiled regex.
+
+    Returns:
+        A tuple of the literal text a match must start with (only for patterns anchored with ``^``),
+        the longest literal text every match must contain and whether the pattern ignores case.
+        Both strings are lowercase if the pattern ignores case and are ``None`` if no literal could be found.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:  # Should never happen as the pattern is already compiled
+        return None, None, False
+
+    flags = parsed.state.flags
+    ignore_case = bool(flags & re.IGNORECASE)
+    if flags & re.LOCALE:
+        return None, None, ignore_case
+
+    items = list(parsed)
+    anchored = bool(items) and (
+            items[0] == (AT, AT_BEGINNING_STRING) or
+            (items[0] == (AT, AT_BEGINNING) and not flags & re.MULTILINE)
+    )
+
+    # Top-level items have to match in sequence, so every run of literals is part of every match
+    runs: List[Tuple[int, str]] = []
+    start, run = 0, ""
+    for num, (opcode, argument) in enumerate(items):
+        if opcode == LITERAL:
+            if not run:
+                start = num
+            run += chr(argument)
+        elif run:
+            runs.append((start, run))
+            run = ""
+    if run:
+        runs.append((start, run))
+
+    if ignore_case:
+        # Non-ASCII characters may match differently-sized characters when lowercased
+        runs = [(start, run.lower()) for start, run in runs if run.isascii()]
+
+    prefix = None
+    if anchored and runs and runs[0][0] == 1:
+        prefix = runs[0][1]
+    required = max((run for _, run in runs), key=len, default=None)
+
+    return prefix, required, ignore_case
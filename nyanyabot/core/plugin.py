@@ -1,16 +1,30 @@
+import asyncio
+import functools
 import logging
+import threading
 from abc import ABC
-from typing import List
+from typing import Any, Callable, List, Optional, TypeVar
 
 from telegram import BotCommand, Update
 from telegram.ext import Handler, CallbackContext
 
+from nyanyabot.core.bulkhead import Bulkhead
 from nyanyabot.core.nyanyabot import NyaNyaBot
 
+T = TypeVar("T")
+
 
 class Plugin(ABC):
     """
     Abstract plugin-class for NyaNyaBot. Every plugin must inherit from this.
+    Handler callbacks may be defined with ``async def``, blocking calls should then be awaited with ``run_sync()``.
+    Expensive initialization belongs into ``setup()``, which may be deferred until the first callback runs.
+    Callbacks run on the dispatcher thread, unless bulkheads are enabled or the plugin sets ``workers`` to get
+    its own Bulkhead, ``max_queue`` overrides the configured queue size (``workers = 0`` opts out of enabled
+    bulkheads). DispatcherHandlerStop can't stop later handler groups from a bulkhead or an ``async def``
+    callback, unless the ChatScheduler is enabled. ``timeout`` overrides the configured time budget of the plugin's
+    callbacks, handlers may set their own. With several webhook processes, jobs scheduled in ``__init__()`` or
+    ``setup()`` only run on the first worker, jobs scheduled by callbacks run on the worker handling the update.
 
     Args:
         nyanyabot (:obj:`NyaNyaBot`): NyaNyaBot instance
@@ -19,20 +33,53 @@ class Plugin(ABC):
     commands: List[BotCommand]
     handlers: List[Handler]
     name: str
+    workers: Optional[int]
+    max_queue: Optional[int]
+    bulkhead: Optional[Bulkhead]
+    timeout: Optional[float]
 
     def __init__(self, nyanyabot: NyaNyaBot):
         self.commands = []
         self.handlers = []
         self.name = "SETME"
+        self.workers = None
+        self.max_queue = None
+        self.bulkhead = None
+        self.timeout = None
 
         # Convenience properties
         self.updater = nyanyabot.updater
         self.dispatcher = self.updater.dispatcher
         self.job_queue = self.updater.job_queue
-        self.bot_name = self.updater.bot.name
-        self.username = self.updater.bot.username
+        self._primary_only = nyanyabot.job_queue.primary_only
+        self.bot_name = nyanyabot.bot_name
+        self.username = nyanyabot.bot_username
         self.db = nyanyabot.database
+        self.runtime = nyanyabot.runtime
+        self.chat_action_sender = nyanyabot.chat_action_sender
         self.logger = logging.getLogger(self.__class__.__name__)
+        self._setup_done = False
+        self._setup_lock = threading.Lock()
+
+    def setup(self) -> None:
+        """Expensive initialization, e.g. loading data or creating API clients. Runs right after loading,
+        or before the first callback if lazy plugin setup is enabled."""
+
+    def ensure_setup(self) -> None:
+        """Runs ``setup()`` exactly once."""
+        if self._setup_done:
+            return
+        with self._setup_lock:
+            if not self._setup_done:
+                with self._primary_only():
+                    self.setup()
+                self._setup_done = True
 
     def run(self, update: Update, context: CallbackContext) -> None:
         pass
+
+    async def run_sync(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Runs blocking code (e.g. ``update.effective_message.reply_text``) on a thread pool."""
+        if self.runtime:
+            return await self.runtime.run_sync(function, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
@@ -1,14 +1,21 @@
+import asyncio
+import functools
 import logging
 import operator
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set
 
-from sqlalchemy import select, func
+from telegram.ext import CallbackContext, ConversationHandler, Handler
 
 import nyanyabot.plugin
+from nyanyabot.core.asyncruntime import run_coroutine_callback
+from nyanyabot.core.bulkhead import Bulkhead
+from nyanyabot.core.handlertable import HandlerTable
+from nyanyabot.core.timeout import limit_callback
 
 if TYPE_CHECKING:
     from nyanyabot.core.nyanyabot import NyaNyaBot
@@ -17,60 +24,160 @@ if TYPE_CHECKING:
 
 class PluginLoader:
     plugins: List['Plugin']
+    chat_blacklist: Dict[int, Set[str]]
 
     def __init__(self, nyanyabot_instance: 'NyaNyaBot'):
         self.nyanyabot = nyanyabot_instance
         self.logger = logging.getLogger(__name__)
         self.plugins = []
+        self.chat_blacklist = {}
         self.group = 0
 
-    def load_plugin(self, path: str) -> None:
+    def import_plugins(self, paths: Iterable[str]) -> None:
+        """Imports plugin modules in parallel, so load_plugin only has to construct the plugins.
+        Errors are ignored here and reported when the plugin is loaded."""
+        paths = [path for path in paths if path not in sys.modules]
+        workers = min(self.nyanyabot.config.plugin_import_workers, len(paths))
+        if workers <= 1:
+            return
+
+        def try_import(path: str) -> None:
+            try:
+                import_module(path)
+            except Exception:
+                self.logger.debug("Importing %s failed, it is reported when loaded", path, exc_info=True)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PluginImport") as executor:
+            list(executor.map(try_import, paths))
+
+    @staticmethod
+    def setup_on_first_call(plugin: 'Plugin', callback: Callable) -> Callable:
+        """Wraps a callback so the plugin's ``setup()`` runs before it is called for the first time."""
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                plugin.ensure_setup()
+                return await callback(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(callback)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            plugin.ensure_setup()
+            return callback(*args, **kwargs)
+
+        return wrapper
+
+    def create_bulkhead(self, plugin: 'Plugin') -> Optional[Bulkhead]:
+        """Creates the worker pool for a plugin's callbacks if the plugin sets ``workers``, or bulkheads are
+        enabled and it doesn't set ``workers = 0``."""
+        workers = plugin.workers
+        if workers is None:
+            workers = self.nyanyabot.config.bulkheads_workers if self.nyanyabot.config.bulkheads_enabled else 0
+        if workers <= 0:
+            return None
+        max_queue = self.nyanyabot.config.bulkheads_max_queue if plugin.max_queue is None else plugin.max_queue
+        return Bulkhead(plugin.name, workers, max_queue, self.nyanyabot.config.bulkheads_max_detached)
+
+    def callback_timeout(self, plugin: 'Plugin', handler: Handler) -> float:
+        """Returns the time budget of a handler's callback, 0 means unlimited."""
+        timeout = getattr(handler, "timeout", None)
+        if timeout is None:
+            timeout = plugin.timeout
+        if timeout is None:
+            timeout = self.nyanyabot.config.plugin_callback_timeout
+        return timeout or 0.0
+
+    def wrap_callback(self, plugin: 'Plugin', callback: Callable, timeout: float = 0.0) -> Callable:
+        """Adds timing, lazy setup and the time budget to a handler callback and decides where it runs:
+        ``async def`` callbacks on the asyncio runtime, everything else in the plugin's bulkhead.
+        With the ChatScheduler, the handler waits for them, so the chat's next update isn't handled before."""
+        wait = self.nyanyabot.chat_scheduler is not None
+        callback = self.nyanyabot.metrics.time_callback(callback, plugin=plugin.name)
+        if self.nyanyabot.config.plugin_lazy_setup:
+            callback = self.setup_on_first_call(plugin, callback)
+
+        if asyncio.iscoroutinefunction(callback):
+            if self.nyanyabot.runtime:
+                if timeout:
+                    callback = limit_callback(callback, timeout, plugin.name)
+                # Waiting coroutines don't occupy a thread, so they don't need a bulkhead
+                return self.nyanyabot.runtime.wrap_callback(callback, self.nyanyabot.updater.dispatcher, wait)
+            callback = run_coroutine_callback(callback)
+
+        if timeout:
+            callback = limit_callback(callback, timeout, plugin.name, plugin.bulkhead,
+                                      self.nyanyabot.config.plugin_callback_max_detached)
+
+        if plugin.bulkhead:
+            callback = plugin.bulkhead.wrap_callback(callback, self.nyanyabot.updater.dispatcher, wait)
+        return callback
+
+    def load_plugin(self, path: str, table: Optional[HandlerTable] = None) -> None:
+        """Loads a plugin and adds its handlers to the given HandlerTable (defaults to the dispatcher's)."""
+        if self.nyanyabot.startup_timer:
+            with self.nyanyabot.startup_timer.phase(path):
+                self._load_plugin(path, table)
+        else:
+            self._load_plugin(path, table)
+
+    def _load_plugin(self, path: str, table: Optional[HandlerTable]) -> None:
         module = import_module(path)
 
         # Setup handlers, jobs and commands
         if hasattr(module, "plugin"):  # Is Plugin?
             # Call the "plugin" variable which references the specific plugin class
             # pylint: disable=used-before-assignment
-            plugin_module: Plugin = module.plugin(self.nyanyabot)  # type:ignore
+            with self.nyanyabot.job_queue.primary_only():
+                plugin_module: Plugin = module.plugin(self.nyanyabot)  # type:ignore
+            if not self.nyanyabot.config.plugin_lazy_setup:
+                plugin_module.ensure_setup()
+            plugin_module.bulkhead = self.create_bulkhead(plugin_module)
 
             for handler in plugin_module.handlers:
-                handler.name = plugin_module.name  # type: ignore
+                # Handlers like ConversationHandler have no callback of their own, their nested handlers'
+                # return values drive the conversation, so they run as they are
+                if getattr(handler, "callback", None):
+                    handler.callback = self.wrap_callback(
+                            plugin_module,
+                            handler.callback,
+                            self.callback_timeout(plugin_module, handler)
+                    )
+                if not isinstance(handler, ConversationHandler):  # Its name can't be changed
+                    handler.name = plugin_module.name  # type: ignore
                 handler.nyanyabot = self.nyanyabot  # type: ignore
                 handler.group = self.group  # type: ignore
-                self.nyanyabot.updater.dispatcher.add_handler(handler, group=self.group)
+                if table is None:
+                    self.nyanyabot.updater.dispatcher.add_handler(handler, group=self.group)
+                else:
+                    table.add(handler, self.group)
                 self.group += 1
 
             self.plugins.append(plugin_module)
 
-    def load_core_plugins(self):
+    def load_core_plugins(self, table: Optional[HandlerTable] = None) -> None:
+        self.import_plugins(f"nyanyabot.plugin.{plugin}" for plugin in nyanyabot.plugin.__all__)
         for num, plugin in enumerate(nyanyabot.plugin.__all__):
             self.logger.info("(%s/%s) Loading core plugin: %s", num + 1, len(nyanyabot.plugin.__all__), plugin)
             try:
-                self.load_plugin(f"nyanyabot.plugin.{plugin}")
+                self.load_plugin(f"nyanyabot.plugin.{plugin}", table)
             except Exception:
                 self.logger.error("".join(traceback.format_exc()))
                 continue
 
-    def load_user_plugins(self):
-        plugins = []
-
+    def load_user_plugins(self, table: Optional[HandlerTable] = None) -> None:
         # Load enabled plugins from database
-        with self.nyanyabot.database.engine.begin() as conn:
-            for row in conn.execute(
-                    select(self.nyanyabot.database.tables.bot_plugins.c.name).where(
-                            self.nyanyabot.database.tables.bot_plugins.c.enabled == 1
-                    )
-            ):
-                plugins.append(row.name)
+        plugins = self.nyanyabot.database.enabled_plugins()
 
         # Setup plugins
         for plugin_dir in self.nyanyabot.config.plugin_modules:
             sys.path.append(os.path.join("..", "user_plugins", plugin_dir))
 
+        self.import_plugins(f"plugins.{plugin}" for plugin in plugins)
         for num, plugin in enumerate(plugins):
             self.logger.info("(%s/%s) Loading plugin: %s", num + 1, len(plugins), plugin)
             try:
-                self.load_plugin(f"plugins.{plugin}")
+                self.load_plugin(f"plugins.{plugin}", table)
             except Exception:
                 self.logger.error("".join(traceback.format_exc()))
                 continue
@@ -108,38 +215,73 @@ class PluginLoader:
 
         # Remove from loaded plugin
         self.plugins.remove(plugin)
+        if plugin.bulkhead:
+            plugin.bulkhead.shutdown()
 
     def reload_all_plugins(self) -> None:
-        # Remove all handlers
-        self.logger.info("Removing handlers")
-        for group in list(self.nyanyabot.updater.dispatcher.handlers.keys()):  # create a copy to avoid RuntimeErrors
-            while (group in self.nyanyabot.updater.dispatcher.handlers.keys()) and \
-                    self.nyanyabot.updater.dispatcher.handlers[group]:
-                self.nyanyabot.updater.dispatcher.remove_handler(
-                        self.nyanyabot.updater.dispatcher.handlers[group][0],
-                        group=group
-                )
-
-        # Unload all Python modules
+        """Loads all plugins again into a new HandlerTable and swaps it into the dispatcher once they are loaded.
+        Updates keep being handled by the old plugins until then. If loading fails, the old plugins stay active."""
+        # Unload all Python modules, the old plugins keep their references
         self.logger.info("Unloading Python modules")
-        modules = {name: module for name, module in sys.modules.items()
-                   if name.startswith("nextbot.plugin.") or name.startswith("plugins.")}
-        for name, _ in modules.items():
+        modules = [name for name in sys.modules if name.startswith(("nyanyabot.plugin.", "plugins."))]
+        for name in modules:
             del sys.modules[name]
 
+        old_plugins, old_group = self.plugins, self.group
         self.plugins = []
         self.group = 0
-        self.load_core_plugins()
-        self.load_user_plugins()
+        table = self.nyanyabot.updater.dispatcher.new_table()
+        try:
+            self.load_core_plugins(table)
+            self.load_user_plugins(table)
+        except Exception:
+            self.shutdown_bulkheads()
+            self.plugins, self.group = old_plugins, old_group
+            raise
 
-    def is_plugin_disabled_for_chat(self, chat_id: int, name: str) -> bool:
-        with self.nyanyabot.database.engine.begin() as conn:
-            # https://stackoverflow.com/a/12942437
-            res = conn.execute(
-                    select([func.count()]).select_from(self.nyanyabot.database.tables.bot_plugins_chat_blacklist).where(
-                            self.nyanyabot.database.tables.bot_plugins_chat_blacklist.c.chat_id == chat_id,
-                            self.nyanyabot.database.tables.bot_plugins_chat_blacklist.c.disabled_plugin == name
-                    )
-            ).fetchone()
+        self.logger.info("Activating %s handlers of %s plugins", len(table), len(self.plugins))
+        self.nyanyabot.updater.dispatcher.swap_table(table)
+        for plugin in old_plugins:
+            if plugin.bulkhead:
+                plugin.bulkhead.shutdown()
+
+    def plugins_changed(self) -> None:
+        """Tells the Ingress that plugins were disabled, enabled or reloaded, so the other workers reload theirs."""
+        if self.nyanyabot.control:
+            self.nyanyabot.control.put(self.nyanyabot.config.worker_index)
+
+    def shutdown_bulkheads(self, wait: bool = False) -> None:
+        """Stops the worker pools of all loaded plugins."""
+        for plugin in self.plugins:
+            if plugin.bulkhead:
+                plugin.bulkhead.shutdown(wait)
+
+    def bulkhead_stats(self) -> Dict[str, Any]:
+        """Returns the bulkhead metrics of all plugins, keys are prefixed with the plugin name."""
+        stats = {}
+        for plugin in self.plugins:
+            if plugin.bulkhead:
+                for key, value in plugin.bulkhead.stats().items():
+                    stats[f"{plugin.name}_{key}"] = value
+        return stats
+
+    def load_chat_blacklist(self) -> None:
+        """Loads the per-chat plugin blacklist from the database into memory."""
+        chat_blacklist = self.nyanyabot.database.chat_blacklist()
+        self.chat_blacklist = chat_blacklist
+        self.logger.debug("Loaded plugin blacklist for %s chats", len(chat_blacklist))
 
-        return res[0] == 1
+    def refresh_chat_blacklist(self, _: CallbackContext) -> None:
+        """Job callback which picks up blacklist changes that were made directly in the database."""
+        self.load_chat_blacklist()
+
+    def set_plugin_disabled_for_chat(self, chat_id: int, name: str, disabled: bool) -> None:
+        """Updates the in-memory blacklist after the database has been changed."""
+        if disabled:
+            self.chat_blacklist.setdefault(chat_id, set()).add(name)
+        else:
+            self.chat_blacklist.get(chat_id, set()).discard(name)
+
+    def is_plugin_disabled_for_chat(self, chat_id: int, name: str) -> bool:
+        disabled_plugins = self.chat_blacklist.get(chat_id)
+        return disabled_plugins is not None and name in disabled_plugins
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+from nyanyabot.core.bulkhead import Bulkhead
+
+
+class CallbackTimeout(Exception):
+    """
+    Passed to the error handlers when a handler callback exceeds its time budget.
+
+    Args:
+        name (:obj:`str`): Name of the plugin
+        timeout (:obj:`float`): The time budget in seconds
+        elapsed (:obj:`float`): Seconds the callback had been running when it was abandoned
+        stack (:obj:`str`, optional): Where the callback was hanging
+    """
+
+    def __init__(self, name: str, timeout: float, elapsed: float, stack: str = ""):
+        super().__init__(f"Callback of {name} did not finish within {timeout:g} seconds "
+                         f"and was abandoned after {elapsed:.2f} seconds")
+        self.name = name
+        self.timeout = timeout
+        self.elapsed = elapsed
+        self.stack = stack
+
+
+def limit_callback(callback: Callable,
+                   timeout: float,
+                   name: str,
+                   bulkhead: Optional[Bulkhead] = None,
+                   max_detached: int = 2) -> Callable:
+    """Limits the execution time of a handler callback. ``async def`` callbacks are cancelled when their time
+    is up. Synchronous callbacks run on a separate daemon thread, which is detached on overrun because Python
+    threads can't be cancelled, so the calling worker is released either way. Detached threads count against
+    the plugin's bulkhead until they end, without a bulkhead the callback is rejected while ``max_detached`` of
+    its threads are still running, so a hanging plugin can't leak threads without limit.
+
+    Raises:
+        CallbackTimeout: If the callback didn't finish in time
+        RuntimeError: If too many earlier calls are still hanging
+    """
+    if asyncio.iscoroutinefunction(callback):
+        @functools.wraps(callback)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await asyncio.wait_for(callback(*args, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                raise CallbackTimeout(name, timeout, time.perf_counter() - start) from None
+
+        return async_wrapper
+
+    # Detached threads of this callback, only used without a bulkhead
+    hanging = {"count": 0}
+    hanging_lock = threading.Lock()
+
+    def add_detached() -> None:
+        if bulkhead:
+            bulkhead.add_detached()
+        else:
+            with hanging_lock:
+                hanging["count"] += 1
+
+    def remove_detached() -> None:
+        if bulkhead:
+            bulkhead.remove_detached()
+        else:
+            with hanging_lock:
+                hanging["count"] -= 1
+
+    @functools.wraps(callback)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not bulkhead and hanging["count"] >= max_detached:
+            raise RuntimeError(f"Callback of {name} has {hanging['count']} hanging calls")
+
+        result: Dict[str, Any] = {}
+        state = {"finished": False, "detached": False}
+        lock = threading.Lock()
+
+        def run() -> None:
+            try:
+                result["value"] = callback(*args, **kwargs)
+            except BaseException as err:  # pylint: disable=broad-except
+                result["error"] = err
+            finally:
+                with lock:
+                    state["finished"] = True
+                    if state["detached"]:
+                        remove_detached()
+
+        start = time.perf_counter()
+        thread = threading.Thread(target=run, name=f"Callback_{name}", daemon=True)
+        thread.start()
+        thread.join(timeout)
+        with lock:
+            detached = state["detached"] = not state["finished"]
+            if detached:
+                add_detached()
+        if detached:
+            frame = sys._current_frames().get(thread.ident)  # type: ignore[arg-type] # pylint: disable=protected-access
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            raise CallbackTimeout(name, timeout, time.perf_counter() - start, stack)
+
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+
+    return wrapper
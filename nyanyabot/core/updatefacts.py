@@ -0,0 +1,83 @@
+from typing import Any, Optional, Set
+
+from telegram import Chat, Update
+
+_UNSET: Any = object()
+
+
+class UpdateFacts:
+    """
+    Facts about an update which many handlers need. They are computed on first use and shared by all handlers
+    checking the same update, get them with ``UpdateFacts.of(update)``.
+
+    Args:
+        update (:obj:`Update`): The update
+    """
+
+    __slots__ = ("update", "_is_message", "_is_group", "_text", "_lower_text", "_superuser")
+
+    def __init__(self, update: Update):
+        self.update = update
+        self._is_message: Any = _UNSET
+        self._is_group: Any = _UNSET
+        self._text: Any = _UNSET
+        self._lower_text: Any = _UNSET
+        self._superuser: Any = _UNSET
+
+    @classmethod
+    def of(cls, update: Update) -> 'UpdateFacts':
+        facts = update.__dict__.get("_facts")
+        if facts is None:
+            # Attributes starting with an underscore are not serialized by TelegramObject.to_dict()
+            facts = update.__dict__["_facts"] = cls(update)
+        return facts
+
+    @property
+    def is_message(self) -> bool:
+        """True for (edited) messages and channel posts, like telegram.ext.Filters.update."""
+        if self._is_message is _UNSET:
+            update = self.update
+            self._is_message = bool(update.message or update.edited_message or
+                                    update.channel_post or update.edited_channel_post)
+        return self._is_message
+
+    @property
+    def is_group(self) -> bool:
+        """True if the update comes from a group or supergroup."""
+        if self._is_group is _UNSET:
+            chat = self.update.effective_chat
+            self._is_group = chat is not None and chat.type in (Chat.GROUP, Chat.SUPERGROUP)
+        return self._is_group
+
+    @property
+    def text(self) -> Optional[str]:
+        """The message's caption or text."""
+        if self._text is _UNSET:
+            message = self.update.effective_message
+            self._text = (message.caption or message.text) if message else None
+        return self._text
+
+    @property
+    def lower_text(self) -> Optional[str]:
+        if self._lower_text is _UNSET:
+            self._lower_text = self.text.lower() if self.text else self.text
+        return self._lower_text
+
+    def starts_with(self, prefix: str, ignore_case: bool) -> bool:
+        """Checks if the text starts with a literal prefix, ``prefix`` must be lowercase if ``ignore_case``
+        is set. Returns True for non-ASCII text when ignoring case, because its lowercase form may differ in
+        length from what a case-insensitive regex matches."""
+        text = self.text
+        if not text:
+            return False
+        if not ignore_case:
+            return text.startswith(prefix)
+        if not text.isascii():
+            return True
+        return self.lower_text.startswith(prefix)  # type: ignore[union-attr]
+
+    def is_superuser(self, superusers: Set[int]) -> bool:
+        if self._superuser is _UNSET:
+            user = self.update.effective_user
+            self._superuser = user is not None and user.id in superusers
+        return self._superuser
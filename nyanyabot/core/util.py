@@ -1,13 +1,16 @@
 import datetime
+import time
+from contextlib import contextmanager
 from functools import wraps
 from types import FunctionType
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Iterator, List, Tuple
 
 from pytz.tzinfo import DstTzInfo
 from telegram import Update
-from telegram.ext import Filters, CallbackContext
+from telegram.ext import CallbackContext
 
 from nyanyabot.core.constants import Constants
+from nyanyabot.core.updatefacts import UpdateFacts
 
 if TYPE_CHECKING:
     from nyanyabot.core.plugin import Plugin
@@ -19,11 +22,12 @@ class Util:
 
     @staticmethod
     def send_action(action: str) -> Any:
+        """Decorator which sends a chat action in the background before the callback runs."""
         def send_action_real(function: FunctionType) -> Any:
             @wraps(function)
             def wrapper(plugin: 'Plugin', update: Update, context: CallbackContext, *args: Any, **kwargs: Any) -> Any:
                 if update.effective_message:
-                    update.effective_message.reply_chat_action(action=action)
+                    plugin.chat_action_sender.send(update.effective_message.chat_id, action)
                 return function(plugin, update, context, *args, **kwargs)
 
             return wrapper
@@ -33,7 +37,7 @@ class Util:
     @staticmethod
     def is_group(update: Update) -> bool:
         """Returns True if message has been send into group."""
-        return Filters.chat_type.groups(update)  # type: ignore
+        return UpdateFacts.of(update).is_group
 
 
 class TimeUtil:
@@ -57,3 +61,26 @@ class TimeUtil:
     def utcnow() -> datetime.datetime:
         """Returns current UTC time as timezone-aware datetime. Convenience function."""
         return TimeUtil.timezone_naive_to_aware(datetime.datetime.utcnow())
+
+
+class StartupTimer:
+    """Measures the duration of named startup phases."""
+
+    def __init__(self) -> None:
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    def summary(self) -> str:
+        total = sum(seconds for _, seconds in self.phases)
+        phases = ", ".join(f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases)
+        return f"{total * 1000:.1f} ms ({phases})"
@@ -0,0 +1,147 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Sequence
+
+from sqlalchemy import Table, create_engine, event
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Executable
+
+from nyanyabot.database.pool import MonitoredQueuePool
+
+
+class StorageBackend(ABC):
+    """
+    The database-specific parts of Database: connection URLs, engine setup, schema management and
+    statements which have no dialect-neutral form in SQLAlchemy, like upserts.
+    """
+
+    name: str
+    # MySQL's schema is managed by yoyo-migrations, other backends create the declared tables
+    uses_migrations = False
+    # Upper limit of bound parameters per statement, multi-row statements are split accordingly
+    max_parameters = 65535
+
+    @property
+    @abstractmethod
+    def url(self) -> str:
+        """SQLAlchemy URL for the synchronous engine."""
+
+    @property
+    @abstractmethod
+    def async_url(self) -> str:
+        """SQLAlchemy URL for the asyncio engine."""
+
+    def create_engine(self, **pool_options: Any) -> Engine:
+        return create_engine(self.url, echo=False, future=True, poolclass=MonitoredQueuePool, **pool_options)
+
+    @abstractmethod
+    def upsert(self, table: Table, rows: List[Dict[str, Any]], update_columns: Sequence[str]) -> Executable:
+        """Inserts rows and updates ``update_columns`` of rows whose primary key already exists."""
+
+    @abstractmethod
+    def insert_ignore(self, table: Table, rows: List[Dict[str, Any]]) -> Executable:
+        """Inserts rows and skips rows whose primary key already exists. Other errors, like a missing
+        foreign key, still raise."""
+
+    def chunks(self, rows: List[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """Splits rows for multi-row statements, so no statement exceeds ``max_parameters``."""
+        if not rows:
+            return
+        size = max(1, self.max_parameters // len(rows[0]))
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+
+
+class MySQLBackend(StorageBackend):
+    """
+    MySQL or MariaDB through mysqlclient, the schema is managed by yoyo-migrations.
+
+    Args:
+        name (:obj:`str`): Name of the database
+        user (:obj:`str`): Database user
+        password (:obj:`str`): Database password
+        host (:obj:`str`, optional): Database host (defaults to "localhost")
+        port (:obj:`int`, optional): Database port (defaults to 3306)
+    """
+
+    name = "mysql"
+    uses_migrations = True
+
+    def __init__(self, name: str, user: str, password: str, host: str = "localhost", port: int = 3306):
+        self._url = f"mysql+mysqldb://{user}:{password}@{host}:{port}/{name}?charset=utf8mb4"
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def async_url(self) -> str:
+        return self._url.replace("mysql+mysqldb://", "mysql+aiomysql://", 1)
+
+    def upsert(self, table: Table, rows: List[Dict[str, Any]], update_columns: Sequence[str]) -> Executable:
+        insert_stmt = mysql.insert(table).values(rows)
+        return insert_stmt.on_duplicate_key_update({column: insert_stmt.inserted[column] for column in update_columns})
+
+    def insert_ignore(self, table: Table, rows: List[Dict[str, Any]]) -> Executable:
+        # INSERT IGNORE would also ignore foreign key errors, a no-op update only skips duplicates
+        primary_key = list(table.primary_key.columns)[0]
+        return mysql.insert(table).values(rows).on_duplicate_key_update({primary_key.name: primary_key})
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    An embedded SQLite database in WAL mode, so readers don't block the writer. Meant for small deployments
+    and load tests without a MySQL server. The tables are created from their declarations.
+
+    Args:
+        path (:obj:`str`): Path to the database file
+        busy_timeout (:obj:`float`, optional): Seconds to wait for a lock held by another connection
+            (defaults to 30)
+    """
+
+    name = "sqlite"
+    max_parameters = 32766
+
+    def __init__(self, path: str, busy_timeout: float = 30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+
+    @property
+    def url(self) -> str:
+        return f"sqlite+pysqlite:///{self.path}"
+
+    @property
+    def async_url(self) -> str:
+        return f"sqlite+aiosqlite:///{self.path}"
+
+    def create_engine(self, **pool_options: Any) -> Engine:
+        pool_options.pop("pool_pre_ping", None)  # Local files don't go stale
+        pool_options.pop("pool_recycle", None)
+        engine = create_engine(
+                self.url,
+                echo=False,
+                future=True,
+                poolclass=MonitoredQueuePool,
+                connect_args={"check_same_thread": False, "timeout": self.busy_timeout},
+                **pool_options
+        )
+        event.listen(engine, "connect", self._configure_connection)
+        return engine
+
+    @staticmethod
+    def _configure_connection(dbapi_connection: Any, _: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")  # Durable with WAL, only a power loss may lose commits
+        cursor.execute("PRAGMA foreign_keys=ON")  # Same constraints as MySQL
+        cursor.close()
+
+    def upsert(self, table: Table, rows: List[Dict[str, Any]], update_columns: Sequence[str]) -> Executable:
+        insert_stmt = sqlite.insert(table).values(rows)
+        return insert_stmt.on_conflict_do_update(
+                index_elements=list(table.primary_key.columns),
+                set_={column: insert_stmt.excluded[column] for column in update_columns}
+        )
+
+    def insert_ignore(self, table: Table, rows: List[Dict[str, Any]]) -> Executable:
+        return sqlite.insert(table).values(rows).on_conflict_do_nothing()
@@ -1,40 +1,229 @@
 import logging
 import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
+import sqlalchemy
 import yoyo
-from sqlalchemy import create_engine
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
+from nyanyabot.core.util import StartupTimer
+from nyanyabot.database.backend import MySQLBackend, SQLiteBackend, StorageBackend
+from nyanyabot.database.pool import MonitoredQueuePool
 from nyanyabot.database.tables import Tables
 
 
 class Database:
     """
-    Provides an interface to the database.
+    Provides an interface to the database. The bookkeeping and plugin state are stored through the methods
+    of this class, which leave dialect-specific statements to a StorageBackend: MySQL or an embedded SQLite
+    database.
 
     Args:
-        name (:obj:`str`): Name of the database
-        user (:obj:`str`): Database user
-        password (:obj:`str`): Database password
-        host (:obj:`str`, optional): Database host (defaults to "localhost")
-        port (:obj:`int`, optional): Database port (defaults to 3306)
+        name (:obj:`str`, optional): Name of the database (required for MySQL)
+        user (:obj:`str`, optional): Database user (required for MySQL)
+        password (:obj:`str`, optional): Database password (required for MySQL)
+        host (:obj:`str`, optional): Database host (defaults to "localhost", MySQL)
+        port (:obj:`int`, optional): Database port (defaults to 3306, MySQL)
+        backend (:obj:`str`, optional): "mysql" or "sqlite" (defaults to "mysql")
+        path (:obj:`str`, optional): Path to the database file (defaults to "nyanyabot.sqlite", SQLite)
+        pool_size (:obj:`int`, optional): Connections kept open (defaults to 10)
+        max_overflow (:obj:`int`, optional): Additional connections opened under load (defaults to 8)
+        pool_timeout (:obj:`float`, optional): Seconds to wait for a free connection (defaults to 30)
+        pool_recycle (:obj:`int`, optional): Seconds after which connections are replaced, must be lower than
+            MySQL's ``wait_timeout`` (defaults to 3600)
+        pool_pre_ping (:obj:`bool`, optional): Test connections on checkout and replace stale ones
+            (defaults to True)
+        startup_timer (:obj:`StartupTimer`, optional): Records the duration of the startup phases
     """
 
-    def __init__(self,
-                 name: str,
-                 user: str,
-                 password: str,
+    MIGRATIONS_PATH = os.path.join("database", "migrations")
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 name: Optional[str] = None,
+                 user: Optional[str] = None,
+                 password: Optional[str] = None,
                  host: str = "localhost",
-                 port: int = 3306):
+                 port: int = 3306,
+                 *,
+                 backend: str = "mysql",
+                 path: str = "nyanyabot.sqlite",
+                 pool_size: int = 10,
+                 max_overflow: int = 8,
+                 pool_timeout: float = 30.0,
+                 pool_recycle: int = 3600,
+                 pool_pre_ping: bool = True,
+                 startup_timer: Optional[StartupTimer] = None):
         self.logger = logging.getLogger(__name__)
-        self.connection_string = f"mysql+mysqldb://{user}:{password}@{host}:{port}/{name}?charset=utf8mb4"
-        self.migrate()
+        self.backend: StorageBackend
+        if backend == "sqlite":
+            self.backend = SQLiteBackend(path, busy_timeout=pool_timeout)
+        else:
+            if name is None or user is None or password is None:
+                raise ValueError("The MySQL backend needs a database name, user and password.")
+            self.backend = MySQLBackend(name, user, password, host, port)
+        self.connection_string = self.backend.url
+        startup_timer = startup_timer or StartupTimer()
+
+        with startup_timer.phase("database"):
+            self.engine = self.backend.create_engine(
+                    pool_size=pool_size,
+                    max_overflow=max_overflow,
+                    pool_timeout=pool_timeout,
+                    pool_recycle=pool_recycle,
+                    pool_pre_ping=pool_pre_ping
+            )
+            self._async_engine: Optional[AsyncEngine] = None
+
+        self.tables = self.prepare_schema(startup_timer)
+
+    def prepare_schema(self, startup_timer: StartupTimer) -> Tables:
+        """Applies missing migrations (MySQL) or creates missing tables (SQLite) and returns the tables."""
+        if not self.backend.uses_migrations:
+            with startup_timer.phase("tables"):
+                tables = Tables()
+                tables.metadata.create_all(self.engine)
+            return tables
+
+        with startup_timer.phase("migrations"):
+            applied_migrations = self.applied_migrations()
+            if applied_migrations is None or not self.available_migrations() <= applied_migrations:
+                self.migrate()
+                applied_migrations = self.applied_migrations()
+            else:
+                self.logger.debug("All migrations are applied, skipping yoyo")
+
+        with startup_timer.phase("tables"):
+            schema_version = max(applied_migrations) if applied_migrations else None
+            if schema_version != Tables.MIGRATION_VERSION:
+                self.logger.info("Schema version %s differs from %s, reflecting tables",
+                                 schema_version, Tables.MIGRATION_VERSION)
+                return Tables(self.engine, reflect=True)
+            return Tables()
+
+    @property
+    def async_engine(self) -> AsyncEngine:
+        """Engine for ``async def`` callbacks, created on first use. Requires the aiomysql or aiosqlite driver."""
+        if self._async_engine is None:
+            self._async_engine = create_async_engine(self.backend.async_url, echo=False)
+        return self._async_engine
+
+    def upsert(self, conn: Connection, table: Any, rows: List[Dict[str, Any]], update_columns: Iterable[str]) -> None:
+        """Inserts rows and updates ``update_columns`` of rows which already exist."""
+        for chunk in self.backend.chunks(rows):
+            conn.execute(self.backend.upsert(table, chunk, list(update_columns)))
+
+    def insert_ignore(self, conn: Connection, table: Any, rows: List[Dict[str, Any]]) -> None:
+        """Inserts rows which don't exist yet."""
+        for chunk in self.backend.chunks(rows):
+            conn.execute(self.backend.insert_ignore(table, chunk))
+
+    def write_bookkeeping(self,
+                          chats: Iterable[Dict[str, Any]],
+                          users: Iterable[Dict[str, Any]],
+                          links: Iterable[Tuple[int, int]],
+                          unlinks: Iterable[Tuple[int, int]]) -> None:
+        """Saves chats, users and memberships and removes memberships in one transaction."""
+        links_table = self.tables.link_bot_chats_id__bot_users_id
+        with self.engine.begin() as conn:
+            self.upsert(conn, self.tables.bot_chats, list(chats), ["title"])
+            self.upsert(conn, self.tables.bot_users, list(users), ["first_name", "last_name", "username"])
+            self.insert_ignore(conn, links_table,
+                               [{"chat_id": chat_id, "user_id": user_id} for chat_id, user_id in links])
+
+            unlinks = list(unlinks)
+            for start in range(0, len(unlinks), self.backend.max_parameters // 2):
+                conn.execute(
+                        delete(links_table).where(
+                                tuple_(links_table.c.chat_id, links_table.c.user_id).in_(
+                                        unlinks[start:start + self.backend.max_parameters // 2]
+                                )
+                        )
+                )
+
+    def enabled_plugins(self) -> List[str]:
+        """Returns the names of the enabled user plugins."""
+        with self.engine.begin() as conn:
+            return [row.name for row in conn.execute(
+                    select(self.tables.bot_plugins.c.name).where(self.tables.bot_plugins.c.enabled == 1)
+            )]
+
+    def is_plugin_enabled(self, name: str) -> bool:
+        with self.engine.begin() as conn:
+            return bool(conn.execute(
+                    select(self.tables.bot_plugins.c.enabled).where(self.tables.bot_plugins.c.name == name)
+            ).scalar())
+
+    def set_plugin_enabled(self, name: str, enabled: bool) -> None:
+        """Enabling adds the plugin if it is missing, disabling only updates known plugins, so mistyped names
+        aren't added."""
+        with self.engine.begin() as conn:
+            if enabled:
+                self.upsert(conn, self.tables.bot_plugins, [{"name": name, "enabled": 1}], ["enabled"])
+            else:
+                conn.execute(
+                        update(self.tables.bot_plugins).where(self.tables.bot_plugins.c.name == name).values(enabled=0)
+                )
+
+    def chat_blacklist(self) -> Dict[int, Set[str]]:
+        """Returns the plugins which are disabled per chat."""
+        chat_blacklist: Dict[int, Set[str]] = {}
+        with self.engine.begin() as conn:
+            for row in conn.execute(select(self.tables.bot_plugins_chat_blacklist)):
+                chat_blacklist.setdefault(row.chat_id, set()).add(row.disabled_plugin)
+        return chat_blacklist
+
+    def disable_plugin_for_chat(self, chat_id: int, name: str, title: Optional[str] = None) -> bool:
+        """Returns False if the plugin was already disabled for the chat. Saves the chat if it isn't yet."""
+        blacklist = self.tables.bot_plugins_chat_blacklist
+        with self.engine.begin() as conn:
+            if conn.execute(
+                    select(blacklist.c.chat_id).where(
+                            blacklist.c.chat_id == chat_id,
+                            blacklist.c.disabled_plugin == name
+                    )
+            ).first():
+                return False
+            # The chat's bookkeeping may not be written yet
+            self.insert_ignore(conn, self.tables.bot_chats, [{"id": chat_id, "title": title}])
+            self.insert_ignore(conn, blacklist, [{"chat_id": chat_id, "disabled_plugin": name}])
+            return True
+
+    def enable_plugin_for_chat(self, chat_id: int, name: str) -> bool:
+        """Returns False if the plugin wasn't disabled for the chat."""
+        with self.engine.begin() as conn:
+            return bool(conn.execute(
+                    delete(self.tables.bot_plugins_chat_blacklist).where(
+                            self.tables.bot_plugins_chat_blacklist.c.chat_id == chat_id,
+                            self.tables.bot_plugins_chat_blacklist.c.disabled_plugin == name
+                    )
+            ).rowcount)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the connection pool metrics."""
+        if isinstance(self.engine.pool, MonitoredQueuePool):
+            return self.engine.pool.stats()
+        return {}
+
+    def available_migrations(self) -> Set[str]:
+        """Returns the IDs of the migration files, without parsing them."""
+        return {os.path.splitext(filename)[0] for filename in os.listdir(self.MIGRATIONS_PATH)
+                if filename.endswith((".sql", ".py")) and not filename.endswith((".rollback.sql", ".rollback.py"))}
 
-        self.engine = create_engine(self.connection_string, echo=False, future=True)
-        self.tables = Tables(self.engine)
+    def applied_migrations(self) -> Optional[Set[str]]:
+        """Returns the IDs of the applied migrations or None if yoyo's table doesn't exist yet."""
+        try:
+            with self.engine.connect() as conn:
+                migrations = sqlalchemy.table(yoyo.default_migration_table, sqlalchemy.column("migration_id"))
+                return {row.migration_id for row in conn.execute(select(migrations.c.migration_id))}
+        except DBAPIError:
+            return None
 
     def migrate(self):
         """Starts yoyo-migrations."""
         backend = yoyo.get_backend(self.connection_string)
-        migrations = yoyo.read_migrations(os.path.join("database", "migrations"))
+        migrations = yoyo.read_migrations(self.MIGRATIONS_PATH)
         with backend.lock():
             backend.apply_migrations(backend.to_apply(migrations))
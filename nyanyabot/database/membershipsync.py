@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from nyanyabot.database.writebehind import WriteBehindQueue
+
+
+class MembershipSync:
+    """
+    Collects joins and leaves from new_chat_members and left_chat_member messages per chat and hands them to
+    the WriteBehindQueue in batches. A chat's events are held for ``window`` seconds after its first pending
+    event, so a raid or mass leave is written as one multi-row upsert and one delete instead of a transaction
+    per service message. The latest event per member wins, so a join followed by a leave only deletes the
+    membership and a leave followed by a join only saves it. A chat is handed over early once ``batch_size``
+    of its events are pending.
+
+    If ``window`` is 0, events are passed to the WriteBehindQueue immediately.
+
+    Args:
+        bookkeeping (:obj:`WriteBehindQueue`): Queue which writes the merged events
+        window (:obj:`float`, optional): Seconds to collect the events of a chat (defaults to 0.5)
+        batch_size (:obj:`int`, optional): Number of pending events of a chat that trigger a hand-over
+            (defaults to 500)
+    """
+
+    def __init__(self, bookkeeping: WriteBehindQueue, window: float = 0.5, batch_size: int = 500):
+        self.logger = logging.getLogger(__name__)
+        self.bookkeeping = bookkeeping
+        self.window = window
+        self.batch_size = batch_size
+
+        # Per chat: user ID -> user record for joins, None for leaves
+        self._events: Dict[int, Dict[int, Optional[Dict[str, Any]]]] = {}
+        self._deadlines: Dict[int, float] = {}
+
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        # Metrics
+        self.events = 0
+        self.events_merged = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of membership events waiting to be handed over."""
+        return sum(len(events) for events in self._events.values())
+
+    def join(self,
+             chat_id: int,
+             user_id: int,
+             first_name: Optional[str],
+             last_name: Optional[str],
+             username: Optional[str]) -> None:
+        self._add(chat_id, user_id, {
+            "id":         user_id,
+            "first_name": first_name,
+            "last_name":  last_name,
+            "username":   username
+        })
+
+    def leave(self, chat_id: int, user_id: int) -> None:
+        self._add(chat_id, user_id, None)
+
+    def _add(self, chat_id: int, user_id: int, user: Optional[Dict[str, Any]]) -> None:
+        if self.window <= 0 or not self._running:
+            self._hand_over([(chat_id, {user_id: user})])
+            return
+
+        with self._condition:
+            self.events += 1
+            events = self._events.setdefault(chat_id, {})
+            if user_id in events:
+                self.events_merged += 1
+                del events[user_id]  # Keep the order of arrival for the hand-over
+            events[user_id] = user
+
+            if chat_id not in self._deadlines:
+                self._deadlines[chat_id] = time.monotonic() + self.window
+                self._condition.notify_all()
+            elif len(events) >= self.batch_size:
+                self._deadlines[chat_id] = 0.0
+                self._condition.notify_all()
+
+    def flush(self, everything: bool = False) -> None:
+        """Hands the events of all chats whose window has passed to the WriteBehindQueue, or of all chats if
+        ``everything`` is set."""
+        now = time.monotonic()
+        with self._condition:
+            due = [chat_id for chat_id, deadline in self._deadlines.items() if everything or deadline <= now]
+            batches = []
+            for chat_id in due:
+                del self._deadlines[chat_id]
+                batches.append((chat_id, self._events.pop(chat_id)))
+
+        if batches:
+            self._hand_over(batches)
+
+    def _hand_over(self, batches: List[Tuple[int, Dict[int, Optional[Dict[str, Any]]]]]) -> None:
+        count = 0
+        for chat_id, events in batches:
+            for user_id, user in events.items():
+                if user:
+                    self.bookkeeping.save_user(user_id, user["first_name"], user["last_name"], user["username"])
+                    self.bookkeeping.add_member(chat_id, user_id)
+                else:
+                    self.bookkeeping.remove_member(chat_id, user_id)
+            count += len(events)
+
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, count)
+        self.logger.debug("Handing over %s membership events of %s chats", count, len(batches))
+        self.bookkeeping.commit()
+
+    def start(self) -> None:
+        """Starts the background thread if a window is set."""
+        if self.window <= 0 or self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="MembershipSync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread and hands over all remaining events."""
+        if self._running:
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+
+        self.flush(everything=True)
+
+    def _run(self) -> None:
+        while self._running:
+            with self._condition:
+                timeout = min(self._deadlines.values()) - time.monotonic() if self._deadlines else None
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+
+            try:
+                self.flush()
+            except Exception:
+                # Keep the thread alive, the WriteBehindQueue requeues records on connection errors and drops
+                # records which fail on their own
+                self.logger.exception("Handing over membership events failed")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the membership sync metrics."""
+        return {
+            "depth":         self.depth,
+            "events":        self.events,
+            "events_merged": self.events_merged,
+            "batches":       self.batches,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,60 @@
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class MonitoredQueuePool(QueuePool):  # type: ignore[misc]
+    """
+    Extends sqlalchemy.pool.QueuePool. Records how long checkouts wait for a connection and how often the pool
+    is exhausted, i.e. all connections including the overflow are checked out when one is requested.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self.checkouts = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self) -> Any:
+        exhausted = 0 <= self._max_overflow and self.checkedout() >= self.size() + self._max_overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.exhausted += exhausted
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def recreate(self) -> 'MonitoredQueuePool':
+        pool = super().recreate()
+        pool.checkouts, pool.exhausted, pool.timeouts = self.checkouts, self.exhausted, self.timeouts
+        pool.total_wait, pool.max_wait = self.total_wait, self.max_wait
+        return pool
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the pool metrics."""
+        return {
+            "size":         self.size(),
+            "checked_out":  self.checkedout(),
+            "overflow":     max(0, self.overflow()),
+            "checkouts":    self.checkouts,
+            "exhausted":    self.exhausted,
+            "timeouts":     self.timeouts,
+            "average_wait": self.total_wait / self.checkouts if self.checkouts else 0.0,
+            "max_wait":     self.max_wait,
+        }
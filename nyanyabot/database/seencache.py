@@ -0,0 +1,69 @@
+from typing import Any, Dict, Hashable, Optional
+
+from nyanyabot.core.lrucache import LRUCache
+
+
+class SeenCache:
+    """
+    Remembers which chats, users and memberships have already been stored, so unchanged records
+    are not written to the database again. Chats and users are stored with a fingerprint of their data,
+    so a record is written again as soon as e.g. the username changes or the entry expired.
+
+    Args:
+        max_size (:obj:`int`, optional): Maximum number of cached entries, 0 disables the cache
+            (defaults to 10000)
+        ttl (:obj:`float`, optional): Seconds after which an entry is written again (defaults to 3600)
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        self.enabled = max_size > 0
+        self.cache = LRUCache(max_size, ttl)
+
+        # Metrics
+        self.skipped_writes = 0
+        self.writes = 0
+
+    def _changed(self, key: Hashable, fingerprint: Any) -> bool:
+        if self.enabled and self.cache.get(key) == fingerprint:
+            self.skipped_writes += 1
+            return False
+
+        self.writes += 1
+        if self.enabled:
+            self.cache.put(key, fingerprint)
+        return True
+
+    def chat_changed(self, chat_id: int, title: Optional[str]) -> bool:
+        """Returns True if the chat has to be written."""
+        return self._changed(("chat", chat_id), title)
+
+    def user_changed(self,
+                     user_id: int,
+                     first_name: Optional[str],
+                     last_name: Optional[str],
+                     username: Optional[str]) -> bool:
+        """Returns True if the user has to be written."""
+        return self._changed(("user", user_id), (first_name, last_name, username))
+
+    def member_changed(self, chat_id: int, user_id: int) -> bool:
+        """Returns True if the user-chat-relationship has to be written."""
+        return self._changed(("member", chat_id, user_id), True)
+
+    def forget_chat(self, chat_id: int) -> None:
+        self.cache.pop(("chat", chat_id))
+
+    def forget_user(self, user_id: int) -> None:
+        self.cache.pop(("user", user_id))
+
+    def forget_member(self, chat_id: int, user_id: int) -> None:
+        self.cache.pop(("member", chat_id, user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the cache metrics."""
+        total = self.skipped_writes + self.writes
+        return {
+            **self.cache.stats(),
+            "writes":         self.writes,
+            "skipped_writes": self.skipped_writes,
+            "skip_rate":      self.skipped_writes / total if total else 0.0,
+        }
@@ -1,21 +1,62 @@
-from sqlalchemy import MetaData, Table
+from typing import Optional
+
+from sqlalchemy import BigInteger, Column, ForeignKey, MetaData, SmallInteger, String, Table
 from sqlalchemy import engine
 
 
 class Tables:
     """
-    Describes the database tables.
+    Describes the database tables. The tables are declared here to match the migrations up to
+    ``MIGRATION_VERSION``, so no reflection queries are needed on startup. If the database has
+    a different schema version, the tables are reflected instead.
 
     Args:
-        db_engine (:obj:`engine.Engine`): SQLAlchemy database engine
+        db_engine (:obj:`engine.Engine`, optional): SQLAlchemy database engine, required for reflection
+        reflect (:obj:`bool`, optional): Reflect the tables from the database (defaults to False)
     """
 
-    def __init__(self, db_engine: engine.Engine):
-        metadata = MetaData()
+    MIGRATION_VERSION = "0002.plugins"
+
+    def __init__(self, db_engine: Optional[engine.Engine] = None, reflect: bool = False):
+        metadata = self.metadata = MetaData()
+
+        if reflect:
+            self.bot_chats = Table("bot_chats", metadata, autoload_with=db_engine)
+            self.bot_users = Table("bot_users", metadata, autoload_with=db_engine)
+            self.link_bot_chats_id__bot_users_id = Table("lnk_bot_chats_id__bot_users_id", metadata,
+                                                         autoload_with=db_engine)
+            self.bot_plugins = Table("bot_plugins", metadata, autoload_with=db_engine)
+            self.bot_plugins_chat_blacklist = Table("bot_plugins_chat_blacklist", metadata, autoload_with=db_engine)
+            return
 
-        self.bot_chats = Table("bot_chats", metadata, autoload_with=db_engine)
-        self.bot_users = Table("bot_users", metadata, autoload_with=db_engine)
-        self.link_bot_chats_id__bot_users_id = Table("lnk_bot_chats_id__bot_users_id", metadata,
-                                                     autoload_with=db_engine)
-        self.bot_plugins = Table("bot_plugins", metadata, autoload_with=db_engine)
-        self.bot_plugins_chat_blacklist = Table("bot_plugins_chat_blacklist", metadata, autoload_with=db_engine)
+        self.bot_chats = Table(
+                "bot_chats", metadata,
+                Column("id", BigInteger, primary_key=True, autoincrement=False),
+                Column("title", String(255)),
+                Column("whitelisted", SmallInteger, nullable=False, server_default="0"),
+        )
+        self.bot_users = Table(
+                "bot_users", metadata,
+                Column("id", BigInteger, primary_key=True, autoincrement=False),
+                Column("first_name", String(255)),
+                Column("last_name", String(255)),
+                Column("username", String(50), index=True),
+                Column("whitelisted", SmallInteger, nullable=False, server_default="0"),
+                Column("blocked", SmallInteger, nullable=False, server_default="0"),
+        )
+        self.link_bot_chats_id__bot_users_id = Table(
+                "lnk_bot_chats_id__bot_users_id", metadata,
+                Column("chat_id", BigInteger, ForeignKey("bot_chats.id"), primary_key=True, autoincrement=False),
+                Column("user_id", BigInteger, ForeignKey("bot_users.id"), primary_key=True, autoincrement=False),
+        )
+        self.bot_plugins = Table(
+                "bot_plugins", metadata,
+                Column("name", String(50), primary_key=True),
+                Column("enabled", SmallInteger, nullable=False, server_default="0"),
+        )
+        self.bot_plugins_chat_blacklist = Table(
+                "bot_plugins_chat_blacklist", metadata,
+                Column("chat_id", BigInteger, ForeignKey("bot_chats.id", ondelete="CASCADE"), primary_key=True,
+                       autoincrement=False),
+                Column("disabled_plugin", String(50), primary_key=True),
+        )
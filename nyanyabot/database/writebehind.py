@@ -0,0 +1,287 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from nyanyabot.database.database import Database
+from nyanyabot.database.seencache import SeenCache
+
+Batch = Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]], Set[Tuple[int, int]], Set[Tuple[int, int]]]
+
+
+class WriteBehindQueue:
+    """
+    Collects chat, user and membership records in memory and writes them to the database in batches.
+    Duplicate records are merged, so only the latest state of each row is written. A flush is triggered when
+    ``batch_size`` records are pending or ``flush_interval`` seconds have passed. Producers are blocked when
+    ``max_pending`` records are waiting to be written.
+
+    If ``write_behind`` is disabled, records are written synchronously on every ``commit()``.
+
+    A failed batch is requeued. After ``max_retries`` failed flushes in a row, the batch is written record by
+    record and records the database rejects (e.g. foreign key violations or oversized values) are dropped, so
+    one bad record can't block all others. Dropped records are removed from the ``seen_cache``, so they are
+    written again the next time they are seen.
+
+    Args:
+        database (:obj:`Database`): Database instance
+        write_behind (:obj:`bool`, optional): Defer writes to a background thread (defaults to False)
+        batch_size (:obj:`int`, optional): Number of pending records that trigger a flush (defaults to 500)
+        flush_interval (:obj:`float`, optional): Maximum seconds between flushes (defaults to 1.0)
+        max_pending (:obj:`int`, optional): Number of pending records before producers are blocked
+            (defaults to 5000)
+        max_retries (:obj:`int`, optional): Failed flushes in a row after which records are written one by one
+            (defaults to 3)
+        seen_cache (:obj:`SeenCache`, optional): Cache of written records to forget dropped records in
+    """
+
+    def __init__(self,
+                 database: Database,
+                 *,
+                 write_behind: bool = False,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 max_pending: int = 5000,
+                 max_retries: int = 3,
+                 seen_cache: Optional[SeenCache] = None):
+        self.logger = logging.getLogger(__name__)
+        self.database = database
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self.max_retries = max_retries
+        self.seen_cache = seen_cache
+        self._failures = 0  # Failed flushes in a row
+
+        self._chats: Dict[int, Dict[str, Any]] = {}
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._links: Set[Tuple[int, int]] = set()
+        self._unlinks: Set[Tuple[int, int]] = set()
+
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        # Metrics
+        self.flushes = 0
+        self.flush_errors = 0
+        self.records_dropped = 0
+        self.records_flushed = 0
+        self.records_merged = 0
+        self.backpressure_waits = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of records waiting to be written."""
+        return len(self._chats) + len(self._users) + len(self._links) + len(self._unlinks)
+
+    def save_chat(self, chat_id: int, title: Optional[str]) -> None:
+        with self._condition:
+            if chat_id in self._chats:
+                self.records_merged += 1
+            self._chats[chat_id] = {"id": chat_id, "title": title}
+
+    def save_user(self,
+                  user_id: int,
+                  first_name: Optional[str],
+                  last_name: Optional[str],
+                  username: Optional[str]) -> None:
+        with self._condition:
+            if user_id in self._users:
+                self.records_merged += 1
+            self._users[user_id] = {
+                "id":         user_id,
+                "first_name": first_name,
+                "last_name":  last_name,
+                "username":   username
+            }
+
+    def add_member(self, chat_id: int, user_id: int) -> None:
+        with self._condition:
+            if (chat_id, user_id) in self._links:
+                self.records_merged += 1
+            self._unlinks.discard((chat_id, user_id))
+            self._links.add((chat_id, user_id))
+
+    def remove_member(self, chat_id: int, user_id: int) -> None:
+        with self._condition:
+            if (chat_id, user_id) in self._unlinks:
+                self.records_merged += 1
+            self._links.discard((chat_id, user_id))
+            self._unlinks.add((chat_id, user_id))
+
+    def commit(self) -> None:
+        """Marks the end of the records for one update. Flushes synchronously if write-behind is disabled,
+        otherwise wakes up the flusher when the batch is full and blocks while the queue is over its limit."""
+        if not self.write_behind or not self._running:
+            self.flush()
+            return
+
+        with self._condition:
+            depth = self.depth
+            if depth >= self.batch_size:
+                self._condition.notify_all()
+            if depth >= self.max_pending:
+                self.backpressure_waits += 1
+                self.logger.warning("Write-behind queue is full (%s records), blocking", depth)
+                while self._running and self.depth >= self.max_pending:
+                    self._condition.wait(self.flush_interval)
+
+    def flush(self) -> None:
+        """Writes all pending records in one transaction."""
+        with self._flush_lock:
+            with self._condition:
+                chats, self._chats = self._chats, {}
+                users, self._users = self._users, {}
+                links, self._links = self._links, set()
+                unlinks, self._unlinks = self._unlinks, set()
+
+            count = len(chats) + len(users) + len(links) + len(unlinks)
+            if not count:
+                return
+
+            start = time.perf_counter()
+            try:
+                self._write(chats, users, links, unlinks)
+                self._failures = 0
+            except Exception:
+                self.flush_errors += 1
+                self._failures += 1
+                if self._failures < self.max_retries:
+                    self.logger.exception("Flushing %s bookkeeping records failed, requeueing", count)
+                    self._requeue(chats, users, links, unlinks)
+                    raise
+                self.logger.exception("Flushing %s bookkeeping records failed %s times, writing them one by one",
+                                      count, self._failures)
+                self._write_each(chats, users, links, unlinks)
+                self._failures = 0
+            finally:
+                with self._condition:
+                    self._condition.notify_all()
+
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.records_flushed += count
+            self.last_flush_latency = latency
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.logger.debug("Flushed %s bookkeeping records in %.1f ms", count, latency * 1000)
+
+    def _write(self,
+               chats: Dict[int, Dict[str, Any]],
+               users: Dict[int, Dict[str, Any]],
+               links: Set[Tuple[int, int]],
+               unlinks: Set[Tuple[int, int]]) -> None:
+        self.database.write_bookkeeping(chats.values(), users.values(), links, unlinks)
+
+    def _write_each(self,
+                    chats: Dict[int, Dict[str, Any]],
+                    users: Dict[int, Dict[str, Any]],
+                    links: Set[Tuple[int, int]],
+                    unlinks: Set[Tuple[int, int]]) -> None:
+        """Writes records one by one and drops those the database rejects. Other errors, e.g. a lost
+        connection, requeue the records which are left and are raised."""
+        # Chats and users first, memberships refer to them
+        records: List[Batch] = [({chat_id: chat}, {}, set(), set()) for chat_id, chat in chats.items()]
+        records += [({}, {user_id: user}, set(), set()) for user_id, user in users.items()]
+        records += [({}, {}, {link}, set()) for link in links]
+        records += [({}, {}, set(), {unlink}) for unlink in unlinks]
+        for num, record in enumerate(records):
+            try:
+                self._write(*record)
+            except (IntegrityError, DataError) as err:
+                self.records_dropped += 1
+                self.logger.error("Dropping bookkeeping record %s: %s", record, err.orig)
+                self._forget(*record)
+            except Exception:
+                for left in records[num:]:
+                    self._requeue(*left)
+                raise
+
+    def _forget(self,
+                chats: Dict[int, Dict[str, Any]],
+                users: Dict[int, Dict[str, Any]],
+                links: Set[Tuple[int, int]],
+                _: Set[Tuple[int, int]]) -> None:
+        """Removes dropped records from the seen cache, so they are saved again."""
+        if not self.seen_cache:
+            return
+        for chat_id in chats:
+            self.seen_cache.forget_chat(chat_id)
+        for user_id in users:
+            self.seen_cache.forget_user(user_id)
+        for chat_id, user_id in links:
+            self.seen_cache.forget_member(chat_id, user_id)
+
+    def _requeue(self,
+                 chats: Dict[int, Dict[str, Any]],
+                 users: Dict[int, Dict[str, Any]],
+                 links: Set[Tuple[int, int]],
+                 unlinks: Set[Tuple[int, int]]) -> None:
+        """Puts records of a failed flush back, without overwriting newer records."""
+        with self._condition:
+            for chat_id, chat in chats.items():
+                self._chats.setdefault(chat_id, chat)
+            for user_id, user in users.items():
+                self._users.setdefault(user_id, user)
+            for link in links:
+                if link not in self._unlinks:
+                    self._links.add(link)
+            for unlink in unlinks:
+                if unlink not in self._links:
+                    self._unlinks.add(unlink)
+
+    def start(self) -> None:
+        """Starts the background flusher if write-behind is enabled."""
+        if not self.write_behind or self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="WriteBehindQueue", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background flusher and writes all remaining records."""
+        if self._running:
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+
+        self.flush()
+
+    def _run(self) -> None:
+        while self._running:
+            with self._condition:
+                if self.depth < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+
+            try:
+                self.flush()
+            except Exception:
+                # Already logged, records are requeued and written on the next flush
+                time.sleep(self.flush_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the queue metrics."""
+        return {
+            "depth":                  self.depth,
+            "flushes":                self.flushes,
+            "flush_errors":           self.flush_errors,
+            "records_dropped":        self.records_dropped,
+            "records_flushed":        self.records_flushed,
+            "records_merged":         self.records_merged,
+            "backpressure_waits":     self.backpressure_waits,
+            "last_flush_latency":     self.last_flush_latency,
+            "max_flush_latency":      self.max_flush_latency,
+            "average_flush_latency":  self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
@@ -1,12 +1,16 @@
+import asyncio
+import functools
 import logging
 import re
-from typing import Any, Union, Pattern, Optional
+from typing import Any, Callable, Union, Pattern, Optional
 
 from telegram import Update, TelegramError
 from telegram.ext import callbackqueryhandler
 from telegram.ext.handler import RT
 from telegram.ext.utils.promise import Promise
 
+from nyanyabot.core.cooldown import Cooldown
+from nyanyabot.core.metrics import measure
 from nyanyabot.core.util import Util, TimeUtil
 
 
@@ -15,27 +19,34 @@ class CallbackQueryHandler(callbackqueryhandler.CallbackQueryHandler):
     Extends telegram.ext.callbackqueryhandler.CallbackQueryHandler
     Added arguments:
         case_sensitive (optional[bool]): Be case sensitive when matching. Default: ``True``
-        cooldown (optional[float]): Time between message and when the query should pe processed. Default: ``0.0``
-        delete_button (optional[bool]): Delete original callback query button. Default: ``True``
+        cooldown (optional[Union[float, Cooldown]]): A float is the time between message and when the query
+            should pe processed. A Cooldown limits how often a user may press the plugin's buttons in a chat,
+            presses on cooldown are answered without running the callback. Default: ``0.0``
+        delete_button (optional[bool]): Delete original callback query button. The buttons are removed in the
+            background, unless the callback edits the message first, and further presses on the message are
+            ignored until both are done. Default: ``True``
         group_only (optional[bool]): Only run this handler in chat groups. Default: ``False``
         privileged (optional[bool]): Shall this only match when sender is an admin? Default: ``False``
         log_to_debug (optional[bool]): Logs to DEBUG instead of INFO. Default: ``False``
+        timeout (optional[float]): Seconds the callback may run before it is abandoned. Default: plugin timeout
     """
     logger = logging.getLogger(__name__)
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
             self,
             *args: Any,
             pattern: Union[str, Pattern] = None,
             case_sensitive: bool = True,
-            cooldown: float = 0.0,
+            cooldown: Union[float, Cooldown] = 0.0,
             delete_button: bool = True,
             group_only: bool = False,
             privileged: bool = False,
             log_to_debug: bool = False,
+            timeout: Optional[float] = None,
             **kwargs: Any,
     ):
         super().__init__(*args, **kwargs)
+        self.callback = self.release_after(self.callback)
         if isinstance(pattern, str):
             if case_sensitive:
                 self.pattern = re.compile(pattern)
@@ -47,15 +58,19 @@ class CallbackQueryHandler(callbackqueryhandler.CallbackQueryHandler):
             self.pattern = pattern
         self.group_only = group_only
         self.privileged = privileged
-        self.cooldown = cooldown
+        # A float keeps its original meaning of a minimum message age
+        self.cooldown = 0.0 if isinstance(cooldown, Cooldown) else cooldown
+        self.usage_cooldown = cooldown if isinstance(cooldown, Cooldown) else None
         self.delete_button = delete_button
         self.log_to_debug = log_to_debug
+        self.timeout = timeout
         self.name = ""
         self.nyanyabot = None  # type: Any
         self.group = 0  # Is set at runtime
 
     def check_update(self, update: object) -> Optional[Union[bool, object]]:
-        return_args = super().check_update(update)
+        with measure(self, "match"):
+            return_args = super().check_update(update)
 
         if return_args and isinstance(update, Update) and update.callback_query:  # Will be handled by plugin
             if self.group_only and not Util.is_group(update):
@@ -68,7 +83,10 @@ class CallbackQueryHandler(callbackqueryhandler.CallbackQueryHandler):
 
             if self.privileged:
                 self.logger.debug("Superuser check")
-                if not update.effective_user or update.effective_user.id not in self.nyanyabot.config.superuser:
+                with measure(self, "superuser"):
+                    is_superuser = bool(update.effective_user) and \
+                                   update.effective_user.id in self.nyanyabot.config.superuser  # type: ignore
+                if not is_superuser:
                     self.logger.debug("Privileged handler and user not a superuser")
                     update.callback_query.answer(
                             text="Du kannst dieses Plugin nicht nutzen, da es nur für Superuser zugelassen ist.",
@@ -78,33 +96,91 @@ class CallbackQueryHandler(callbackqueryhandler.CallbackQueryHandler):
 
             if update.effective_message and update.effective_message.date and self.cooldown > 0.0:
                 self.logger.debug("Cooldown check")
-                callback_time = update.effective_message.date
-                current_time = TimeUtil.utcnow()
-                time_passed = (current_time - callback_time).total_seconds()
+                with measure(self, "cooldown"):
+                    callback_time = update.effective_message.date
+                    current_time = TimeUtil.utcnow()
+                    time_passed = (current_time - callback_time).total_seconds()
                 if time_passed < self.cooldown:
-                    time_to_wait = str(round(self.cooldown - time_passed, 1)).replace(".", ",")
-                    update.callback_query.answer(
-                            text=f"🕒 Bitte warte noch {time_to_wait} Sekunden.",
-                            show_alert=True
-                    )
+                    self.answer_wait(update, self.cooldown - time_passed)
                     return False
 
             if Util.is_group(update):
                 self.logger.debug("Plugin-per-chat blacklist check")
-                if self.nyanyabot.plugin_loader.is_plugin_disabled_for_chat(
-                        update.effective_chat.id,  # type: ignore
-                        self.name
-                ):
+                with measure(self, "blacklist"):
+                    is_disabled = self.nyanyabot.plugin_loader.is_plugin_disabled_for_chat(
+                            update.effective_chat.id,  # type: ignore
+                            self.name
+                    )
+                if is_disabled:
                     update.callback_query.answer(
                             text="Dieses Plugin ist für diese Gruppe deaktiviert worden.",
                             show_alert=True
                     )
                     return False
 
-            return return_args
+            # Last, so only presses which would be handled count
+            if self.check_cooldown(update) and self.begin_press(update):
+                return return_args
 
         return False
 
+    def check_cooldown(self, update: Update) -> bool:
+        """Records a use of the plugin, answers the press and returns False if it is on cooldown."""
+        if not self.usage_cooldown or not self.nyanyabot:
+            return True
+
+        with measure(self, "cooldown"):
+            wait = self.nyanyabot.cooldowns.hit(self.name, update, self.usage_cooldown)
+        if wait:
+            self.logger.debug("On cooldown for %.1f seconds", wait)
+            self.answer_wait(update, wait)
+            return False
+        return True
+
+    def begin_press(self, update: Update) -> bool:
+        """Returns False and answers the press if the button was already pressed and is being handled."""
+        if not self.delete_button or not self.nyanyabot:
+            return True
+
+        if self.nyanyabot.button_cleaner.begin(update.callback_query):
+            return True
+        self.logger.debug("Button was already pressed")
+        update.callback_query.answer()
+        return False
+
+    def end_press(self, update: Update) -> None:
+        if self.delete_button and self.nyanyabot and isinstance(update, Update) and update.callback_query:
+            self.nyanyabot.button_cleaner.end(update.callback_query)
+
+    def release_after(self, callback: Callable) -> Callable:
+        """Wraps the callback so its message can be pressed again once it is done."""
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def async_wrapper(update: Update, *args: Any, **kwargs: Any) -> Any:
+                try:
+                    return await callback(update, *args, **kwargs)
+                finally:
+                    self.end_press(update)
+
+            return async_wrapper
+
+        @functools.wraps(callback)
+        def wrapper(update: Update, *args: Any, **kwargs: Any) -> Any:
+            try:
+                return callback(update, *args, **kwargs)
+            finally:
+                self.end_press(update)
+
+        return wrapper
+
+    @staticmethod
+    def answer_wait(update: Update, seconds: float) -> None:
+        time_to_wait = str(round(seconds, 1)).replace(".", ",")
+        update.callback_query.answer(
+                text=f"🕒 Bitte warte noch {time_to_wait} Sekunden.",
+                show_alert=True
+        )
+
     # pylint: disable=signature-differs
     def handle_update(
             self,
@@ -117,12 +193,14 @@ class CallbackQueryHandler(callbackqueryhandler.CallbackQueryHandler):
         else:
             self.logger.info(self)
 
-        if self.delete_button and isinstance(update, Update):
-            try:
-                if update.callback_query:
+        if self.delete_button and isinstance(update, Update) and update.callback_query:
+            if self.nyanyabot:
+                self.nyanyabot.button_cleaner.remove_buttons(update.callback_query)
+            else:
+                try:
                     update.callback_query.edit_message_reply_markup(reply_markup=None)
-            except TelegramError:
-                pass
+                except TelegramError:
+                    pass
 
         return super().handle_update(update, *args, **kwargs)
 
@@ -1,12 +1,15 @@
 import logging
 import re
-from typing import Any, Union, Pattern, Optional, Match
+from typing import Any, Callable, Hashable, Union, Pattern, Optional, Match
 
-from telegram import Update
+from telegram import InlineQuery, Update
 from telegram.bot import RT
 from telegram.ext import inlinequeryhandler
 from telegram.ext.utils.promise import Promise
 
+from nyanyabot.core.inlinecache import InlineResultCache
+from nyanyabot.core.metrics import measure
+
 
 class InlineQueryHandler(inlinequeryhandler.InlineQueryHandler):
     """
@@ -15,16 +18,27 @@ class InlineQueryHandler(inlinequeryhandler.InlineQueryHandler):
         case_sensitive (optional[bool]): Be case sensitive when matching. Default: ``False``
         privileged (optional[bool]): Shall this only match when sender is an admin? Default: ``False``
         log_to_debug (optional[bool]): Logs to DEBUG instead of INFO. Default: ``False``
+        timeout (optional[float]): Seconds the callback may run before it is abandoned. Default: plugin timeout
+        cache_time (optional[int]): Seconds for which answers are cached, also sent to Telegram as ``cache_time``.
+            ``0`` disables the cache. Default: ``inline_cache.ttl`` from the config
+        is_personal (optional[bool]): Results depend on the user, cache them per user. Answers with
+            ``is_personal=True`` from handlers without it aren't cached. Default: ``False``
+        debounce (optional[float]): Wait until a user stopped typing for this many seconds and only handle
+            their latest query. Default: ``0.0``
     """
     logger = logging.getLogger(__name__)
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
             self,
             *args: Any,
             pattern: Union[str, Pattern] = None,
             case_sensitive: bool = False,
             privileged: bool = False,
             log_to_debug: bool = False,
+            timeout: Optional[float] = None,
+            cache_time: Optional[int] = None,
+            is_personal: bool = False,
+            debounce: float = 0.0,
             **kwargs: Any
     ):
         super().__init__(*args, **kwargs)
@@ -37,29 +51,90 @@ class InlineQueryHandler(inlinequeryhandler.InlineQueryHandler):
             if case_sensitive:
                 raise ValueError("case_sensitive can't be set when pattern is already a compiled regex.")
             self.pattern = pattern
+        # Only queries of handlers which ignore case are normalized for the cache
+        self.ignore_case = bool(self.pattern and self.pattern.flags & re.IGNORECASE)
         self.privileged = privileged
         self.log_to_debug = log_to_debug
+        self.timeout = timeout
+        self.cache_time = cache_time
+        self.is_personal = is_personal
+        self.debounce = debounce
         self.name = ""
         self.nyanyabot = None  # type: Any
         self.group = 0  # Is set at runtime
 
     def check_update(self, update: object) -> Optional[Union[bool, Match]]:
-        return_args = super().check_update(update)
+        with measure(self, "match"):
+            return_args = super().check_update(update)
 
         if return_args and isinstance(update, Update) and update.inline_query:  # Will be handled by plugin
             if self.privileged:
                 self.logger.debug("Superuser check")
-                if not update.effective_user or update.effective_user.id not in self.nyanyabot.config.superuser:
+                with measure(self, "superuser"):
+                    is_superuser = bool(update.effective_user) and \
+                                   update.effective_user.id in self.nyanyabot.config.superuser  # type: ignore
+                if not is_superuser:
                     self.logger.debug("Privileged handler and user not a superuser")
-                    update.inline_query.answer(results=[], cache_time=5, is_personal=True)
+                    update.inline_query.answer(results=[], cache_time=self.get_cache_time() or 5, is_personal=True)
                     return False
             return return_args
 
         return False
 
+    def get_cache_time(self) -> int:
+        if self.cache_time is not None:
+            return self.cache_time
+        return self.nyanyabot.config.inline_cache_ttl if self.nyanyabot else 0
+
+    def caching_answer(self, cache: InlineResultCache, key: Hashable, inline_query: InlineQuery,
+                       cache_time: int) -> Callable[..., bool]:
+        """Returns a replacement for ``inline_query.answer`` which caches the results it answers with."""
+
+        def answer(results: Any, *args: Any, **kwargs: Any) -> bool:
+            if callable(results) or args:
+                # Paginated results depend on the offset and can't be replayed
+                cache.abort(key)
+                return InlineQuery.answer(inline_query, results, *args, **kwargs)
+
+            kwargs["cache_time"] = cache_time
+            if kwargs.get("is_personal") and not self.is_personal:
+                # The cache key doesn't include the user, so these results must not be shared
+                cache.abort(key)
+                return InlineQuery.answer(inline_query, results, **kwargs)
+
+            kwargs["is_personal"] = self.is_personal
+            try:
+                answered = InlineQuery.answer(inline_query, results, **kwargs)
+            except Exception:
+                cache.abort(key)
+                raise
+            cache.complete(key, results, kwargs, cache_time)
+            return answered
+
+        return answer
+
     # pylint: disable=signature-differs
     def handle_update(
             self,
+            update: Update,
+            *args: Any,
+            **kwargs: Any,
+    ) -> Union[RT, Promise]:
+        if self.debounce and self.nyanyabot and isinstance(update, Update) and update.inline_query:
+            self.nyanyabot.inline_debouncer.submit(
+                    (self.name, self.group, update.inline_query.from_user.id),
+                    self.debounce,
+                    self.handle_query,
+                    update,
+                    *args,
+                    **kwargs
+            )
+            return None  # type: ignore[return-value]
+        return self.handle_query(update, *args, **kwargs)
+
+    def handle_query(
+            self,
+            update: Update,
             *args: Any,
             **kwargs: Any,
     ) -> Union[RT, Promise]:
@@ -68,7 +143,32 @@ class InlineQueryHandler(inlinequeryhandler.InlineQueryHandler):
         else:
             self.logger.info(self)
 
-        return super().handle_update(*args, **kwargs)
+        cache_time = self.get_cache_time()
+        if not cache_time or not isinstance(update, Update) or not update.inline_query:
+            return super().handle_update(update, *args, **kwargs)
+
+        cache = self.nyanyabot.inline_cache
+        key = cache.key(self.name, update.inline_query, self.is_personal, self.ignore_case)
+        cached = cache.get(key)
+        if cached:
+            self.logger.debug("Answering inline query from cache")
+            cache.answer(update.inline_query, cached)
+            return None  # type: ignore[return-value]
+        if not cache.begin(key, update.inline_query):
+            self.logger.debug("Same inline query is already being computed")
+            return None  # type: ignore[return-value]
+
+        update.inline_query.answer = self.caching_answer(  # type: ignore[method-assign]
+                cache,
+                key,
+                update.inline_query,
+                cache_time
+        )
+        try:
+            return super().handle_update(update, *args, **kwargs)
+        except Exception:
+            cache.abort(key)
+            raise
 
     def __repr__(self):
         output = f"InlineQueryHandler for {self.name}"
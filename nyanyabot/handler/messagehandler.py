@@ -6,17 +6,24 @@ from telegram.ext import messagehandler
 from telegram.ext.handler import RT
 from telegram.ext.utils.promise import Promise
 
-from nyanyabot.core.util import Util
+from nyanyabot.core.cooldown import Cooldown
+from nyanyabot.core.metrics import measure
+from nyanyabot.core.updatefacts import UpdateFacts
 
 
 class MessageHandler(messagehandler.MessageHandler):
     """
     Extends telegram.ext.messagehandler.MessageHandler
+    Checks run cheapest-first on facts shared by all handlers (see UpdateFacts), the filters run last.
+    Captions are copied into the text before checking, so filters and callbacks see them as text.
     Added arguments:
         group_only (optional[bool]): Only run this handler in chat groups. Default: ``False``
         handle_edits (optional[bool]): Processes edited message if set to True. Default: ``False``
         privileged (optional[bool]): Shall this only match when sender is an admin? Default: ``False``
         log_to_debug (optional[bool]): Logs to DEBUG instead of INFO. Default: ``True``
+        timeout (optional[float]): Seconds the callback may run before it is abandoned. Default: plugin timeout
+        cooldown (optional[Union[float, Cooldown]]): Limits how often a user may use the plugin in a chat,
+            a float allows one use per that many seconds. Messages on cooldown are ignored. Default: ``0.0``
     """
     logger = logging.getLogger(__name__)
 
@@ -27,6 +34,8 @@ class MessageHandler(messagehandler.MessageHandler):
             handle_edits: bool = False,
             privileged: bool = False,
             log_to_debug: bool = True,
+            timeout: Optional[float] = None,
+            cooldown: Union[float, Cooldown] = 0.0,
             **kwargs: Any,
     ):
         super().__init__(*args, **kwargs)
@@ -34,46 +43,84 @@ class MessageHandler(messagehandler.MessageHandler):
         self.group_only = group_only
         self.privileged = privileged
         self.log_to_debug = log_to_debug
+        self.timeout = timeout
+        self.cooldown = Cooldown.of(cooldown)
         self.name = ""
         self.nyanyabot = None  # type: Any
         self.group = 0  # Is set at runtime
 
     def check_update(self, update: object) -> Optional[Union[bool, Dict[str, object]]]:
         if isinstance(update, Update) and update.effective_message:
-            if self.group_only and not Util.is_group(update):
-                self.logger.debug("group_only set to True and not in a group")
+            facts = UpdateFacts.of(update)
+            if not facts.is_message:
                 return False
 
+            # Add caption as text
+            if update.effective_message.caption:
+                update.effective_message.text = update.effective_message.caption
+
             if update.edited_message and not self.handle_edits:
                 self.logger.debug("Edited message, but shouldn't be handled")
                 return False
 
-            # Add caption as text
-            if update.effective_message.caption:
-                update.effective_message.text = update.effective_message.caption
+            if not self.is_allowed(update, facts):
+                return False
 
-            return_args = super().check_update(update)
-            if return_args:  # Will be handled by plugin
-                if self.privileged and update.effective_user:
-                    self.logger.debug("Superuser Check")
-                    if update.effective_user.id not in self.nyanyabot.config.superuser:
-                        self.logger.debug("Privileged handler and user not a superuser")
-                        return False
-
-                if Util.is_group(update):
-                    self.logger.debug("Plugin-per-chat blacklist check")
-                    if self.nyanyabot.plugin_loader.is_plugin_disabled_for_chat(
-                            update.effective_chat.id,  # type: ignore
-                            self.name
-                    ):
-                        return False
-
-                return return_args
+            with measure(self, "match"):
+                check = self.match(update, facts)
+
+            # Last, so only messages which would be handled count
+            if check and not self.check_cooldown(update):
+                return False
+            return check
         return False
 
+    def is_allowed(self, update: Update, facts: UpdateFacts) -> bool:
+        """Checks the chat type, superuser and blacklist restrictions."""
+        if self.group_only and not facts.is_group:
+            self.logger.debug("group_only set to True and not in a group")
+            return False
+
+        if self.privileged and update.effective_user:
+            with measure(self, "superuser"):
+                is_superuser = facts.is_superuser(self.nyanyabot.config.superuser)
+            if not is_superuser:
+                self.logger.debug("Privileged handler and user not a superuser")
+                return False
+
+        if facts.is_group and self.nyanyabot:
+            with measure(self, "blacklist"):
+                is_disabled = self.nyanyabot.plugin_loader.is_plugin_disabled_for_chat(
+                        update.effective_chat.id,  # type: ignore
+                        self.name
+                )
+            if is_disabled:
+                self.logger.debug("Plugin disabled in this chat")
+                return False
+
+        return True
+
+    def check_cooldown(self, update: Update) -> bool:
+        """Records a use of the plugin, returns False if it is on cooldown."""
+        if not self.cooldown or not self.nyanyabot:
+            return True
+
+        with measure(self, "cooldown"):
+            wait = self.nyanyabot.cooldowns.hit(self.name, update, self.cooldown)
+        if wait:
+            self.logger.debug("On cooldown for %.1f seconds", wait)
+            return False
+        return True
+
+    # pylint: disable=unused-argument
+    def match(self, update: Update, facts: UpdateFacts) -> Optional[Union[bool, Dict[str, object]]]:
+        """Runs the filters. Subclasses may use the precomputed facts instead."""
+        return super().check_update(update)  # type: ignore[return-value]
+
     # pylint: disable=signature-differs
     def handle_update(
             self,
+            update: Update,
             *args: Any,
             **kwargs: Any
     ) -> Union[RT, Promise]:
@@ -81,7 +128,7 @@ class MessageHandler(messagehandler.MessageHandler):
             self.logger.debug(self)
         else:
             self.logger.info(self)
-        return super().handle_update(*args, **kwargs)
+        return super().handle_update(update, *args, **kwargs)
 
     def __repr__(self):
         return f"MessageHandler for {self.name}: {self.filters}"
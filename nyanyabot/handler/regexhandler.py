@@ -1,15 +1,20 @@
 import logging
 import re
-from typing import Pattern, Any, Union
+from typing import Pattern, Any, Dict, Optional, Union
 
+from telegram import Update
 from telegram.ext import Filters
 
+from nyanyabot.core.patterns import literal_prefix
+from nyanyabot.core.updatefacts import UpdateFacts
 from nyanyabot.handler.messagehandler import MessageHandler
 
 
 class RegexHandler(MessageHandler):
     """
     Reintroduces telegram.ext.regexhandler.RegexHandler
+    Matches the text or caption. Texts which don't start with the pattern's literal prefix (e.g. "/list" for
+    ``^/list(?:@bot)?$``) are rejected without running the regex.
     Added arguments:
         case_sensitive (optional[bool]): Be case sensitive when matching. Default: ``False``
     """
@@ -32,6 +37,7 @@ class RegexHandler(MessageHandler):
             if case_sensitive:
                 raise ValueError("case_sensitive can't be set when pattern is already a compiled regex.")
             self.pattern = pattern
+        self.prefix, self.required, self.ignore_case = literal_prefix(self.pattern)
         super().__init__(
                 Filters.regex(self.pattern),
                 *args,
@@ -39,5 +45,18 @@ class RegexHandler(MessageHandler):
                 **kwargs
         )
 
+    # pylint: disable=unused-argument
+    def match(self, update: Update, facts: UpdateFacts) -> Optional[Union[bool, Dict[str, object]]]:
+        text = facts.text
+        if not text:
+            return False
+        if self.prefix and not facts.starts_with(self.prefix, self.ignore_case):
+            return False
+
+        match = self.pattern.search(text)
+        if match:
+            return {"matches": [match]}  # Same as Filters.regex
+        return False
+
     def __repr__(self):
         return f"RegexHandler for {self.name}: {self.pattern.pattern}"
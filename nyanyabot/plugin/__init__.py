@@ -1 +1 @@
-__all__ = ['plugin_manager']
+__all__ = ['plugin_manager', 'stats']
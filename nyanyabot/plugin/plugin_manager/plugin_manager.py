@@ -1,8 +1,6 @@
 import traceback
 from operator import attrgetter
 
-from sqlalchemy import select, update, delete
-from sqlalchemy.dialects.mysql import insert
 from telegram import Update, BotCommand, ChatAction
 from telegram.ext import CallbackContext
 
@@ -70,14 +68,8 @@ class PluginManager(Plugin):
         except ValueError:
             tg_update.effective_message.reply_text("❌ Plugin ist nicht aktiv.")
 
-        with self.db.engine.begin() as conn:
-            conn.execute(
-                    update(self.db.tables.bot_plugins).where(
-                            self.db.tables.bot_plugins.c.name == plg_name
-                    ).values(
-                            enabled=0
-                    )
-            )
+        self.db.set_plugin_enabled(plg_name, False)
+        self.pluginloader.plugins_changed()
 
     @Util.send_action(ChatAction.TYPING)
     def enable_plugin(self, tg_update: Update, context: CallbackContext) -> None:
@@ -87,14 +79,7 @@ class PluginManager(Plugin):
             tg_update.effective_message.reply_text("✅ Dies ist ein Core-Plugin, welches schon aktiv ist.")
             return
 
-        with self.db.engine.begin() as conn:
-            plg = conn.execute(
-                    select(self.db.tables.bot_plugins.c.enabled).where(
-                            self.db.tables.bot_plugins.c.name == plg_name
-                    )
-            ).fetchone()
-
-        if plg and plg.enabled:
+        if self.db.is_plugin_enabled(plg_name):
             tg_update.effective_message.reply_text("✅ Plugin ist bereits aktiv.")
             return
 
@@ -108,15 +93,8 @@ class PluginManager(Plugin):
             tg_update.effective_message.reply_text("❌ Plugin konnte nicht geladen werden.")
             return
 
-        with self.db.engine.begin() as conn:
-            conn.execute(
-                    insert(self.db.tables.bot_plugins).values(
-                            name=plg_name,
-                            enabled=1
-                    ).on_duplicate_key_update(
-                            enabled=1
-                    )
-            )
+        self.db.set_plugin_enabled(plg_name, True)
+        self.pluginloader.plugins_changed()
 
         tg_update.effective_message.reply_text("✅ Plugin wurde aktiviert.")
 
@@ -124,6 +102,7 @@ class PluginManager(Plugin):
     def reload_all_plugins(self, tg_update: Update, context: CallbackContext) -> None:
         message = tg_update.effective_message.reply_text("Alle Plugins werden neu geladen...")
         self.pluginloader.reload_all_plugins()
+        self.pluginloader.plugins_changed()
         message.edit_text("✅ Plugins neu geladen!")
 
     @Util.send_action(ChatAction.TYPING)
@@ -131,7 +110,8 @@ class PluginManager(Plugin):
         plg_name = context.match[1]
 
         message = tg_update.effective_message.reply_text("Plugin wird neu geladen...")
-        tg_update.effective_message.reply_chat_action(ChatAction.TYPING)
+        # The reply ended the action sent by the decorator
+        self.chat_action_sender.send(tg_update.effective_message.chat_id, ChatAction.TYPING, refresh=True)
 
         try:
             self.pluginloader.unload_plugin(plg_name)
@@ -143,6 +123,7 @@ class PluginManager(Plugin):
             self.pluginloader.load_plugin(f"nyanyabot.plugin.{plg_name}")
         else:
             self.pluginloader.load_plugin(f"plugins.{plg_name}")
+        self.pluginloader.plugins_changed()
 
         message.edit_text("✅ Plugin neu geladen!")
 
@@ -154,15 +135,11 @@ class PluginManager(Plugin):
             tg_update.effective_message.reply_text("❌ Dies ist ein Core-Plugin und kann nicht deaktiviert werden.")
             return
 
-        with self.db.engine.begin() as conn:
-            res = conn.execute(
-                    insert(self.db.tables.bot_plugins_chat_blacklist).values(
-                            chat_id=tg_update.effective_message.chat_id,
-                            disabled_plugin=plg_name
-                    ).prefix_with('IGNORE')
-            )
+        disabled = self.db.disable_plugin_for_chat(tg_update.effective_message.chat_id, plg_name,
+                                                   tg_update.effective_chat.title)
+        self.pluginloader.set_plugin_disabled_for_chat(tg_update.effective_message.chat_id, plg_name, True)
 
-        if res.rowcount:
+        if disabled:
             tg_update.effective_message.reply_text("✅ Plugin wurde für diesen Chat deaktiviert.")
         else:
             tg_update.effective_message.reply_text("✅ Plugin ist für diesen Chat schon deaktiviert.")
@@ -175,15 +152,10 @@ class PluginManager(Plugin):
             tg_update.effective_message.reply_text("❌ Dies ist ein Core-Plugin und kann nicht deaktiviert werden.")
             return
 
-        with self.db.engine.begin() as conn:
-            res = conn.execute(
-                    delete(self.db.tables.bot_plugins_chat_blacklist).where(
-                            self.db.tables.bot_plugins_chat_blacklist.c.chat_id == tg_update.effective_message.chat_id,
-                            self.db.tables.bot_plugins_chat_blacklist.c.disabled_plugin == plg_name
-                    )
-            )
+        enabled = self.db.enable_plugin_for_chat(tg_update.effective_message.chat_id, plg_name)
+        self.pluginloader.set_plugin_disabled_for_chat(tg_update.effective_message.chat_id, plg_name, False)
 
-        if res.rowcount:
+        if enabled:
             tg_update.effective_message.reply_text("✅ Plugin wurde für diesen Chat wieder aktiviert.")
         else:
             tg_update.effective_message.reply_text("✅ Plugin ist für diesen Chat nicht deaktiviert.")
@@ -0,0 +1,86 @@
+import html
+from typing import Dict, List
+
+from telegram import Update, BotCommand, ChatAction
+from telegram.constants import MAX_MESSAGE_LENGTH
+from telegram.ext import CallbackContext
+
+from nyanyabot.core.metrics import Histogram
+from nyanyabot.core.nyanyabot import NyaNyaBot
+from nyanyabot.core.plugin import Plugin
+from nyanyabot.core.util import Util
+from nyanyabot.handler.regexhandler import RegexHandler
+
+
+class Stats(Plugin):
+    def __init__(self, nyanyabot_instance: NyaNyaBot):
+        super().__init__(nyanyabot_instance)
+        self.name = "stats"
+        self.handlers = [
+            RegexHandler(rf"^/stats(?:@{self.username})?$", callback=self.show_stats, privileged=True),
+        ]
+        self.commands = [
+            BotCommand("stats", "Zeigt Laufzeit-Statistiken der Plugins an (nur Superuser)"),
+        ]
+        self.metrics = nyanyabot_instance.metrics
+        self.pluginloader = nyanyabot_instance.plugin_loader
+        self.chat_scheduler = nyanyabot_instance.chat_scheduler
+
+    @staticmethod
+    def format_histogram(histogram: Histogram) -> str:
+        average = histogram.sum / histogram.count * 1000 if histogram.count else 0.0
+        return f"{histogram.count}x, Ø {average:.1f} ms, p99 ≤ {histogram.quantile(0.99) * 1000:g} ms"
+
+    @staticmethod
+    def split_text(text: str) -> List[str]:
+        """Splits the text at line breaks into messages Telegram accepts, lines keep their HTML tags closed."""
+        messages = [""]
+        for line in text.splitlines(keepends=True):
+            if messages[-1] and len(messages[-1]) + len(line) > MAX_MESSAGE_LENGTH:
+                messages.append("")
+            messages[-1] += line
+        return messages
+
+    def reply_split(self, tg_update: Update, text: str) -> None:
+        for message in self.split_text(text):
+            tg_update.effective_message.reply_html(message)
+
+    @Util.send_action(ChatAction.TYPING)
+    def show_stats(self, tg_update: Update, context: CallbackContext) -> None:
+        text = "<strong>Updates:</strong>\n"
+        for (_, labels), histogram in sorted(self.metrics.histograms("nyanyabot_update_seconds").items()):
+            text += f"{html.escape(dict(labels)['phase'])}: {self.format_histogram(histogram)}\n"
+
+        plugins: Dict[str, Dict[str, Histogram]] = {}
+        for (_, labels), histogram in self.metrics.histograms("nyanyabot_handler_seconds").items():
+            label_dict = dict(labels)
+            plugins.setdefault(label_dict["plugin"], {})[label_dict["phase"]] = histogram
+
+        text += "\n<strong>Plugins:</strong>\n"
+        if not plugins:
+            text += "<i>Noch keine Daten</i>"
+        for plugin_name, phases in sorted(plugins.items()):
+            text += f"<b>{html.escape(plugin_name)}</b>\n"
+            for phase, histogram in sorted(phases.items()):
+                text += f"  {html.escape(phase)}: {self.format_histogram(histogram)}\n"
+
+        text += "\n<strong>Bulkheads:</strong>\n"
+        for plg in sorted(self.pluginloader.plugins, key=lambda plg: plg.name):
+            if plg.bulkhead:
+                bulkhead_stats = plg.bulkhead.stats()
+                text += (f"<b>{html.escape(plg.name)}</b>: {bulkhead_stats['running']}/{bulkhead_stats['workers']} "
+                         f"aktiv, {bulkhead_stats['queued']} wartend, {bulkhead_stats['rejected']} abgewiesen\n")
+
+        if self.chat_scheduler:
+            scheduler_stats = self.chat_scheduler.stats()
+            text += (f"\n<strong>Chats:</strong>\n"
+                     f"{scheduler_stats['chats']} aktiv, {scheduler_stats['backlog']} wartend, "
+                     f"{scheduler_stats['rejected']} abgewiesen, "
+                     f"Ø {scheduler_stats['average_wait'] * 1000:.1f} ms Wartezeit\n")
+            for chat_id, backlog in self.chat_scheduler.backlogs(5):
+                text += f"<code>{chat_id}</code>: {backlog} wartend\n"
+
+        self.reply_split(tg_update, text)
+
+
+plugin = Stats
@@ -0,0 +1,12 @@
+import pytest
+
+from nyanyabot.core import cooldown, lrucache, outbound
+from tests.util import FakeTime
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch: pytest.MonkeyPatch) -> FakeTime:
+    clock = FakeTime()
+    for module in (cooldown, lrucache, outbound):
+        monkeypatch.setattr(module, "time", clock)
+    return clock
@@ -0,0 +1,130 @@
+import datetime
+from typing import Any, List, Tuple
+
+import pytest
+from telegram import CallbackQuery, Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, User
+from telegram.utils.request import Request
+from telegram.utils.types import JSONDict
+
+from nyanyabot.core.buttoncleaner import ButtonCleaner, CleaningBot
+from tests.util import FakeTime
+
+KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("Button", callback_data="data")]])
+
+
+class StubRequest(Request):
+    """Records the Bot API requests instead of sending them."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.sent: List[Tuple[str, bool]] = []
+
+    def post(self, url: str, data: JSONDict, timeout: Any = None) -> JSONDict:  # type: ignore
+        self.sent.append((url.rsplit("/", 1)[-1], "reply_markup" in data))
+        return {"message_id": 5, "date": 0, "chat": {"id": -100, "type": "group"}}
+
+
+@pytest.fixture(name="request_stub")
+def fixture_request_stub() -> StubRequest:
+    return StubRequest()
+
+
+@pytest.fixture(name="cleaner")
+def fixture_cleaner() -> ButtonCleaner:
+    cleaner = ButtonCleaner(in_flight_timeout=60.0)
+    # Keep the background thread from starting, the tests run the removals themselves
+    cleaner._thread = object()  # type: ignore # pylint: disable=protected-access
+    return cleaner
+
+
+@pytest.fixture(name="bot")
+def fixture_bot(cleaner: ButtonCleaner, request_stub: StubRequest) -> CleaningBot:
+    return CleaningBot("123:token", request=request_stub, button_cleaner=cleaner)
+
+
+def make_query(bot: CleaningBot) -> CallbackQuery:
+    message = Message(5, datetime.datetime.now(), Chat(-100, Chat.GROUP), bot=bot)
+    return CallbackQuery("1", User(1, "User", False), "instance", message=message, data="data", bot=bot)
+
+
+def run_removal(cleaner: ButtonCleaner) -> None:
+    cleaner._remove(cleaner._queue.get_nowait())  # pylint: disable=protected-access
+
+
+def test_double_press_is_ignored_until_callback_returns(bot: CleaningBot, cleaner: ButtonCleaner) -> None:
+    query = make_query(bot)
+    assert cleaner.begin(query)
+    assert not cleaner.begin(make_query(bot))
+    cleaner.end(query)
+    assert cleaner.begin(make_query(bot))
+    assert cleaner.duplicates == 1
+
+
+def test_edit_before_removal_cancels_it(bot: CleaningBot, cleaner: ButtonCleaner,
+                                        request_stub: StubRequest) -> None:
+    query = make_query(bot)
+    cleaner.begin(query)
+    cleaner.remove_buttons(query)
+    bot.edit_message_text("Edited", chat_id=-100, message_id=5, reply_markup=KEYBOARD)
+    run_removal(cleaner)
+    cleaner.end(query)
+
+    assert request_stub.sent == [("editMessageText", True)]
+    assert cleaner.merged == 1
+    assert cleaner.begin(make_query(bot))  # The new buttons may be pressed
+
+
+def test_removed_buttons_stay_in_flight_until_timeout(bot: CleaningBot, cleaner: ButtonCleaner,
+                                                      request_stub: StubRequest, clock: FakeTime) -> None:
+    query = make_query(bot)
+    cleaner.begin(query)
+    cleaner.remove_buttons(query)
+    run_removal(cleaner)
+    cleaner.end(query)
+
+    assert request_stub.sent == [("editMessageReplyMarkup", False)]
+    assert not cleaner.begin(make_query(bot))  # Only stale presses of the removed buttons can follow
+    clock.now += 60.0
+    assert cleaner.begin(make_query(bot))
+
+
+def test_edit_after_removal_releases_the_press(bot: CleaningBot, cleaner: ButtonCleaner,
+                                               request_stub: StubRequest) -> None:
+    query = make_query(bot)
+    cleaner.begin(query)
+    cleaner.remove_buttons(query)
+    run_removal(cleaner)
+    assert query.message is not None
+    query.message.edit_reply_markup(reply_markup=KEYBOARD)
+    cleaner.end(query)
+
+    assert request_stub.sent == [("editMessageReplyMarkup", False), ("editMessageReplyMarkup", True)]
+    assert cleaner.begin(make_query(bot))
+
+
+def test_press_stays_in_flight_while_removal_is_pending(bot: CleaningBot, cleaner: ButtonCleaner) -> None:
+    query = make_query(bot)
+    cleaner.begin(query)
+    cleaner.remove_buttons(query)
+    cleaner.end(query)
+    assert not cleaner.begin(make_query(bot))  # The removal is still pending
+
+    run_removal(cleaner)
+    bot.delete_message(-100, 5)  # Deleting the message releases the press like an edit
+    assert cleaner.begin(make_query(bot))
+
+
+def test_failed_removal_releases_the_press(bot: CleaningBot, cleaner: ButtonCleaner,
+                                           request_stub: StubRequest, monkeypatch: pytest.MonkeyPatch) -> None:
+    def fail(*_: Any, **__: Any) -> None:
+        raise RuntimeError("Network down")
+
+    monkeypatch.setattr(request_stub, "post", fail)
+    query = make_query(bot)
+    cleaner.begin(query)
+    cleaner.remove_buttons(query)
+    cleaner.end(query)
+    run_removal(cleaner)
+
+    assert cleaner.failed == 1
+    assert cleaner.begin(make_query(bot))
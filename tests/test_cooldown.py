@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+from nyanyabot.core.cooldown import Cooldown, CooldownStore
+from tests.util import FakeTime
+
+
+def make_update(user_id: int, chat_id: int = -100) -> Update:
+    user = User(user_id, "User", False)
+    return Update(1, message=Message(1, datetime.datetime.now(), Chat(chat_id, Chat.SUPERGROUP), from_user=user))
+
+
+def test_cooldown_of() -> None:
+    cooldown = Cooldown(5.0, limit=2)
+    assert Cooldown.of(cooldown) is cooldown
+    assert Cooldown.of(0) is None
+    assert Cooldown.of(None) is None
+    assert repr(Cooldown.of(3.0)) == "Cooldown(3.0, limit=1, per_chat=False)"
+    with pytest.raises(ValueError):
+        Cooldown(0)
+
+
+def test_sliding_window(clock: FakeTime) -> None:
+    store = CooldownStore()
+    cooldown = Cooldown(10.0, limit=2)
+    update = make_update(1)
+
+    assert store.hit("plugin", update, cooldown) == 0.0
+    clock.now += 4.0
+    assert store.hit("plugin", update, cooldown) == 0.0
+    clock.now += 1.0
+    assert store.hit("plugin", update, cooldown) == pytest.approx(5.0)
+
+    clock.now += 5.0  # The first use left the window
+    assert store.hit("plugin", update, cooldown) == 0.0
+    assert store.hit("plugin", update, cooldown) == pytest.approx(4.0)
+    assert (store.allowed, store.rejected) == (3, 2)
+
+
+def test_rejected_uses_are_not_recorded(clock: FakeTime) -> None:
+    store = CooldownStore()
+    cooldown = Cooldown(10.0)
+    update = make_update(1)
+
+    assert store.hit("plugin", update, cooldown) == 0.0
+    for _ in range(5):
+        clock.now += 1.0
+        assert store.hit("plugin", update, cooldown) > 0
+    clock.now += 5.0
+    assert store.hit("plugin", update, cooldown) == 0.0
+
+
+def test_windows_are_per_user_plugin_and_cooldown() -> None:
+    store = CooldownStore()
+    cooldown = Cooldown(10.0)
+
+    assert store.hit("plugin", make_update(1), cooldown) == 0.0
+    assert store.hit("plugin", make_update(2), cooldown) == 0.0
+    assert store.hit("plugin", make_update(1, chat_id=-200), cooldown) == 0.0
+    assert store.hit("other", make_update(1), cooldown) == 0.0
+    assert store.hit("plugin", make_update(1), Cooldown(20.0)) == 0.0
+    assert store.hit("plugin", make_update(1), cooldown) > 0
+
+
+def test_per_chat_windows_are_shared_by_users() -> None:
+    store = CooldownStore()
+    cooldown = Cooldown(10.0, per_chat=True)
+
+    assert store.hit("plugin", make_update(1), cooldown) == 0.0
+    assert store.hit("plugin", make_update(2), cooldown) > 0
+    assert store.hit("plugin", make_update(2, chat_id=-200), cooldown) == 0.0
+
+
+def test_expired_windows_are_purged(clock: FakeTime) -> None:
+    store = CooldownStore(purge_interval=30.0)
+    cooldown = Cooldown(10.0)
+    for user_id in range(5):
+        store.hit("plugin", make_update(user_id), cooldown)
+    assert store.stats()["tracked"] == 5
+
+    clock.now += 30.0
+    store.hit("plugin", make_update(99), cooldown)
+    assert store.stats()["tracked"] == 1
+    assert store.stats()["expirations"] == 5
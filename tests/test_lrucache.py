@@ -0,0 +1,62 @@
+from nyanyabot.core.lrucache import LRUCache
+from tests.util import FakeTime
+
+
+def test_evicts_least_recently_used() -> None:
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used entry
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_put_refreshes_existing_key() -> None:
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 3)
+    cache.put("c", 4)
+
+    assert cache.get("a") == 3
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+
+def test_entries_expire(clock: FakeTime) -> None:
+    cache = LRUCache(max_size=10, ttl=5.0)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=0)  # Never expires
+
+    clock.now += 4.9
+    assert cache.get("a") == 1
+    clock.now += 0.2
+    assert cache.get("a", "default") == "default"
+    assert cache.get("b") == 2
+    assert cache.expirations == 1
+
+
+def test_purge_expired(clock: FakeTime) -> None:
+    cache = LRUCache(max_size=10)
+    cache.put("a", 1, ttl=1.0)
+    cache.put("b", 2, ttl=10.0)
+
+    clock.now += 5.0
+    assert cache.purge_expired() == 1
+    assert len(cache) == 1
+    assert cache.get("b") == 2
+
+
+def test_pop_and_stats() -> None:
+    cache = LRUCache(max_size=10)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("missing") is None
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "default") == "default"
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1, "hit_rate": 0.5, "evictions": 0, "expirations": 0}
@@ -0,0 +1,114 @@
+import threading
+from typing import Any, Iterator, List, Tuple
+
+import pytest
+
+from nyanyabot.database.membershipsync import MembershipSync
+
+
+class FakeBookkeeping:
+    """Records the calls MembershipSync makes to the WriteBehindQueue."""
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[Any, ...]] = []
+        self.committed = threading.Event()
+
+    def save_user(self, user_id: int, *_: Any) -> None:
+        self.calls.append(("save_user", user_id))
+
+    def add_member(self, chat_id: int, user_id: int) -> None:
+        self.calls.append(("add_member", chat_id, user_id))
+
+    def remove_member(self, chat_id: int, user_id: int) -> None:
+        self.calls.append(("remove_member", chat_id, user_id))
+
+    def commit(self) -> None:
+        self.calls.append(("commit",))
+        self.committed.set()
+
+
+@pytest.fixture(name="bookkeeping")
+def fixture_bookkeeping() -> FakeBookkeeping:
+    return FakeBookkeeping()
+
+
+@pytest.fixture(name="sync")
+def fixture_sync(bookkeeping: FakeBookkeeping) -> Iterator[MembershipSync]:
+    sync = MembershipSync(bookkeeping, window=60.0)  # type: ignore
+    sync.start()
+    yield sync
+    sync.stop()
+
+
+def test_latest_event_per_member_wins(sync: MembershipSync, bookkeeping: FakeBookkeeping) -> None:
+    sync.join(-100, 1, "One", None, None)
+    sync.leave(-100, 1)
+    sync.leave(-100, 2)
+    sync.join(-100, 2, "Two", None, None)
+    assert bookkeeping.calls == []
+
+    sync.flush(everything=True)
+    assert bookkeeping.calls == [
+        ("remove_member", -100, 1),
+        ("save_user", 2),
+        ("add_member", -100, 2),
+        ("commit",),
+    ]
+    assert (sync.events, sync.events_merged, sync.depth) == (4, 2, 0)
+
+
+def test_merged_events_move_to_the_end(sync: MembershipSync, bookkeeping: FakeBookkeeping) -> None:
+    sync.join(-100, 1, "One", None, None)
+    sync.join(-100, 2, "Two", None, None)
+    sync.leave(-100, 3)
+    sync.leave(-100, 1)
+
+    sync.flush(everything=True)
+    assert bookkeeping.calls == [
+        ("save_user", 2),
+        ("add_member", -100, 2),
+        ("remove_member", -100, 3),
+        ("remove_member", -100, 1),
+        ("commit",),
+    ]
+
+
+def test_chats_are_batched_separately(sync: MembershipSync, bookkeeping: FakeBookkeeping) -> None:
+    sync.leave(-100, 1)
+    sync.leave(-200, 1)
+    sync.leave(-100, 2)
+
+    sync.flush(everything=True)
+    assert bookkeeping.calls == [
+        ("remove_member", -100, 1),
+        ("remove_member", -100, 2),
+        ("remove_member", -200, 1),
+        ("commit",),
+    ]
+    assert (sync.batches, sync.largest_batch) == (1, 3)
+
+
+def test_full_batch_is_handed_over_early(bookkeeping: FakeBookkeeping) -> None:
+    sync = MembershipSync(bookkeeping, window=60.0, batch_size=2)  # type: ignore
+    sync.start()
+    try:
+        sync.leave(-100, 1)
+        sync.leave(-100, 2)
+        assert bookkeeping.committed.wait(5.0)
+        assert bookkeeping.calls[:2] == [("remove_member", -100, 1), ("remove_member", -100, 2)]
+    finally:
+        sync.stop()
+
+
+def test_without_window_events_are_handed_over_immediately(bookkeeping: FakeBookkeeping) -> None:
+    sync = MembershipSync(bookkeeping, window=0)  # type: ignore
+    sync.join(-100, 1, "One", None, None)
+    assert bookkeeping.calls == [("save_user", 1), ("add_member", -100, 1), ("commit",)]
+
+
+def test_stop_hands_over_pending_events(bookkeeping: FakeBookkeeping) -> None:
+    sync = MembershipSync(bookkeeping, window=60.0)  # type: ignore
+    sync.start()
+    sync.leave(-100, 1)
+    sync.stop()
+    assert bookkeeping.calls == [("remove_member", -100, 1), ("commit",)]
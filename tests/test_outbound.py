@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import List
+
+import pytest
+from telegram import TelegramError
+
+from nyanyabot.core.outbound import OutboundScheduler, Priority, TokenBucket
+from tests.util import FakeTime
+
+
+def test_bucket_allows_burst_then_refills(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.delay() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.delay() == 0.0
+    clock.now += 10.0
+    bucket.delay()
+    assert bucket.tokens == 3  # Capped at the capacity
+
+
+def test_bucket_reservations_queue_up(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=1.0, capacity=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+
+    clock.now += 1.0
+    assert bucket.delay() == pytest.approx(2.0)  # The first two reservations are still outstanding
+
+
+def test_bucket_pause(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=10.0, capacity=10)
+    bucket.pause(5.0)
+    assert bucket.delay() == pytest.approx(5.0)
+    bucket.pause(1.0)  # Shorter pauses don't shorten a running one
+    assert bucket.delay() == pytest.approx(5.0)
+
+    clock.now += 5.0
+    assert bucket.delay() == 0.0
+
+
+def test_classify() -> None:
+    scheduler = OutboundScheduler()
+    assert scheduler.classify("getMe") is None
+    assert scheduler.classify("sendChatAction") is None
+    assert scheduler.classify("answerCallbackQuery") == Priority.HIGH
+    assert scheduler.classify("sendMessage") == Priority.NORMAL
+    with scheduler.priority(Priority.LOW):
+        assert scheduler.classify("sendMessage") == Priority.LOW
+        assert scheduler.classify("answerInlineQuery") == Priority.HIGH
+    assert scheduler.classify("editMessageText") == Priority.NORMAL
+
+
+def record_order(bucket: TokenBucket) -> List[str]:
+    """Records the names of the threads in the order they take a token of the bucket."""
+    order: List[str] = []
+    reserve = bucket.reserve
+
+    def recording_reserve() -> float:
+        order.append(threading.current_thread().name)
+        return reserve()
+
+    bucket.reserve = recording_reserve  # type: ignore
+    return order
+
+
+def start_waiting(scheduler: OutboundScheduler, chat_id: object, priorities: List[Priority]) -> List[threading.Thread]:
+    threads = []
+    for priority in priorities:
+        thread = threading.Thread(target=scheduler.acquire, args=(chat_id, priority), name=priority.name)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)  # Keep the arrival order deterministic
+    return threads
+
+
+def test_global_queue_is_served_by_priority() -> None:
+    scheduler = OutboundScheduler(global_rate=100.0)
+    order = record_order(scheduler._global)  # pylint: disable=protected-access
+    scheduler.flood_wait(None, 0.3)
+
+    threads = start_waiting(scheduler, None, [Priority.LOW, Priority.NORMAL, Priority.LOW, Priority.HIGH])
+    for thread in threads:
+        thread.join(5.0)
+
+    assert order == ["HIGH", "NORMAL", "LOW", "LOW"]
+    assert scheduler.sent == 4
+
+
+def test_chat_queue_is_served_by_priority() -> None:
+    scheduler = OutboundScheduler(chat_rate=100.0, chat_burst=10)
+    scheduler.flood_wait(42, 0.3)
+    order = record_order(scheduler._chat_bucket(42))  # pylint: disable=protected-access
+
+    threads = start_waiting(scheduler, 42, [Priority.NORMAL, Priority.LOW, Priority.HIGH, Priority.NORMAL])
+    for thread in threads:
+        thread.join(5.0)
+
+    assert order == ["HIGH", "NORMAL", "NORMAL", "LOW"]
+
+
+def test_max_delay_drops_all_but_high_priority() -> None:
+    scheduler = OutboundScheduler(chat_rate=1.0, chat_burst=1, max_delay=0.2)
+    scheduler.acquire(1, Priority.NORMAL)
+
+    with pytest.raises(TelegramError):
+        scheduler.acquire(1, Priority.NORMAL)
+    assert scheduler.dropped == 1
+
+    start = time.monotonic()
+    scheduler.acquire(1, Priority.HIGH)
+    assert time.monotonic() - start > 0.5
@@ -0,0 +1,35 @@
+import re
+
+import pytest
+
+from nyanyabot.core.patterns import literal_prefix
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    (r"^/start(?:@bot)?$", ("/start", "/start", False)),
+    (r"\A/help", ("/help", "/help", False)),
+    (r"^hello world$", ("hello world", "hello world", False)),
+    (r"^(?:hi|yo)", (None, None, False)),
+    (r"^(?:hi|hello)", ("h", "h", False)),  # The parser factors out the common prefix
+    (r"^a.bcd", ("a", "bcd", False)),
+    (r"foo\d+barbaz", (None, "barbaz", False)),
+    (r"^\d+", (None, None, False)),
+    (r"", (None, None, False)),
+])
+def test_literal_prefix(pattern: str, expected: tuple) -> None:
+    assert literal_prefix(re.compile(pattern)) == expected
+
+
+def test_multiline_caret_is_not_an_anchor() -> None:
+    assert literal_prefix(re.compile(r"^/start", re.MULTILINE)) == (None, "/start", False)
+
+
+def test_ignore_case_lowercases_literals() -> None:
+    assert literal_prefix(re.compile(r"^/Start", re.IGNORECASE)) == ("/start", "/start", True)
+    assert literal_prefix(re.compile(r"(?i)^Hello")) == ("hello", "hello", True)
+
+
+def test_ignore_case_skips_non_ascii_literals() -> None:
+    # Non-ASCII characters may match differently-sized characters when lowercased
+    assert literal_prefix(re.compile(r"^straße", re.IGNORECASE)) == (None, None, True)
+    assert literal_prefix(re.compile(r"^ab.straße", re.IGNORECASE)) == ("ab", "ab", True)
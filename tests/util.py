@@ -0,0 +1,8 @@
+class FakeTime:
+    """Replaces the time module of the tested modules, so their clock only moves when a test advances it."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now